@@ -1,7 +1,10 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 from typing import Dict, Any, List
 from dotenv import load_dotenv
+import json
 import logging
 
 # 配置日志
@@ -12,7 +15,9 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # 导入我们真实的工具执行器
-from tools.tool_registry import execute_tool, tool_instances, initialize_tools, cleanup_tools
+from tools.tool_registry import execute_tool, execute_tool_stream, tool_instances, initialize_tools, cleanup_tools
+from tools.metrics import metrics
+from tools.stockfish_tool import StockfishTool, StreamCommand
 
 app = FastAPI(
     title="Python Tool Server & Documentation Gateway",
@@ -44,33 +49,40 @@ TOOLS_CATALOG = [
       "title": "TavilySearchInput",
       "type": "object",
       "properties": {
-        "query": { "title": "Query", "type": "string", "description": "The search query to execute." }
-      },
-      "required": ["query"]
+        "query": { "title": "Query", "type": "string", "description": "The search query to execute." },
+        "queries": { "title": "Queries", "type": "array", "items": { "type": "string" }, "description": "Several queries to run concurrently instead of 'query'; results are merged, deduplicated by URL, and each result lists the queries that found it under 'sources'." },
+        "search_depth": { "title": "Search Depth", "type": "string", "enum": ["basic", "advanced"], "default": "advanced" },
+        "max_results": { "title": "Max Results", "type": "integer", "default": 5, "description": "Maximum results per query." },
+        "max_concurrency": { "title": "Max Concurrency", "type": "integer", "description": "How many of 'queries' run at once." }
+      }
     }
   },
   {
     "name": "python_sandbox",
-    "description": "Executes Python code in a secure, isolated Docker environment. This is an external service with its own endpoint.",
+    "description": "Executes Python code in a secure, isolated Docker environment. Open matplotlib figures and files written to /tmp/outputs are returned as base64 artifacts. This is an external service with its own endpoint.",
     "endpoint_url": "https://pythonsandbox.10110531.xyz/api/v1/python_sandbox",
     "input_schema": {
       "title": "CodeInterpreterInput",
       "type": "object",
       "properties": {
-        "code": { "title": "Code", "type": "string", "description": "The Python code to be executed." }
+        "code": { "title": "Code", "type": "string", "description": "The Python code to be executed." },
+        "session_id": { "title": "Session Id", "type": "string", "description": "Optional session id; calls with the same id share variables and imports." },
+        "close_session": { "title": "Close Session", "type": "boolean", "default": False, "description": "Close the session after this execution." },
+        "timeout": { "title": "Timeout", "type": "number", "description": "Wall-clock limit in seconds (default 30, max 300)." },
+        "files": { "title": "Files", "type": "object", "additionalProperties": { "type": "string" }, "description": "Input files as {file name: base64 content}, written to /tmp/inputs/<name>." }
       },
       "required": ["code"]
     }
   },
   {
     "name": "firecrawl",
-    "description": "A powerful tool to scrape, crawl, search, map, or extract structured data from web pages. Modes: 'scrape' for a single URL, 'search' for a web query, 'crawl' for an entire website, 'map' to get all links, 'extract' for AI-powered data extraction, and 'check_status' for async jobs.",
+    "description": "A powerful tool to scrape, crawl, search, map, or extract structured data from web pages. Modes: 'scrape' for a single URL, 'search' for a web query, 'crawl' for an entire website, 'map' to get all links, 'extract' for AI-powered data extraction, 'check_status' for async jobs (answered from the server's job store), 'wait' to long-poll until an async job finishes (parameters: job_id, optional kind 'crawl'|'extract', timeout seconds up to 120), and 'map_and_scrape' to map a site and concurrently scrape the URLs matching include_patterns/exclude_patterns (globs) with a concurrency limit; POST the same body to /api/v1/execute_tool/stream to receive pages as NDJSON as they complete.",
     "endpoint_url": "https://tools.10110531.xyz/api/v1/execute_tool",
     "input_schema": {
       "title": "FirecrawlInput",
       "type": "object",
       "properties": {
-        "mode": { "title": "Mode", "type": "string", "enum": ["scrape", "search", "crawl", "map", "extract", "check_status"], "description": "The function to execute." },
+        "mode": { "title": "Mode", "type": "string", "enum": ["scrape", "search", "crawl", "map", "extract", "check_status", "wait", "map_and_scrape"], "description": "The function to execute." },
         "parameters": { "title": "Parameters", "type": "object", "description": "A dictionary of parameters for the selected mode." }
       },
       "required": ["mode", "parameters"]
@@ -78,25 +90,45 @@ TOOLS_CATALOG = [
   },
   {
     "name": "stockfish_analyzer",
-    "description": "A powerful chess analysis tool using the Stockfish engine. Use different modes to get the best move, top several moves, or a positional evaluation.",
+    "description": "A powerful chess analysis tool using the Stockfish engine. Use different modes to get the best move, top several moves, or a positional evaluation of one position, to analyze a whole game (PGN or FEN list) with per-move evaluations and blunder detection, or to evaluate a batch of positions.",
     "endpoint_url": "https://tools.10110531.xyz/api/v1/execute_tool",
     "input_schema": {
       "title": "StockfishInput",
       "type": "object",
       "properties": {
-        "mode": { "title": "Mode", "type": "string", "enum": ["get_best_move", "get_top_moves", "evaluate_position"], "description": "The analysis mode to execute." },
-        "fen": { "title": "FEN", "type": "string", "description": "The FEN string of the current board position." },
+        "mode": { "title": "Mode", "type": "string", "enum": ["get_best_move", "get_top_moves", "evaluate_position", "analyze_game", "batch"], "description": "The analysis mode to execute." },
+        "fen": { "title": "FEN", "type": "string", "description": "The FEN string of the current board position (single-position modes)." },
+        "pgn": { "title": "PGN", "type": "string", "description": "A PGN game to analyze move by move ('analyze_game' mode)." },
+        "fens": { "title": "FENs", "type": "array", "items": { "type": "string" }, "description": "Consecutive positions of one game for 'analyze_game', or independent positions for 'batch'." },
         "options": {
           "title": "Options",
           "type": "object",
           "properties": {
             "skill_level": { "title": "Skill Level", "type": "integer", "default": 20, "minimum": 0, "maximum": 20 },
-            "depth": { "title": "Depth", "type": "integer", "default": 15, "minimum": 1, "maximum": 30 },
+            "depth": { "title": "Depth", "type": "integer", "minimum": 1, "maximum": 30, "description": "Search depth. Defaults to 15 when neither movetime_ms nor nodes is given." },
+            "movetime_ms": { "title": "Movetime (ms)", "type": "integer", "minimum": 1, "description": "Search time budget; the best result found when it expires is returned." },
+            "nodes": { "title": "Nodes", "type": "integer", "minimum": 1, "description": "Search node budget." },
             "count": { "title": "Count", "type": "integer", "default": 3, "minimum": 1, "maximum": 10 }
           }
         }
       },
-      "required": ["mode", "fen"]
+      "required": ["mode"]
+    }
+  },
+  {
+    "name": "web_scrape",
+    "description": "Scrapes a single URL to markdown using whichever backend (local crawl4ai browser or remote Firecrawl) is fastest for that domain; if the first backend is slower than its usual p90 latency, a hedged request goes to the other and the first successful result wins.",
+    "endpoint_url": "https://tools.10110531.xyz/api/v1/execute_tool",
+    "input_schema": {
+      "title": "WebScrapeInput",
+      "type": "object",
+      "properties": {
+        "url": { "title": "Url", "type": "string", "description": "The URL of the page to scrape to markdown." },
+        "hedge": { "title": "Hedge", "type": "boolean", "default": True, "description": "Send a second request to the other backend if the first is slow." },
+        "prefer": { "title": "Prefer", "type": "string", "enum": ["crawl4ai", "firecrawl"], "description": "Force the first backend." },
+        "timeout": { "title": "Timeout", "type": "number", "default": 120, "description": "Overall time limit in seconds." }
+      },
+      "required": ["url"]
     }
   },
   {
@@ -145,6 +177,13 @@ async def get_tool_documentation():
     """
     return TOOLS_CATALOG
 
+@app.get("/api/v1/metrics", summary="Get In-Process Tool Metrics")
+async def get_metrics():
+    """
+    Returns counters and latency histograms collected by the tools in this worker process.
+    """
+    return metrics.snapshot()
+
 @app.post("/api/v1/execute_tool")
 async def api_execute_tool(request: ToolExecutionRequest):
     """
@@ -172,5 +211,73 @@ async def api_execute_tool(request: ToolExecutionRequest):
         logger.error(f"Unexpected error in tool execution: {str(e)}")
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+@app.post("/api/v1/execute_tool/stream")
+async def api_execute_tool_stream(request: ToolExecutionRequest):
+    """
+    Executes a tool and streams its events as newline-delimited JSON (application/x-ndjson).
+    Tools with incremental output (e.g. firecrawl 'map_and_scrape') emit one line per event as it happens;
+    other tools (including python_sandbox, whose stdout/stderr stream is served by the sandbox service) emit a
+    single line. The last line is always {"type": "done", "success": ...}.
+    """
+    try:
+        events = execute_tool_stream(request.tool_name, request.parameters)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    # 输入校验错误在开始流式响应之前返回 400
+    first = await events.__anext__()
+    if first.get("type") == "done" and first.get("success") is False and "details" in first:
+        raise HTTPException(status_code=400, detail=first)
+
+    async def body():
+        # 与普通响应一样用 jsonable_encoder 序列化（SDK 返回的 pydantic 对象等）
+        yield json.dumps(jsonable_encoder(first)) + "\n"
+        async for event in events:
+            yield json.dumps(jsonable_encoder(event)) + "\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.websocket("/api/v1/stockfish/analysis")
+async def stockfish_analysis_stream(websocket: WebSocket):
+    """
+    Interactive infinite analysis. The session holds one pooled Stockfish engine until the socket closes.
+    Send {"type": "position", "fen": ..., "moves": [...], "multipv": N} to (re)start analysis and
+    {"type": "stop"} to pause; the server streams {"type": "info"} updates per depth and a
+    {"type": "bestmove"} message whenever a search ends.
+    """
+    await websocket.accept()
+    tool = tool_instances.get(StockfishTool.name)
+    if tool is None:
+        await websocket.send_json({"type": "error", "error": "stockfish_analyzer is not available."})
+        await websocket.close(code=1011)
+        return
+
+    stream = tool.open_stream(websocket.send_json)
+    try:
+        await stream.attach()
+    except Exception as e:
+        await websocket.send_json({"type": "error", "error": f"Stockfish busy: {e}"})
+        await websocket.close(code=1013)
+        return
+
+    try:
+        await websocket.send_json({"type": "ready"})
+        while True:
+            message = await websocket.receive_text()
+            try:
+                command = StreamCommand(**json.loads(message))
+            except (ValueError, TypeError, ValidationError) as e:
+                await stream.emit({"type": "error", "error": f"Invalid command: {e}"})
+                continue
+            if command.type == "position":
+                await stream.set_position(command)
+            else:
+                await stream.stop()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # 断开时停止搜索并把引擎归还给池
+        await stream.close()
+
 # To run this server, you would use a command like:
 # uvicorn main:app --host 0.0.0.0 --port 8827 --reload
\ No newline at end of file
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# Tool modules read their settings from the environment at import time
+os.environ.setdefault("TAVILY_API_KEY", "test-key")
+os.environ.setdefault("TAVILY_HTTP2", "false")
+os.environ.setdefault("TAVILY_RATE_LIMIT", "0")
+os.environ.setdefault("RETRY_MAX_ATTEMPTS", "3")
+os.environ.setdefault("RETRY_BASE_DELAY", "0.05")
+os.environ.setdefault("RATE_LIMIT_DIR", tempfile.mkdtemp(prefix="rate_limits_"))
+os.environ.setdefault("STOCKFISH_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_uci_engine.py"))
+os.environ.setdefault("STOCKFISH_POOL_SIZE", "2")
+os.environ.setdefault("STOCKFISH_STREAM_INTERVAL", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
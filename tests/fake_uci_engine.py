@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+A minimal UCI engine for tests. Like Stockfish it ignores 'stop' when no search is running;
+'go infinite' emits one info line per depth every few milliseconds until 'stop'.
+"""
+
+import sys
+import threading
+import time
+
+lock = threading.Lock()
+search = None
+
+
+def emit(line):
+    with lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+class Search(threading.Thread):
+    def __init__(self, max_depth):
+        super().__init__(daemon=True)
+        self.max_depth = max_depth
+        self.stopped = threading.Event()
+
+    def run(self):
+        depth = 0
+        while not self.stopped.is_set() and (self.max_depth is None or depth < self.max_depth):
+            depth += 1
+            emit(f"info depth {depth} seldepth {depth} multipv 1 score cp 20 nodes {depth * 1000} "
+                 f"nps 1000000 time {depth} pv e2e4 e7e5")
+            time.sleep(0.005)
+        if self.max_depth is None:
+            self.stopped.wait()
+        emit("bestmove e2e4 ponder e7e5")
+
+
+for raw in sys.stdin:
+    command = raw.split()
+    if not command:
+        continue
+    if command[0] == "uci":
+        emit("id name FakeFish")
+        emit("uciok")
+    elif command[0] == "isready":
+        emit("readyok")
+    elif command[0] == "go":
+        max_depth = None if "infinite" in command else int(command[command.index("depth") + 1]) if "depth" in command else 5
+        search = Search(max_depth)
+        search.start()
+    elif command[0] == "stop":
+        if search is not None and search.is_alive():
+            search.stopped.set()
+            search.join()
+        search = None
+    elif command[0] == "quit":
+        break
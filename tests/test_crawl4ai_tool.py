@@ -0,0 +1,94 @@
+"""
+EnhancedCrawl4AITool.stream with a fake browser: the batch iterator is replaced by one that the test
+releases page by page, so two streams can be held open at the same time.
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("crawl4ai")
+pytest.importorskip("psutil")
+
+from tools.crawl4ai_tool_all import Crawl4AIInput, EnhancedCrawl4AITool
+
+
+class FakePage:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.open_pages = [FakePage()]  # about:blank
+
+    def is_connected(self):
+        return True
+
+    async def pages(self):
+        return [page for page in self.open_pages if not page.closed]
+
+
+class FakeCrawler:
+    def __init__(self):
+        self.browser = FakeBrowser()
+
+
+def make_tool():
+    tool = EnhancedCrawl4AITool()
+    tool.crawler = FakeCrawler()
+    tool._initialized = True
+    tool._cleanup_interval = 10_000  # 不触发内存检查
+    releases = {}
+
+    async def fake_iter_batch(urls, params):
+        for url in urls:
+            # 每个 URL 在浏览器里占用一个页面，直到测试放行
+            page = FakePage()
+            tool.crawler.browser.open_pages.append(page)
+            await releases[url].wait()
+            yield {"url": url, "success": True, "page_open": not page.closed}
+
+    tool._iter_batch = fake_iter_batch
+    return tool, releases
+
+
+def batch(url):
+    return Crawl4AIInput(mode="batch_crawl", parameters={"urls": [url]})
+
+
+async def collect(tool, url):
+    return [event async for event in tool.stream(batch(url))]
+
+
+def test_finishing_stream_does_not_close_pages_of_overlapping_stream():
+    async def main():
+        tool, releases = make_tool()
+        releases["https://a.example/"] = asyncio.Event()
+        releases["https://b.example/"] = asyncio.Event()
+
+        first = asyncio.create_task(collect(tool, "https://a.example/"))
+        second = asyncio.create_task(collect(tool, "https://b.example/"))
+        await asyncio.sleep(0.01)
+        assert tool._running == 2
+
+        releases["https://a.example/"].set()
+        first_events = await first
+        assert first_events[-1]["type"] == "done" and first_events[-1]["success"]
+        # 第一个流结束时第二个流仍在运行，它的页面必须保持打开
+        second_page = tool.crawler.browser.open_pages[2]
+        assert not second_page.closed
+        assert tool._running == 1
+
+        releases["https://b.example/"].set()
+        second_events = await second
+        assert second_events[0]["page_open"]
+        assert tool._running == 0
+        # 最后一个任务结束后才清理多余页面，about:blank 保留
+        assert second_page.closed
+        assert not tool.crawler.browser.open_pages[0].closed
+
+    asyncio.run(main())
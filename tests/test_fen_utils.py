@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("chess")
+
+from tools.fen_utils import normalize_fen, validate_fen
+
+START = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+
+def test_normalize_keeps_halfmove_clock_and_drops_fullmove_number():
+    assert normalize_fen("8/8/4k3/8/8/4K3/4R3/8 w - - 0 1") == "8/8/4k3/8/8/4K3/4R3/8 w - - 0 1"
+    assert normalize_fen("8/8/4k3/8/8/4K3/4R3/8 w - - 37 80") == "8/8/4k3/8/8/4K3/4R3/8 w - - 37 1"
+    assert normalize_fen("8/8/4k3/8/8/4K3/4R3/8 w - - 49 1") != normalize_fen("8/8/4k3/8/8/4K3/4R3/8 w - - 0 1")
+
+
+def test_normalize_drops_castling_rights_without_king_and_rook_in_place():
+    # 白方 h1 车已离开、黑方王已离开 e8
+    fen = "r3k2r/8/8/8/8/8/8/R3K1R1 w KQkq - 0 1"
+    assert normalize_fen(fen).split()[2] == "Qkq"
+    fen = "r2k3r/8/8/8/8/8/8/R3K2R b KQkq - 0 1"
+    assert normalize_fen(fen).split()[2] == "KQ"
+    assert normalize_fen("4k3/8/8/8/8/8/8/4K3 w KQkq - 0 1").split()[2] == "-"
+    # 顺序统一为 KQkq
+    assert normalize_fen("r3k2r/8/8/8/8/8/8/R3K2R w qkQK - 0 1").split()[2] == "KQkq"
+
+
+def test_normalize_drops_en_passant_square_without_capturer():
+    # 1. e4 之后黑方没有能吃过路兵的兵
+    after_e4 = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+    assert normalize_fen(after_e4).split()[3] == "-"
+    # 黑兵在 d4，可以吃 e3 过路兵
+    capturable = "rnbqkbnr/ppp1pppp/8/8/3pP3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 3"
+    assert normalize_fen(capturable).split()[3] == "e3"
+
+
+def test_normalize_is_idempotent():
+    fen = "r3k2r/8/8/8/8/8/8/R3K1R1 w KQkq - 12 40"
+    assert normalize_fen(normalize_fen(fen)) == normalize_fen(fen)
+
+
+def test_validate_strips_whitespace_and_accepts_start_position():
+    assert validate_fen("  " + START.replace(" ", "   ") + " ") == START
+
+
+@pytest.mark.parametrize("fen", [
+    "4k3/8/8/8/8/8/8/4R1K1 w - - 0 1",                      # 非走棋方被将军
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQ1BNR w kq - 0 1",  # 白方没有王
+    "P3k3/8/8/8/8/8/8/4K3 w - - 0 1",                       # 兵在底线
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBN w KQkq - 0 1",  # 一行只有 7 格
+    "not a fen",
+])
+def test_validate_rejects_illegal_positions(fen):
+    with pytest.raises(ValueError):
+        validate_fen(fen)
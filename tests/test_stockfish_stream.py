@@ -0,0 +1,72 @@
+"""
+AnalysisStream against tests/fake_uci_engine.py (configured as STOCKFISH_PATH in conftest).
+"""
+
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("chess")
+pytest.importorskip("pydantic")
+
+from tools.stockfish_tool import StockfishTool, StreamCommand
+
+START = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+
+def run_with_stream(scenario):
+    async def main():
+        tool = StockfishTool()
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        stream = tool.open_stream(send)
+        await stream.attach()
+        try:
+            return await scenario(tool, stream, sent)
+        finally:
+            await stream.close()
+            await tool.cleanup()
+    return asyncio.run(main())
+
+
+def test_back_to_back_positions_stop_the_first_search():
+    async def scenario(tool, stream, sent):
+        engine = stream.pooled
+        started = time.monotonic()
+        # 与 receive_text() 已有排队消息时一样，两条 position 之间没有其他 await
+        await stream.set_position(StreamCommand(type="position", fen=START))
+        await stream.set_position(StreamCommand(type="position", fen=START, moves=["e2e4"]))
+        assert time.monotonic() - started < 2.0
+        assert stream.pooled is engine and stream._healthy
+
+        await asyncio.sleep(0.1)
+        await stream.stop()
+        bestmoves = [m for m in sent if m["type"] == "bestmove"]
+        assert len(bestmoves) == 2
+        assert bestmoves[0]["fen"] == START
+        assert not any(m["type"] == "error" for m in sent)
+        assert any(m["type"] == "info" and m["fen"] != START for m in sent)
+
+    run_with_stream(scenario)
+
+
+def test_cancelled_timed_analysis_leaves_no_reader():
+    async def scenario(tool, stream, sent):
+        engine = stream.pooled.engine
+        task = asyncio.create_task(engine.analyse(START, infinite=True, timeout=30))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        readers = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()
+                   and getattr(t.get_coro(), "__name__", "") == "_read_search"]
+        assert readers == []
+        # 引擎仍在搜索：把它作为不健康的引擎归还
+        stream._healthy = False
+
+    run_with_stream(scenario)
@@ -0,0 +1,226 @@
+"""
+tavily_search against a local stub of the Tavily /search endpoint.
+
+The stub is a real HTTP/1.1 server so that keep-alive reuse, timeouts and concurrency are exercised
+through the tool's pooled client. The query string controls the stub's behaviour:
+"slow <seconds>", "status <code>" and "flaky429 <n>" (429 for the first n calls); anything else
+returns two results after a short delay.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tools import tavily_search
+from tools.rate_limiter import RETRY_MAX_ATTEMPTS
+from tools.tavily_search import TavilySearchInput, TavilySearchTool
+
+RESPONSE_DELAY = 0.2
+
+
+class StubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = []
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.attempts = {}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        query = body["query"]
+        state = self.state
+        with state.lock:
+            state.calls.append((query, self.headers.get("Authorization")))
+            state.active += 1
+            state.max_active = max(state.max_active, state.active)
+            attempt = state.attempts[query] = state.attempts.get(query, 0) + 1
+        try:
+            command, _, arg = query.partition(" ")
+            if command == "slow":
+                time.sleep(float(arg))
+                self._reply(200, {"query": query, "results": []})
+            elif command == "status":
+                self._reply(int(arg), {"detail": {"error": f"stub error {arg}"}}, retry_after="0.1")
+            elif command == "flaky429" and attempt <= int(arg):
+                self._reply(429, {"detail": {"error": "rate limited"}}, retry_after="0.1")
+            else:
+                time.sleep(RESPONSE_DELAY)
+                self._reply(200, {
+                    "query": query,
+                    "results": [
+                        {"title": f"{query} {i}", "url": f"https://example.com/{i}", "content": "c", "score": 0.9 - i / 10}
+                        for i in range(2)
+                    ],
+                })
+        finally:
+            with state.lock:
+                state.active -= 1
+
+    def _reply(self, status, payload, retry_after=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        if status == 429 and retry_after:
+            self.send_header("Retry-After", retry_after)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture(scope="module")
+def stub_server():
+    StubHandler.state = StubState()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stub(stub_server, monkeypatch):
+    StubHandler.state.reset()
+    monkeypatch.setattr(tavily_search, "TAVILY_BASE_URL", f"http://127.0.0.1:{stub_server.server_port}")
+    return StubHandler.state
+
+
+def run_with_tool(scenario):
+    """Run `scenario(tool)` on a fresh tool (own client, cache and in-flight table) and close it afterwards."""
+    async def main():
+        tool = TavilySearchTool()
+        try:
+            return await scenario(tool)
+        finally:
+            await tool.cleanup()
+    return asyncio.run(main())
+
+
+def test_search_returns_results_and_sends_api_key(stub):
+    async def scenario(tool):
+        return await tool.execute(TavilySearchInput(query="python asyncio"))
+
+    result = run_with_tool(scenario)
+    assert result["success"] is True
+    assert result["cache"] == "miss"
+    assert len(result["data"]["results"]) == 2
+    assert stub.calls == [("python asyncio", "Bearer test-key")]
+
+
+def test_sequential_requests_reuse_one_pooled_connection(stub):
+    async def scenario(tool):
+        for i in range(3):
+            assert (await tool.execute(TavilySearchInput(query=f"reuse {i}")))["success"]
+
+    run_with_tool(scenario)
+    assert len(stub.calls) == 3
+    assert stub.connections == 1
+
+
+def test_concurrent_requests_overlap(stub):
+    async def scenario(tool):
+        started = time.monotonic()
+        results = await asyncio.gather(*(tool.execute(TavilySearchInput(query=f"overlap {i}")) for i in range(5)))
+        return results, time.monotonic() - started
+
+    results, elapsed = run_with_tool(scenario)
+    assert all(r["success"] for r in results)
+    assert stub.max_active > 1
+    assert elapsed < 5 * RESPONSE_DELAY
+
+
+def test_read_timeout_is_reported_and_not_retried(stub, monkeypatch):
+    monkeypatch.setattr(tavily_search, "TAVILY_TIMEOUT", 0.2)
+
+    async def scenario(tool):
+        return await tool.execute(TavilySearchInput(query="slow 1"))
+
+    result = run_with_tool(scenario)
+    assert result["success"] is False
+    assert "timed out" in result["error"]
+    assert len(stub.calls) == 1
+
+
+def test_client_error_status_surfaces_provider_message(stub):
+    async def scenario(tool):
+        return await tool.execute(TavilySearchInput(query="status 401"))
+
+    result = run_with_tool(scenario)
+    assert result["success"] is False
+    assert "HTTP 401" in result["error"]
+    assert "stub error 401" in result["error"]
+    assert len(stub.calls) == 1
+
+
+def test_server_error_is_retried_then_reported(stub):
+    async def scenario(tool):
+        return await tool.execute(TavilySearchInput(query="status 503"))
+
+    result = run_with_tool(scenario)
+    assert result["success"] is False
+    assert "HTTP 503" in result["error"]
+    assert len(stub.calls) == RETRY_MAX_ATTEMPTS
+
+
+def test_429_waits_for_retry_after_and_succeeds(stub):
+    async def scenario(tool):
+        started = time.monotonic()
+        result = await tool.execute(TavilySearchInput(query="flaky429 1"))
+        return result, time.monotonic() - started
+
+    result, elapsed = run_with_tool(scenario)
+    assert result["success"] is True
+    assert len(stub.calls) == 2
+    assert elapsed >= 0.1 + RESPONSE_DELAY
+
+
+def test_concurrent_identical_queries_share_one_request(stub):
+    async def scenario(tool):
+        queries = ["Hello, World!", "hello world", "  HELLO   world?"]
+        return await asyncio.gather(*(tool.execute(TavilySearchInput(query=q)) for q in queries))
+
+    results = run_with_tool(scenario)
+    assert all(r["success"] for r in results)
+    assert len(stub.calls) == 1
+
+
+def test_cancelled_caller_does_not_fail_coalesced_waiters(stub):
+    async def scenario(tool):
+        first = asyncio.create_task(tool.cached_search("shared query", "basic", 2))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(tool.cached_search("shared query", "basic", 2))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        result, state = await second
+        cached, cached_state = await tool.cached_search("shared query", "basic", 2)
+        return first, result, state, cached_state
+
+    first, result, state, cached_state = run_with_tool(scenario)
+    assert first.cancelled()
+    assert len(result["results"]) == 2
+    assert state == "miss"
+    assert cached_state == "hit"
+    assert len(stub.calls) == 1
@@ -0,0 +1,71 @@
+"""
+The NDJSON contract of /api/v1/execute_tool/stream: whatever the tool, the last event is {"type": "done"}.
+
+Tools are created without running their constructors and their execute() is replaced, so no backend
+(Docker, browser, engine, remote API) is needed; stream() implementations run as-is.
+"""
+
+import asyncio
+
+import pytest
+
+for module in ("docker", "crawl4ai", "firecrawl", "chess", "httpx"):
+    pytest.importorskip(module)
+
+from tools import tool_registry
+
+PARAMETERS = {
+    "tavily_search": {"query": "stockfish"},
+    "python_sandbox": {"code": "print(1)"},
+    "firecrawl": {"mode": "scrape", "parameters": {"url": "https://example.com"}},
+    "stockfish_analyzer": {"mode": "get_best_move", "fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"},
+    "crawl4ai": {"mode": "scrape", "parameters": {"url": "https://example.com"}},
+    "web_scrape": {"url": "https://example.com"},
+}
+
+
+def make_instance(tool_class):
+    instance = object.__new__(tool_class)
+    # python_sandbox: stream() would report "Docker daemon not available." as a non-done event
+    instance.docker_client = None
+
+    async def execute(parameters):
+        return {"success": True, "data": {"tool": tool_class.name}}
+
+    instance.execute = execute
+    return instance
+
+
+def collect(tool_name, parameters):
+    async def main():
+        return [event async for event in tool_registry.execute_tool_stream(tool_name, parameters)]
+    return asyncio.run(main())
+
+
+def test_every_registered_tool_has_stream_parameters():
+    assert set(PARAMETERS) == set(tool_registry.TOOL_CLASSES)
+
+
+@pytest.mark.parametrize("tool_name", sorted(tool_registry.TOOL_CLASSES))
+def test_last_stream_event_is_done(tool_name, monkeypatch):
+    monkeypatch.setitem(tool_registry.tool_instances, tool_name,
+                        make_instance(tool_registry.TOOL_CLASSES[tool_name]))
+    events = collect(tool_name, PARAMETERS[tool_name])
+    assert events[-1]["type"] == "done"
+    assert [event["type"] for event in events].count("done") == 1
+    assert events[-1]["success"] is True
+    assert events[-1]["data"] == {"tool": tool_name}
+
+
+def test_stream_without_done_event_is_terminated(monkeypatch):
+    class Partial:
+        input_schema = tool_registry.TOOL_CLASSES["python_sandbox"].input_schema
+        streams_done_events = True
+
+        async def stream(self, parameters):
+            yield {"type": "stdout", "data": "1\n"}
+
+    monkeypatch.setitem(tool_registry.tool_instances, "partial", Partial())
+    events = collect("partial", {"code": "print(1)"})
+    assert [event["type"] for event in events] == ["stdout", "done"]
+    assert events[-1]["success"] is False
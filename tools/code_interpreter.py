@@ -2,21 +2,861 @@
 
 import docker
 import asyncio
+import base64
+import codecs
+import io
 import logging
-from pydantic import BaseModel, Field
-from docker.errors import DockerException, ContainerError, ImageNotFound, NotFound
+import mimetypes
+import os
+import re
+import socket
+import tarfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import BaseModel, Field, ValidationError, validator
+from docker.errors import DockerException, ImageNotFound, NotFound
+from docker.utils.socket import STDERR, STDOUT, frames_iter
 from fastapi import FastAPI, HTTPException
-from contextlib import asynccontextmanager
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Dict, Optional
 import json
+import uuid
+
+try:
+    from .metrics import metrics
+except ImportError:  # 作为独立服务运行时 (uvicorn code_interpreter:app)
+    from metrics import metrics
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# --- Sandbox Container Configuration ---
+SANDBOX_IMAGE = os.getenv("SANDBOX_IMAGE", "tools-python-sandbox")
+SANDBOX_POOL_LABEL = "py_tool_server.sandbox_pool"
+SANDBOX_OWNER_LABEL = "py_tool_server.sandbox_owner"  # 创建容器的进程："<hostname>:<pid>:<nonce>"
+
+# 并发执行参数：每个沙箱容器限额半个 CPU 核心，默认每个核心并发两个
+SANDBOX_MAX_CONCURRENCY = int(os.getenv("SANDBOX_MAX_CONCURRENCY", str(max(2, (os.cpu_count() or 1) * 2))))
+SANDBOX_MAX_QUEUE = int(os.getenv("SANDBOX_MAX_QUEUE", "64"))               # 排队等待的最大请求数
+SANDBOX_QUEUE_TIMEOUT = float(os.getenv("SANDBOX_QUEUE_TIMEOUT", "30"))     # 排队等待的最长秒数
+
+# 执行超时：从宿主机侧计时，超时后直接 kill 容器
+SANDBOX_DEFAULT_TIMEOUT = float(os.getenv("SANDBOX_DEFAULT_TIMEOUT", "30"))
+SANDBOX_MAX_TIMEOUT = float(os.getenv("SANDBOX_MAX_TIMEOUT", "300"))
+
+# 代码和输入文件通过 exec 的 stdin 传入，输入文件总大小上限（/tmp 是 100M 的 tmpfs）
+SANDBOX_MAX_INPUT_BYTES = int(os.getenv("SANDBOX_MAX_INPUT_BYTES", str(32 * 1024 * 1024)))
+SANDBOX_INPUTS_DIR = "/tmp/inputs"
+
+# stdout/stderr 各自的字节上限，超出部分丢弃并以截断标记代替
+SANDBOX_MAX_OUTPUT_BYTES = int(os.getenv("SANDBOX_MAX_OUTPUT_BYTES", str(2 * 1024 * 1024)))
+
+# 写入 /tmp/outputs 的文件（包括自动保存的 matplotlib 图表）作为 artifacts 返回
+SANDBOX_OUTPUTS_DIR = "/tmp/outputs"
+SANDBOX_MAX_ARTIFACT_BYTES = int(os.getenv("SANDBOX_MAX_ARTIFACT_BYTES", str(20 * 1024 * 1024)))
+
+# 只读数据集：运维把同一个数据集目录挂载到所有沙箱容器的 SANDBOX_DATASETS_DIR
+SANDBOX_DATASETS_HOST_DIR = os.getenv("SANDBOX_DATASETS_HOST_DIR", "")          # Docker 守护进程所在主机上的路径或命名卷，为空则不挂载
+SANDBOX_DATASETS_DIR = os.getenv("SANDBOX_DATASETS_DIR", "/data")                # 沙箱容器内的挂载点
+SANDBOX_DATASETS_LOCAL_DIR = os.getenv("SANDBOX_DATASETS_LOCAL_DIR", SANDBOX_DATASETS_DIR)  # 本服务内可见的同一目录，用于生成列表
+DATASET_CATALOG_FILE = "catalog.json"
+DATASET_CATALOG_TTL = 60.0
+DATASET_FORMATS = {
+    ".parquet": "parquet", ".pq": "parquet", ".feather": "feather", ".arrow": "arrow",
+    ".csv": "csv", ".npy": "npy", ".npz": "npz",
+}
+
+# 资源消耗直方图的分桶
+CPU_SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 150.0)
+MEMORY_BYTES_BUCKETS = tuple(mb * 1024 * 1024 for mb in (16, 32, 64, 128, 256, 384, 512, 768, 1024, 1536, 2048))
+
+# 容器池参数（均可通过环境变量配置）
+POOL_MIN_SIZE = int(os.getenv("SANDBOX_POOL_MIN_SIZE", "2"))        # 常驻的空闲预热容器数量
+POOL_MAX_SIZE = int(os.getenv("SANDBOX_POOL_MAX_SIZE", str(SANDBOX_MAX_CONCURRENCY)))  # 容器总数上限（空闲 + 租用中）
+POOL_IDLE_TTL = float(os.getenv("SANDBOX_POOL_IDLE_TTL", "300"))    # 超出 min_size 的空闲容器存活秒数
+POOL_MAX_USES = int(os.getenv("SANDBOX_POOL_MAX_USES", "20"))       # 单个容器最多执行多少次后回收
+POOL_LEASE_TIMEOUT = float(os.getenv("SANDBOX_POOL_LEASE_TIMEOUT", "30"))
+POOL_MAINTENANCE_INTERVAL = 5.0
+
+# 会话参数：session_id 独占一个沙箱容器，变量和导入在调用之间保留
+SANDBOX_SESSION_IDLE_TIMEOUT = float(os.getenv("SANDBOX_SESSION_IDLE_TIMEOUT", "600"))
+SANDBOX_SESSION_MEM_LIMIT = os.getenv("SANDBOX_SESSION_MEM_LIMIT", "1g")
+SANDBOX_MAX_SESSIONS = int(os.getenv("SANDBOX_MAX_SESSIONS", "16"))
+
+# 沙箱容器内常驻的 forkserver runner (见 sandbox_runner.py，随镜像一起构建)
+SANDBOX_RUNNER_PATH = os.getenv("SANDBOX_RUNNER_PATH", "/app/sandbox_runner.py")
+SANDBOX_RUNNER_START_TIMEOUT = float(os.getenv("SANDBOX_RUNNER_START_TIMEOUT", "60"))
+SANDBOX_PRELOAD_MODULES = os.getenv("SANDBOX_PRELOAD_MODULES", "numpy,pandas,matplotlib,matplotlib.pyplot")
+META_PREFIX = b"\x1e"
+
+
+_owner_id = None
+_owner_pid = None
+
+
+def sandbox_owner_id() -> str:
+    """当前进程的容器所有者标识。gunicorn 在 fork 之后每个 worker 会得到各自的标识"""
+    global _owner_id, _owner_pid
+    if _owner_pid != os.getpid():
+        _owner_pid = os.getpid()
+        _owner_id = f"{socket.gethostname()}:{_owner_pid}:{uuid.uuid4().hex[:8]}"
+    return _owner_id
+
+
+def _owner_is_gone(owner: str) -> bool:
+    """所有者是本机上已经退出的进程时返回 True；其他主机/容器的所有者无法判断，视为存活"""
+    host, _, rest = owner.partition(":")
+    pid = rest.partition(":")[0]
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def sandbox_container_kwargs() -> dict:
+    """沙箱容器的统一运行参数：无网络、只读根文件系统、内存与CPU受限"""
+    volumes = {}
+    if SANDBOX_DATASETS_HOST_DIR:
+        volumes[SANDBOX_DATASETS_HOST_DIR] = {"bind": SANDBOX_DATASETS_DIR, "mode": "ro"}
+    return dict(
+        image=SANDBOX_IMAGE,
+        command=["python", SANDBOX_RUNNER_PATH, "serve"],
+        init=True,  # 由 docker-init 回收孤儿进程
+        network_disabled=True,
+        environment={
+            'MPLCONFIGDIR': '/tmp',
+            'SANDBOX_PRELOAD_MODULES': SANDBOX_PRELOAD_MODULES,
+            # forkserver 在 fork 前已导入 numpy，BLAS 线程池在 fork 后不安全
+            'OPENBLAS_NUM_THREADS': '1',
+            'OMP_NUM_THREADS': '1',
+            'MKL_NUM_THREADS': '1',
+        },
+        mem_limit="1g",
+        cpu_period=100_000,
+        cpu_quota=50_000,
+        read_only=True,
+        volumes=volumes,
+        tmpfs={'/tmp': 'size=100M,mode=1777', '/run/sandbox': 'size=1M,mode=700'},
+        labels={SANDBOX_POOL_LABEL: "1", SANDBOX_OWNER_LABEL: sandbox_owner_id()},
+        detach=True,
+    )
+
+
+# --- Read-only Datasets ---
+class DatasetCatalog:
+    """
+    只读数据集列表。目录下有 catalog.json 时按其内容列出：
+        {"datasets": [{"name": "prices", "path": "prices/2024.parquet", "description": "..."}]}
+    否则递归扫描目录中的 Parquet/Feather/CSV/NPY/NPZ 文件。结果缓存 DATASET_CATALOG_TTL 秒。
+    """
+
+    def __init__(self, local_dir: str = SANDBOX_DATASETS_LOCAL_DIR, sandbox_dir: str = SANDBOX_DATASETS_DIR):
+        self.local_dir = local_dir
+        self.sandbox_dir = sandbox_dir
+        self._cache = None
+        self._cached_at = 0.0
+        self._lock = threading.Lock()
+
+    def list(self) -> list:
+        with self._lock:
+            if self._cache is None or time.monotonic() - self._cached_at > DATASET_CATALOG_TTL:
+                self._cache = self._load()
+                self._cached_at = time.monotonic()
+            return self._cache
+
+    def _load(self) -> list:
+        if not os.path.isdir(self.local_dir):
+            return []
+        catalog_path = os.path.join(self.local_dir, DATASET_CATALOG_FILE)
+        if os.path.isfile(catalog_path):
+            try:
+                with open(catalog_path, encoding="utf-8") as f:
+                    entries = json.load(f).get("datasets", [])
+            except (OSError, ValueError, AttributeError) as e:
+                logger.warning(f"Invalid dataset catalog {catalog_path}: {e}")
+                entries = []
+        else:
+            entries = []
+            for root, _, files in os.walk(self.local_dir):
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in DATASET_FORMATS:
+                        relpath = os.path.relpath(os.path.join(root, name), self.local_dir)
+                        entries.append({"name": os.path.splitext(relpath)[0], "path": relpath})
+
+        datasets = []
+        for entry in entries:
+            dataset = self._describe(entry)
+            if dataset:
+                datasets.append(dataset)
+        return datasets
+
+    def _describe(self, entry: dict) -> Optional[dict]:
+        relpath = os.path.normpath(str(entry.get("path", "")))
+        local_path = os.path.join(self.local_dir, relpath)
+        if relpath.startswith("..") or os.path.isabs(relpath) or not os.path.isfile(local_path):
+            logger.warning(f"Skipping dataset entry outside {self.local_dir} or missing: {entry}")
+            return None
+        fmt = entry.get("format") or DATASET_FORMATS.get(os.path.splitext(relpath)[1].lower(), "file")
+        path = f"{self.sandbox_dir.rstrip('/')}/{relpath}"
+        dataset = {
+            "name": entry.get("name") or os.path.splitext(relpath)[0],
+            "path": path,
+            "format": fmt,
+            "size_bytes": os.path.getsize(local_path),
+            "description": entry.get("description", ""),
+        }
+        try:
+            if fmt == "npy":
+                import numpy as np
+                array = np.load(local_path, mmap_mode="r")
+                dataset.update(shape=list(array.shape), dtype=str(array.dtype))
+                dataset["load_hint"] = f"np.load('{path}', mmap_mode='r')"
+            elif fmt == "parquet":
+                import pyarrow.parquet as pq
+                metadata = pq.ParquetFile(local_path).metadata
+                dataset.update(num_rows=metadata.num_rows, columns=metadata.schema.names)
+                dataset["load_hint"] = f"pyarrow.parquet.read_table('{path}', memory_map=True).to_pandas()"
+            elif fmt in ("feather", "arrow"):
+                dataset["load_hint"] = f"pyarrow.feather.read_table('{path}', memory_map=True)"
+            elif fmt == "npz":
+                dataset["load_hint"] = f"np.load('{path}')"
+            elif fmt == "csv":
+                dataset["load_hint"] = f"pd.read_csv('{path}')"
+        except ImportError:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not inspect dataset {local_path}: {e}")
+        return dataset
+
+
+# --- Warm Container Pool ---
+class PooledContainer:
+    """池中的一个沙箱容器及其使用统计"""
+
+    def __init__(self, container):
+        self.container = container
+        self.uses = 0
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.dirty = False  # 执行过程中出现异常（Docker错误、容器被杀等）时置为 True
+
+
+class SandboxContainerPool:
+    """
+    预先启动的沙箱容器池。
+
+    每次执行从池中租用一个容器（`lease()`），执行结束后在后台重置并放回；
+    使用次数达到 max_uses 或状态异常的容器会被销毁，由维护线程在后台补充。
+    """
+
+    def __init__(self, docker_client, image: str = SANDBOX_IMAGE,
+                 min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE,
+                 idle_ttl: float = POOL_IDLE_TTL, max_uses: int = POOL_MAX_USES,
+                 lease_timeout: float = POOL_LEASE_TIMEOUT):
+        if max_size < 1:
+            raise ValueError("Sandbox pool max_size must be at least 1.")
+        self.docker_client = docker_client
+        self.image = image
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.max_uses = max(1, max_uses)
+        self.lease_timeout = lease_timeout
+
+        self._idle = deque()
+        self._total = 0        # 空闲 + 租用中 + 启动中 + 重置中
+        self._starting = 0
+        self._leased = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._started = False
+        self._wakeup = threading.Event()
+        self._maintainer = None
+        self._housekeeping = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sandbox-pool")
+
+        self._lease_wait = metrics.histogram("sandbox_pool_lease_wait_seconds")
+
+    # --- 生命周期 ---
+    def start(self):
+        """检查镜像、清理上次遗留的容器，并启动后台维护线程"""
+        if self._started:
+            return
+        try:
+            self.docker_client.images.get(self.image)
+        except ImageNotFound:
+            raise RuntimeError(f"Docker image '{self.image}' not found.")
+
+        self._remove_stale_containers()
+
+        self._started = True
+        self._maintainer = threading.Thread(target=self._maintain_loop, name="sandbox-pool-maintainer", daemon=True)
+        self._maintainer.start()
+        logger.info(f"Sandbox pool started (min={self.min_size}, max={self.max_size}, "
+                    f"idle_ttl={self.idle_ttl}s, max_uses={self.max_uses})")
+
+    def close(self):
+        """销毁所有空闲容器；租用中的容器在归还时销毁"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+            self._cond.notify_all()
+        self._wakeup.set()
+        for pooled in idle:
+            self._destroy(pooled)
+        self._housekeeping.shutdown(wait=False)
+        logger.info("Sandbox pool closed")
+
+    # --- 租用 / 归还 ---
+    def acquire(self, timeout: Optional[float] = None) -> PooledContainer:
+        """租用一个容器；池已满时最多等待 timeout 秒"""
+        timeout = self.lease_timeout if timeout is None else timeout
+        start = time.perf_counter()
+        deadline = start + timeout
+        create_inline = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Sandbox pool is closed.")
+                if self._idle:
+                    pooled = self._idle.popleft()
+                    break
+                if self._total < self.max_size:
+                    # 没有预热容器可用，直接在当前线程冷启动一个
+                    self._total += 1
+                    create_inline = True
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    metrics.counter("sandbox_pool_lease_timeouts_total").inc()
+                    raise TimeoutError(f"No sandbox container available within {timeout:.0f}s.")
+                self._cond.wait(remaining)
+            self._leased += 1
+
+        if create_inline:
+            try:
+                pooled = self._create()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                    self._leased -= 1
+                    self._cond.notify()
+                raise
+
+        self._lease_wait.observe(time.perf_counter() - start)
+        metrics.counter("sandbox_pool_leases_total", warm=str(not create_inline).lower()).inc()
+        self._wakeup.set()  # 让维护线程尽快补充空闲容器
+        return pooled
+
+    def release(self, pooled: PooledContainer, dirty: bool = False):
+        """归还容器：正常容器在后台重置后放回，异常或用满的容器直接回收"""
+        pooled.uses += 1
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._leased -= 1
+            closed = self._closed
+
+        if dirty or pooled.dirty or closed or pooled.uses >= self.max_uses:
+            reason = "dirty" if (dirty or pooled.dirty) else ("closed" if closed else "max_uses")
+            metrics.counter("sandbox_pool_recycled_total", reason=reason).inc()
+            self._discard(pooled)
+            return
+        try:
+            self._housekeeping.submit(self._reset_and_return, pooled)
+        except RuntimeError:  # 池已关闭，线程池不再接受任务
+            self._discard(pooled)
+
+    def detach(self, pooled: PooledContainer):
+        """把租用中的容器移出池（交给会话独占），池会在后台补充新的预热容器"""
+        with self._cond:
+            self._leased -= 1
+            self._total -= 1
+            self._cond.notify()
+        metrics.counter("sandbox_pool_detached_total").inc()
+        self._wakeup.set()
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        """`with pool.lease() as pooled:` 租用容器，出现异常时标记为脏容器"""
+        pooled = self.acquire(timeout)
+        try:
+            yield pooled
+        except Exception:
+            self.release(pooled, dirty=True)
+            raise
+        else:
+            self.release(pooled)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "idle": len(self._idle),
+                "leased": self._leased,
+                "starting": self._starting,
+                "total": self._total,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "idle_ttl": self.idle_ttl,
+                "max_uses": self.max_uses,
+                "lease_wait_seconds": self._lease_wait.snapshot(),
+            }
+
+    # --- 内部实现 ---
+    def _remove_stale_containers(self):
+        """
+        清理服务异常退出时遗留的池容器。多个进程（gunicorn worker、独立沙箱服务）共用同一个
+        Docker 守护进程，只有本进程创建的、已停止的、或所有者进程已确认退出的容器才会被删除。
+        """
+        owner = sandbox_owner_id()
+        for container in self.docker_client.containers.list(all=True, filters={"label": SANDBOX_POOL_LABEL}):
+            container_owner = (container.labels or {}).get(SANDBOX_OWNER_LABEL, "")
+            stale = (container_owner == owner
+                     or container.status in ("exited", "dead")
+                     or (container_owner and _owner_is_gone(container_owner)))
+            if not stale:
+                continue
+            try:
+                container.remove(force=True)
+            except Exception as e:
+                logger.warning(f"Failed to remove stale sandbox container {container.short_id}: {e}")
+
+    def _create(self) -> PooledContainer:
+        start = time.perf_counter()
+        container = self.docker_client.containers.run(**sandbox_container_kwargs())
+        try:
+            self._wait_until_ready(container)
+        except Exception:
+            try:
+                container.remove(force=True)
+            except Exception:
+                pass
+            raise
+        metrics.histogram("sandbox_pool_container_start_seconds").observe(time.perf_counter() - start)
+        metrics.counter("sandbox_pool_containers_created_total").inc()
+        return PooledContainer(container)
+
+    def _wait_until_ready(self, container):
+        """等待容器内 forkserver 完成预导入并开始监听"""
+        deadline = time.monotonic() + SANDBOX_RUNNER_START_TIMEOUT
+        while True:
+            exit_code, _ = container.exec_run(["python", SANDBOX_RUNNER_PATH, "ping"])
+            if exit_code == 0:
+                return
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"Sandbox runner did not start within {SANDBOX_RUNNER_START_TIMEOUT:.0f}s.")
+            time.sleep(0.25)
+
+    def _destroy(self, pooled: PooledContainer):
+        try:
+            pooled.container.remove(force=True)
+        except NotFound:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to remove sandbox container {pooled.container.short_id}: {e}")
+
+    def _discard(self, pooled: PooledContainer):
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+        try:
+            self._housekeeping.submit(self._destroy, pooled)
+        except RuntimeError:
+            self._destroy(pooled)
+        self._wakeup.set()
+
+    def _reset_and_return(self, pooled: PooledContainer):
+        try:
+            exit_code, _ = pooled.container.exec_run(["python", SANDBOX_RUNNER_PATH, "reset"])
+            if exit_code != 0:
+                raise RuntimeError(f"reset script exited with code {exit_code}")
+        except Exception as e:
+            logger.warning(f"Sandbox container reset failed, recycling: {e}")
+            metrics.counter("sandbox_pool_recycled_total", reason="reset_failed").inc()
+            self._discard(pooled)
+            return
+
+        with self._cond:
+            if not self._closed:
+                self._idle.append(pooled)
+                self._cond.notify()
+                return
+            self._total -= 1
+        self._destroy(pooled)
+
+    def _create_into_idle(self):
+        try:
+            pooled = self._create()
+        except Exception as e:
+            logger.error(f"Failed to start sandbox container: {e}")
+            metrics.counter("sandbox_pool_start_failures_total").inc()
+            with self._cond:
+                self._starting -= 1
+                self._total -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._starting -= 1
+            if not self._closed:
+                self._idle.append(pooled)
+                self._cond.notify()
+                return
+            self._total -= 1
+        self._destroy(pooled)
+
+    def _refill(self):
+        with self._cond:
+            if self._closed:
+                return
+            deficit = min(self.min_size - len(self._idle) - self._starting, self.max_size - self._total)
+            if deficit <= 0:
+                return
+            self._starting += deficit
+            self._total += deficit
+        for _ in range(deficit):
+            self._housekeeping.submit(self._create_into_idle)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        evicted = []
+        with self._cond:
+            keep = deque()
+            for pooled in self._idle:
+                if (now - pooled.last_used > self.idle_ttl
+                        and len(self._idle) - len(evicted) > self.min_size):
+                    evicted.append(pooled)
+                else:
+                    keep.append(pooled)
+            self._idle = keep
+            self._total -= len(evicted)
+        for pooled in evicted:
+            metrics.counter("sandbox_pool_recycled_total", reason="idle_ttl").inc()
+            self._destroy(pooled)
+
+    def _maintain_loop(self):
+        while not self._closed:
+            try:
+                self._refill()
+                self._evict_idle()
+            except Exception as e:
+                logger.error(f"Sandbox pool maintenance error: {e}")
+            self._wakeup.wait(POOL_MAINTENANCE_INTERVAL)
+            self._wakeup.clear()
+
+class SandboxBusyError(RuntimeError):
+    """执行队列已满或排队超时"""
+
+
+# --- Stateful Sessions ---
+class SandboxSession:
+    """一个会话独占的沙箱容器；容器内的会话进程在调用之间保留变量和导入"""
+
+    def __init__(self, session_id: str, pooled: PooledContainer):
+        self.session_id = session_id
+        self.pooled = pooled
+        self.lock = threading.Lock()  # 同一会话的调用串行执行
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.runs = 0
+        self.closed = False
+
+    def info(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            "runs": self.runs,
+            "busy": self.lock.locked(),
+        }
+
+
+class SandboxSessionManager:
+    """
+    管理 session_id -> 独占容器 的映射。
+
+    会话容器从预热池中租用后移出池，按 SANDBOX_SESSION_MEM_LIMIT 调整内存上限；
+    空闲超过 idle_timeout 或被显式关闭时销毁容器。
+    """
+
+    def __init__(self, pool: SandboxContainerPool, idle_timeout: float = SANDBOX_SESSION_IDLE_TIMEOUT,
+                 mem_limit: str = SANDBOX_SESSION_MEM_LIMIT, max_sessions: int = SANDBOX_MAX_SESSIONS):
+        self.pool = pool
+        self.idle_timeout = idle_timeout
+        self.mem_limit = mem_limit
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._reaper = None
+
+    def start(self):
+        self._reaper = threading.Thread(target=self._reap_loop, name="sandbox-session-reaper", daemon=True)
+        self._reaper.start()
+
+    def get_or_create(self, session_id: str) -> SandboxSession:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                return session
+            if len(self._sessions) >= self.max_sessions:
+                metrics.counter("sandbox_rejected_total", reason="max_sessions").inc()
+                raise SandboxBusyError(f"Maximum of {self.max_sessions} sandbox sessions reached.")
+
+        pooled = self.pool.acquire()
+        self.pool.detach(pooled)
+        try:
+            pooled.container.update(mem_limit=self.mem_limit, memswap_limit=self.mem_limit)
+        except Exception as e:
+            logger.warning(f"Could not apply session memory limit {self.mem_limit}: {e}")
+        session = SandboxSession(session_id, pooled)
+
+        with self._lock:
+            existing = self._sessions.get(session_id)
+            if existing is None and not self._closed:
+                self._sessions[session_id] = session
+        if existing is not None or self._closed:
+            # 并发请求已经为同一个 session_id 创建了容器
+            self._destroy(session)
+            if existing is None:
+                raise RuntimeError("Sandbox is shutting down.")
+            return existing
+
+        metrics.counter("sandbox_sessions_created_total").inc()
+        logger.info(f"Sandbox session '{session_id}' started in container {pooled.container.short_id}")
+        return session
+
+    def close(self, session_id: str, reason: str = "closed") -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        metrics.counter("sandbox_sessions_closed_total", reason=reason).inc()
+        self._destroy(session)
+        logger.info(f"Sandbox session '{session_id}' closed ({reason})")
+        return True
+
+    def close_all(self):
+        with self._lock:
+            self._closed = True
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        self._wakeup.set()
+        for session in sessions:
+            self._destroy(session)
+
+    def list(self) -> list:
+        with self._lock:
+            return [session.info() for session in self._sessions.values()]
+
+    def _destroy(self, session: SandboxSession):
+        session.closed = True
+        try:
+            session.pooled.container.remove(force=True)
+        except NotFound:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to remove session container {session.pooled.container.short_id}: {e}")
+
+    def _reap_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, session in self._sessions.items()
+                       if now - session.last_used > self.idle_timeout and not session.lock.locked()]
+        for session_id in expired:
+            self.close(session_id, reason="idle_timeout")
+
+    def _reap_loop(self):
+        while not self._closed:
+            try:
+                self._reap_idle()
+            except Exception as e:
+                logger.error(f"Sandbox session reaper error: {e}")
+            self._wakeup.wait(min(30.0, max(1.0, self.idle_timeout / 4)))
+
+
 # --- Pydantic Input Schema ---
 class CodeInterpreterInput(BaseModel):
     """Input schema for the Code Interpreter tool."""
     code: str = Field(description="The Python code to be executed in the sandbox.")
+    session_id: Optional[str] = Field(
+        default=None,
+        description="Run inside a stateful session: variables and imports are kept between calls with the same id."
+    )
+    close_session: bool = Field(default=False, description="Close the session after this execution.")
+    timeout: Optional[float] = Field(
+        default=None, gt=0, le=SANDBOX_MAX_TIMEOUT,
+        description=f"Wall-clock limit in seconds (default {SANDBOX_DEFAULT_TIMEOUT:g}, max {SANDBOX_MAX_TIMEOUT:g})."
+    )
+    files: Optional[Dict[str, str]] = Field(
+        default=None,
+        description=f"Input files as {{file name: base64 content}}, written to {SANDBOX_INPUTS_DIR}/<name> before the code runs."
+    )
+
+    @validator('session_id')
+    def validate_session_id(cls, v):
+        if v is not None and not re.fullmatch(r"[A-Za-z0-9_.-]{1,64}", v):
+            raise ValueError("session_id must be 1-64 characters of letters, digits, '_', '-' or '.'.")
+        return v
+
+    @validator('files')
+    def validate_files(cls, v):
+        if not v:
+            return v
+        total = 0
+        for name, content in v.items():
+            if not re.fullmatch(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}", name):
+                raise ValueError(f"Invalid file name '{name}': use letters, digits, '_', '-' or '.'.")
+            # 在这里严格解码：无效的 base64 应返回 422，而不是在租用容器之后才失败
+            try:
+                total += len(base64.b64decode(content, validate=True))
+            except ValueError:
+                raise ValueError(f"File '{name}' is not valid base64.")
+        if total > SANDBOX_MAX_INPUT_BYTES:
+            raise ValueError(f"Input files exceed {SANDBOX_MAX_INPUT_BYTES} bytes.")
+        return v
+
+def build_stdin_payload(token: str, code: str, session: bool = False, files: Optional[Dict[str, str]] = None) -> list:
+    """构造 runner 的 stdin 负载：JSON 头一行，随后是代码和各输入文件的原始字节（见 sandbox_runner.py）"""
+    code_bytes = code.encode("utf-8")
+    file_entries = [(name, base64.b64decode(content, validate=True)) for name, content in (files or {}).items()]
+    header = {
+        "token": token,
+        "session": session,
+        "code_size": len(code_bytes),
+        "files": [{"name": name, "size": len(data)} for name, data in file_entries],
+    }
+    return [json.dumps(header).encode("utf-8") + b"\n", code_bytes] + [data for _, data in file_entries]
+
+# --- Output Helpers ---
+def split_meta_trailer(stderr: bytes, token: str):
+    """从 stderr 末尾剥离 runner 写入的元数据行，返回 (stderr, meta)"""
+    marker = META_PREFIX + token.encode("ascii")
+    index = stderr.rfind(marker)
+    if index == -1:
+        return stderr, None
+    try:
+        meta = json.loads(stderr[index + len(marker):].strip() or b"{}")
+    except ValueError:
+        meta = {}
+    return stderr[:index], meta
+
+
+class MetaTrailerSplitter:
+    """
+    流式剥离 stderr 末尾的元数据行：可能是标记开头的尾部字节会被暂时扣留，其余字节立即放行。
+    finish() 返回 (扣留的普通 stderr, meta)。
+    """
+
+    def __init__(self, token: str):
+        self.token = token
+        self.marker = META_PREFIX + token.encode("ascii")
+        self._held = b""
+
+    def feed(self, data: bytes) -> bytes:
+        buf = self._held + data
+        index = buf.find(self.marker)
+        if index == -1:
+            # 末尾可能是被拆开的标记前缀
+            index = buf.rfind(META_PREFIX, max(0, len(buf) - len(self.marker) + 1))
+            if index == -1 or not self.marker.startswith(buf[index:]):
+                index = len(buf)
+        self._held = buf[index:]
+        return buf[:index]
+
+    def finish(self):
+        return split_meta_trailer(self._held, self.token)
+
+
+class OutputCapture:
+    """按字节上限收集一路输出；超出上限的部分只计数不保存，并在截断处插入一次标记"""
+
+    def __init__(self, name: str, limit: int = SANDBOX_MAX_OUTPUT_BYTES, keep: bool = True):
+        self.name = name
+        self.limit = limit
+        self.keep = keep
+        self.size = 0
+        self.dropped = 0
+        self._chunks = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+
+    @property
+    def truncated(self) -> bool:
+        return self.dropped > 0
+
+    def add(self, data: bytes) -> str:
+        """记录一段输出，返回可以转发的文本（超出上限后为空）"""
+        if not data:
+            return ""
+        was_truncated = self.truncated
+        room = self.limit - self.size
+        if len(data) > room:
+            self.dropped += len(data) - max(room, 0)
+            data = data[:max(room, 0)]
+        self.size += len(data)
+        text = self._decoder.decode(data)
+        if self.truncated and not was_truncated:
+            text += self._decoder.decode(b"", final=True)
+            text += f"\n[... {self.name} truncated at {self.limit} bytes ...]\n"
+            metrics.counter("sandbox_output_truncated_total", stream=self.name).inc()
+        if self.keep and text:
+            self._chunks.append(text)
+        return text
+
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+
+class ExecutionHandle:
+    """流式执行的取消句柄：客户端断开时调用 cancel()，kill 正在执行代码的容器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kill: Optional[Callable[[], None]] = None
+        self.cancelled = False
+
+    def bind(self, kill: Callable[[], None]):
+        """执行开始时登记 kill；若已被取消则立即 kill"""
+        with self._lock:
+            self._kill = kill
+            cancelled = self.cancelled
+        if cancelled:
+            kill()
+
+    def unbind(self):
+        with self._lock:
+            self._kill = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            kill = self._kill
+        if kill:
+            kill()
+
+
+def format_stdout(stdout: str) -> str:
+    """若 stdout 是一个完整的 JSON 对象则去掉首尾空白后返回；其余情况原样返回"""
+    stripped_stdout = stdout.strip()
+    if stripped_stdout.startswith('{') and stripped_stdout.endswith('}'):
+        try:
+            json.loads(stripped_stdout)
+            return stripped_stdout
+        except json.JSONDecodeError:
+            pass
+    return stdout
+
 
 # --- Tool Class ---
 class CodeInterpreterTool:
@@ -33,12 +873,22 @@ class CodeInterpreterTool:
 
     def __init__(self):
         self.docker_client = None
+        self.pool = None
+        self.sessions = None
+        self.datasets = DatasetCatalog()
+        self._pool_lock = threading.Lock()
+        # Docker SDK 是同步的：所有容器操作都在专用线程池中执行，不阻塞事件循环
+        self._executor = ThreadPoolExecutor(max_workers=SANDBOX_MAX_CONCURRENCY, thread_name_prefix="sandbox-exec")
+        self._semaphore = asyncio.Semaphore(SANDBOX_MAX_CONCURRENCY)
+        self._waiting = 0
+        self._running = 0
         self.initialize_docker_client()
 
     def initialize_docker_client(self):
         """Initialize Docker client with error handling"""
         try:
-            self.docker_client = docker.from_env()
+            # 读超时必须长于最长执行时间，否则安静运行的长任务会在读取输出时断开
+            self.docker_client = docker.from_env(timeout=int(SANDBOX_MAX_TIMEOUT) + 60)
             self.docker_client.ping()
             logger.info("Docker client initialized successfully")
         except DockerException as e:
@@ -54,228 +904,501 @@ class CodeInterpreterTool:
         except ImageNotFound:
             raise RuntimeError(f"Docker image '{image_name}' not found.")
 
+    def _ensure_pool(self) -> SandboxContainerPool:
+        """按需创建并启动容器池（镜像检查只在启动时做一次）"""
+        with self._pool_lock:
+            if self.pool is None:
+                if not self.docker_client:
+                    raise RuntimeError("Docker client not available")
+                self.check_image(SANDBOX_IMAGE)
+                pool = SandboxContainerPool(self.docker_client)
+                pool.start()
+                self.sessions = SandboxSessionManager(pool)
+                self.sessions.start()
+                self.pool = pool
+            return self.pool
+
+    async def initialize(self):
+        """预热容器池（沙箱服务启动时调用）"""
+        if self.docker_client:
+            await asyncio.to_thread(self._ensure_pool)
+
+    async def cleanup(self):
+        """关闭所有会话、容器池和执行线程池"""
+        if self.sessions:
+            self.sessions.close_all()
+            self.sessions = None
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+        self._executor.shutdown(wait=False)
+
+    async def _admit(self):
+        """
+        并发上限 + 有界排队：超过 SANDBOX_MAX_QUEUE 直接拒绝，排队超过 SANDBOX_QUEUE_TIMEOUT 秒则超时。
+        成功后占用一个执行槽位，须由 _release() 归还。
+        """
+        if self._waiting >= SANDBOX_MAX_QUEUE:
+            metrics.counter("sandbox_rejected_total", reason="queue_full").inc()
+            raise SandboxBusyError(f"{self._waiting} executions already queued.")
+
+        start = time.perf_counter()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=SANDBOX_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            metrics.counter("sandbox_rejected_total", reason="queue_timeout").inc()
+            raise SandboxBusyError(f"No execution slot became free within {SANDBOX_QUEUE_TIMEOUT:.0f}s.")
+        finally:
+            self._waiting -= 1
+        metrics.histogram("sandbox_queue_wait_seconds").observe(time.perf_counter() - start)
+        self._running += 1
+
+    def _release(self):
+        self._running -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def _admission(self):
+        await self._admit()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": SANDBOX_MAX_CONCURRENCY,
+            "running": self._running,
+            "queued": self._waiting,
+            "max_queue": SANDBOX_MAX_QUEUE,
+            "pool": self.pool.stats() if self.pool else None,
+            "sessions": len(self.sessions.list()) if self.sessions else 0,
+        }
+
+    async def list_datasets(self) -> list:
+        if not SANDBOX_DATASETS_HOST_DIR:
+            return []  # 沙箱中没有挂载数据集
+        return await asyncio.to_thread(self.datasets.list)
+
+    def list_sessions(self) -> list:
+        return self.sessions.list() if self.sessions else []
+
+    async def close_session(self, session_id: str) -> bool:
+        if not self.sessions:
+            return False
+        return await asyncio.to_thread(self.sessions.close, session_id)
+
     async def execute(self, parameters: CodeInterpreterInput) -> dict:
         if not self.docker_client:
             return {"success": False, "error": "Docker daemon not available."}
-            
-        image_name = "tools-python-sandbox"
         
         try:
-            self.check_image(image_name)
+            pool = self.pool or await asyncio.to_thread(self._ensure_pool)
         except Exception as e:
             return {"success": False, "error": f"Image preparation failed: {e}"}
         
-        # --- 核心修复：将字体设置逻辑移动到 runner_script 内部 ---
-        runner_script = f"""
-import sys, traceback, io, json, base64
+        try:
+            async with self._admission():
+                loop = asyncio.get_running_loop()
+                if parameters.session_id:
+                    return await loop.run_in_executor(self._executor, self._run_in_session, parameters)
+                return await loop.run_in_executor(self._executor, self._run_in_pool, pool, parameters)
+        except SandboxBusyError as e:
+            return {"success": False, "error": f"Sandbox busy: {e}"}
 
-# --- Matplotlib Font and Style Setup (runs inside the sandbox) ---
-def setup_matplotlib_config():
-    try:
-        import matplotlib.pyplot as plt
-        import matplotlib.font_manager as fm
-
-        # 字体优先级列表
-        font_preferences = [
-            'WenQuanYi Micro Hei', 'WenQuanYi Zen Hei', 'DejaVu Sans', 
-            'Arial Unicode MS', 'SimHei'
-        ]
-        
-        # 查找系统中可用的字体
-        available_fonts = set(f.name for f in fm.fontManager.ttflist)
-        
-        # 设置找到的第一个偏好字体
-        for font_name in font_preferences:
-            if font_name in available_fonts:
-                plt.rcParams['font.family'] = font_name
-                break
-        
-        # 金融图表常用配置
-        plt.rcParams['axes.unicode_minus'] = False
-        plt.rcParams['font.size'] = 10
-        plt.rcParams['figure.titlesize'] = 12
-        plt.rcParams['axes.labelsize'] = 10
-        
-        # --- Capture matplotlib title ---
-        title_holder = [None]
-        original_title_func = plt.title
-        def new_title_func(label, *args, **kwargs):
-            title_holder[0] = label
-            return original_title_func(label, *args, **kwargs)
-        plt.title = new_title_func
-        return title_holder
-
-    except ImportError:
-        return [None] # Matplotlib not available
-    except Exception as e:
-        print(f"Font setup failed inside sandbox: {{e}}", file=sys.stderr)
-        return [None]
+    async def stream(self, parameters: CodeInterpreterInput) -> AsyncIterator[dict]:
+        """
+        流式执行：stdout/stderr 在产生时即以 {"type": "stdout"|"stderr", "data": ...} 事件输出，
+        最后输出一个 {"type": "result", ...} 事件（不再重复完整输出），出错时为 {"type": "error"}。
+        """
+        if not self.docker_client:
+            yield {"type": "error", "error": "Docker daemon not available."}
+            return
+        try:
+            pool = self.pool or await asyncio.to_thread(self._ensure_pool)
+        except Exception as e:
+            yield {"type": "error", "error": f"Image preparation failed: {e}"}
+            return
 
-# --- Redirect stdout/stderr ---
-old_stdout = sys.stdout
-old_stderr = sys.stderr
-sys.stdout = buffer_stdout = io.StringIO()
-sys.stderr = buffer_stderr = io.StringIO()
+        try:
+            await self._admit()
+        except SandboxBusyError as e:
+            yield {"type": "error", "error": f"Sandbox busy: {e}"}
+            return
 
-stdout_val = ""
-stderr_val = ""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        handle = ExecutionHandle()
+
+        def on_output(stream: str, text: str):
+            loop.call_soon_threadsafe(queue.put_nowait, {"type": stream, "data": text})
 
-try:
-    # 关键：在执行用户代码前，先运行字体和配置
-    title_holder = setup_matplotlib_config()
-
-    # 安全的内置函数列表
-    safe_builtins = {{
-        '__import__': __import__, 'print': print, 'repr': repr, 'bool': bool, 'int': int, 
-        'float': float, 'str': str, 'list': list, 'dict': dict, 'set': set, 'tuple': tuple, 
-        'type': type, 'len': len, 'range': range, 'sorted': sorted, 'reversed': reversed, 
-        'zip': zip, 'enumerate': enumerate, 'slice': slice, 'abs': abs, 'max': max, 
-        'min': min, 'sum': sum, 'round': round, 'pow': pow, 'divmod': divmod, 
-        'isinstance': isinstance, 'issubclass': issubclass, 'hasattr': hasattr, 
-        'getattr': getattr, 'setattr': setattr,
-    }}
-    
-    exec_globals = {{'__builtins__': safe_builtins}}
-    
-    # 执行用户代码
-    exec({repr(parameters.code)}, exec_globals)
-    
-    stdout_val = buffer_stdout.getvalue()
-    stderr_val = buffer_stderr.getvalue()
-
-except Exception as e:
-    stdout_val = buffer_stdout.getvalue()
-    stderr_val = buffer_stderr.getvalue() + '\\n' + traceback.format_exc()
-finally:
-    sys.stdout = old_stdout
-    sys.stderr = old_stderr
-
-# --- Format output ---
-stripped_stdout = stdout_val.strip()
-output_processed = False
-
-# 1. 优先尝试解析为JSON对象 - 关键修复：使用单花括号
-if stripped_stdout.startswith('{') and stripped_stdout.endswith('}'):
-    try:
-        json.loads(stripped_stdout)
-        print(stripped_stdout, end='')
-        output_processed = True
-    except json.JSONDecodeError:
-        pass
-
-# 2. 如果不是JSON，回退检查是否为纯Base64图片
-if not output_processed:
-    is_image = False
-    if stripped_stdout.startswith(('iVBORw0KGgo', '/9j/')):
         try:
-            base64.b64decode(stripped_stdout, validate=True)
-            is_image = True
+            if parameters.session_id:
+                future = loop.run_in_executor(self._executor, self._run_in_session, parameters, on_output, handle)
+            else:
+                future = loop.run_in_executor(self._executor, self._run_in_pool, pool, parameters, on_output, handle)
+        except BaseException:
+            self._release()
+            raise
+        # 槽位在执行线程真正结束时才归还：客户端断开后容器可能仍在执行，不能让新的执行越过并发上限
+        future.add_done_callback(lambda _: self._release())
+
+        getter = None
+        try:
+            while not future.done() or not queue.empty():
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, future}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+        finally:
+            if getter is not None and not getter.done():
+                getter.cancel()
+            if not future.done():
+                # 客户端断开：kill 正在执行的容器（Docker API 调用放到线程中，不阻塞事件循环）
+                metrics.counter("sandbox_stream_cancelled_total").inc()
+                threading.Thread(target=handle.cancel, daemon=True).start()
+        result = future.result()
+
+        if result.get("success"):
+            data = {k: v for k, v in result["data"].items() if k not in ("stdout", "stderr")}
+            yield {"type": "result", **data}
+        else:
+            yield {"type": "error", "error": result.get("error")}
+
+    def _exec_snippet(self, container, parameters: CodeInterpreterInput, session: bool = False,
+                      on_output: Optional[Callable[[str, str], None]] = None,
+                      handle: Optional[ExecutionHandle] = None):
+        """
+        通过容器内的 forkserver 执行代码，返回 (data, meta)；meta 为 None 表示 runner 已不可用。
+
+        代码和输入文件经 exec 的 stdin 传给 runner，不受命令行参数长度限制。
+        stdout/stderr 分开收集，各自受 SANDBOX_MAX_OUTPUT_BYTES 限制；传入 on_output 时
+        每段输出在产生时即回调 on_output(stream, text)，且不在内存中保留完整输出。
+        超过 timeout 秒时由看门狗线程 kill 整个容器，此时返回已经收到的部分输出，
+        并把 status 标记为 timed_out。传入 handle 时，handle.cancel() 同样会 kill 容器（status 为 cancelled）。
+        """
+        timeout = parameters.timeout or SANDBOX_DEFAULT_TIMEOUT
+        token = uuid.uuid4().hex
+        payload = build_stdin_payload(token, parameters.code, session, parameters.files)
+
+        api = container.client.api
+        exec_id = api.exec_create(
+            container.id, ["python", SANDBOX_RUNNER_PATH, "run"], stdin=True, stdout=True, stderr=True
+        )["Id"]
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            try:
+                container.kill()
+            except Exception as e:
+                logger.warning(f"Failed to kill timed out container {container.short_id}: {e}")
+
+        cancelled = threading.Event()
+
+        def abort():
+            cancelled.set()
+            try:
+                container.kill()
+            except Exception as e:
+                logger.warning(f"Failed to kill cancelled container {container.short_id}: {e}")
+
+        stdout = OutputCapture("stdout", keep=on_output is None)
+        stderr = OutputCapture("stderr", keep=on_output is None)
+        splitter = MetaTrailerSplitter(token)
+
+        def forward(capture: OutputCapture, data: bytes):
+            text = capture.add(data)
+            if text and on_output:
+                on_output(capture.name, text)
+
+        watchdog = threading.Timer(timeout, kill)
+        watchdog.daemon = True
+        start = time.perf_counter()
+        watchdog.start()
+        if handle:
+            handle.bind(abort)
+        sock = api.exec_start(exec_id, socket=True)
+        raw_sock = getattr(sock, "_sock", sock)
+        try:
+            for chunk in payload:
+                raw_sock.sendall(chunk)
+            raw_sock.shutdown(socket.SHUT_WR)
+            for stream_id, data in frames_iter(sock, tty=False):
+                if stream_id == STDOUT:
+                    forward(stdout, data)
+                elif stream_id == STDERR:
+                    forward(stderr, splitter.feed(data))
         except Exception:
-            is_image = False
-
-    if is_image:
-        captured_title = title_holder[0] if title_holder[0] else "Generated Chart"
-        output_data = {{
-            "type": "image",
-            "title": captured_title,
-            "image_base64": stripped_stdout
-        }}
-        print(json.dumps(output_data), end='')
-    else:
-        # 3. 如果都不是，则作为原始文本输出
-        print(stdout_val, end='')
-
-# 始终打印标准错误流的内容
-print(stderr_val, file=sys.stderr, end='')
-"""
+            # 容器被 kill 时连接可能直接断开
+            if not timed_out.is_set() and not cancelled.is_set():
+                raise
+        finally:
+            watchdog.cancel()
+            if handle:
+                handle.unbind()
+            sock.close()
+        elapsed = time.perf_counter() - start
+        metrics.histogram("sandbox_execution_seconds").observe(elapsed)
+
+        rest, meta = splitter.finish()
+        forward(stderr, rest)
+        stderr_text = stderr.text()
+        if timed_out.is_set():
+            meta = None
+            metrics.counter("sandbox_timeouts_total").inc()
+            note = f"Execution timed out after {timeout:g} seconds; the sandbox was terminated."
+            if stderr_text and not stderr_text.endswith("\n"):
+                stderr_text += "\n"
+            stderr_text += note
+            if on_output:
+                on_output("stderr", "\n" + note)
+            exit_code = None
+        elif cancelled.is_set():
+            meta = None
+            exit_code = None
+        else:
+            exit_code = (meta or {}).get("exit_code")
+            if exit_code is None:
+                exit_code = api.exec_inspect(exec_id).get("ExitCode")
+
+        usage = dict((meta or {}).get("usage") or {"wall_seconds": round(elapsed, 4), "oom_killed": False})
+        if meta is None and not timed_out.is_set() and not cancelled.is_set():
+            usage["oom_killed"] = self._container_oom_killed(container)
+        self._record_usage(usage)
+
+        data = {
+            "stdout": format_stdout(stdout.text()),
+            "stderr": stderr_text,
+            "exit_code": exit_code,
+            "status": "timed_out" if timed_out.is_set() else "cancelled" if cancelled.is_set() else "ok",
+            "timed_out": timed_out.is_set(),
+            "duration": round(elapsed, 3),
+            "truncated": stdout.truncated or stderr.truncated,
+            "usage": usage,
+            "artifacts": self._fetch_artifacts(container, meta) if meta and meta.get("artifacts") else [],
+        }
+        return data, meta
+
+    def _container_oom_killed(self, container) -> bool:
+        """runner 没有返回元数据时，检查是否整个容器因内存耗尽被杀"""
         try:
-            # 运行容器
-            output = self.docker_client.containers.run(
-                image=image_name,
-                command=["python", "-c", runner_script],
-                network_disabled=True,
-                environment={'MPLCONFIGDIR': '/tmp'},
-                mem_limit="1g",
-                cpu_period=100_000,
-                cpu_quota=50_000,
-                remove=True,
-                read_only=True,
-                tmpfs={'/tmp': 'size=100M,mode=1777'},
-                stdout=True,
-                stderr=True,
-                detach=False
+            container.reload()
+            return bool(container.attrs.get("State", {}).get("OOMKilled"))
+        except Exception:
+            return False
+
+    def _record_usage(self, usage: dict):
+        metrics.histogram("sandbox_wall_seconds").observe(usage.get("wall_seconds", 0.0))
+        if usage.get("cpu_seconds") is not None:
+            metrics.histogram("sandbox_cpu_seconds", buckets=CPU_SECONDS_BUCKETS).observe(usage["cpu_seconds"])
+        if usage.get("peak_memory_bytes") is not None:
+            metrics.histogram("sandbox_peak_memory_bytes", buckets=MEMORY_BYTES_BUCKETS).observe(usage["peak_memory_bytes"])
+        if usage.get("oom_killed"):
+            metrics.counter("sandbox_oom_kills_total").inc()
+
+    def _fetch_artifacts(self, container, meta: dict) -> list:
+        """用一次 tar exec 取回 runner 报告的输出文件，超出 SANDBOX_MAX_ARTIFACT_BYTES 的文件只返回元信息"""
+        figures = meta.get("figures") or {}
+        artifacts, wanted, budget = [], [], SANDBOX_MAX_ARTIFACT_BYTES
+        for entry in meta["artifacts"]:
+            artifact = {
+                "name": entry["name"],
+                "content_type": mimetypes.guess_type(entry["name"])[0] or "application/octet-stream",
+                "size": entry["size"],
+            }
+            if entry["name"] in figures:
+                artifact["title"] = figures[entry["name"]]
+            if entry["size"] <= budget:
+                budget -= entry["size"]
+                wanted.append(entry["name"])
+            else:
+                artifact["omitted"] = f"Exceeds the {SANDBOX_MAX_ARTIFACT_BYTES}-byte artifact limit."
+            artifacts.append(artifact)
+        if not wanted:
+            return artifacts
+
+        try:
+            exit_code, archive = container.exec_run(
+                ["tar", "-cf", "-", "-C", SANDBOX_OUTPUTS_DIR, "--"] + wanted, stdout=True, stderr=False
             )
+            contents = {}
+            with tarfile.open(fileobj=io.BytesIO(archive), mode="r:") as tar:
+                for member in tar:
+                    if member.isfile():
+                        contents[member.name] = tar.extractfile(member).read()
+        except Exception as e:
+            logger.warning(f"Failed to collect sandbox artifacts: {e}")
+            contents = {}
+        for artifact in artifacts:
+            content = contents.get(artifact["name"])
+            if content is not None:
+                artifact["size"] = len(content)
+                artifact["data_base64"] = base64.b64encode(content).decode("ascii")
+            elif "omitted" not in artifact:
+                artifact["omitted"] = "Could not be read from the sandbox."
+        metrics.counter("sandbox_artifacts_total").inc(len(contents))
+        return artifacts
+
+    def _run_in_pool(self, pool: SandboxContainerPool, parameters: CodeInterpreterInput,
+                     on_output: Optional[Callable[[str, str], None]] = None,
+                     handle: Optional[ExecutionHandle] = None) -> dict:
+        """在执行线程中运行：租用预热容器，把代码交给容器内的 forkserver 执行"""
+        if handle and handle.cancelled:
+            return {"success": False, "error": "Execution cancelled."}
+        try:
+            with pool.lease() as pooled:
+                data, meta = self._exec_snippet(pooled.container, parameters, on_output=on_output, handle=handle)
+                if meta is None:
+                    # 超时被 kill，或者 runner 没有写出元数据（forkserver 已不可用）：销毁容器
+                    pooled.dirty = True
             
-            # 解码输出
-            stdout = output.decode('utf-8', errors='ignore')
-            
-            return {
-                "success": True,
-                "data": {
-                    "stdout": stdout,
-                    "stderr": "",  # 在此模式下，stderr通常合并到stdout
-                    "exit_code": 0 # 如果执行到这里，说明没有抛出异常，exit_code为0
-                }
-            }
+            # 代码本身出错时 exit_code 非零，但执行过程是成功的
+            return {"success": True, "data": data}
             
-        except ContainerError as e:
-            # 容器内代码执行出错 (非零退出码)
-            stdout = e.stdout.decode('utf-8', errors='ignore') if e.stdout else ""
-            stderr = e.stderr.decode('utf-8', errors='ignore') if e.stderr else ""
-                
-            return {
-                "success": True, # 成功执行了代码，但代码本身有错误
-                "data": {
-                    "stdout": stdout,
-                    "stderr": stderr,
-                    "exit_code": e.exit_status
-                }
-            }
+        except TimeoutError as e:
+            return {"success": False, "error": f"Sandbox busy: {e}"}
         except Exception as e:
             logger.error(f"Sandbox error: {e}")
             return {"success": False, "error": f"Sandbox error: {e}"}
 
+    def _run_in_session(self, parameters: CodeInterpreterInput,
+                        on_output: Optional[Callable[[str, str], None]] = None,
+                        handle: Optional[ExecutionHandle] = None) -> dict:
+        """在执行线程中运行：在会话独占的容器中执行，复用之前调用留下的变量和导入"""
+        if handle and handle.cancelled:
+            return {"success": False, "error": "Execution cancelled."}
+        session_id = parameters.session_id
+        try:
+            while True:
+                session = self.sessions.get_or_create(session_id)
+                with session.lock:
+                    if session.closed:
+                        continue  # 会话刚好被回收，重新创建
+                    try:
+                        data, meta = self._exec_snippet(
+                            session.pooled.container, parameters, session=True, on_output=on_output, handle=handle
+                        )
+                    except Exception:
+                        self.sessions.close(session_id, reason="error")
+                        raise
+                    session.runs += 1
+                    session.last_used = time.monotonic()
+                    break
+
+            if meta is None:
+                reason = "timeout" if data["timed_out"] else "cancelled" if data["status"] == "cancelled" else "error"
+                self.sessions.close(session_id, reason=reason)
+                data["session_lost"] = True
+            elif meta.get("session_lost"):
+                # 会话进程在执行中退出（例如超出内存上限），之前的变量已丢失，下次调用从空白状态开始
+                metrics.counter("sandbox_sessions_lost_total").inc()
+                data["session_lost"] = True
+            if parameters.close_session:
+                self.sessions.close(session_id)
+            data["session_id"] = session_id
+            return {"success": True, "data": data}
+
+        except (SandboxBusyError, TimeoutError) as e:
+            return {"success": False, "error": f"Sandbox busy: {e}"}
+        except Exception as e:
+            logger.error(f"Sandbox session error: {e}")
+            return {"success": False, "error": f"Sandbox session error: {e}"}
+
 # --- FastAPI Application ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global code_interpreter_instance
     code_interpreter_instance = CodeInterpreterTool()
+    try:
+        await code_interpreter_instance.initialize()
+    except Exception as e:
+        logger.error(f"Sandbox pool failed to start: {e}")
     yield
+    await code_interpreter_instance.cleanup()
     if code_interpreter_instance and code_interpreter_instance.docker_client:
         code_interpreter_instance.docker_client.close()
 
 app = FastAPI(lifespan=lifespan)
 
+def parse_sandbox_request(request_data: dict) -> CodeInterpreterInput:
+    parameters = request_data.get('parameters', {})
+    if not parameters.get('code'):
+        raise HTTPException(status_code=422, detail="Missing 'code' field.")
+    try:
+        return CodeInterpreterInput(**parameters)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 @app.post('/api/v1/python_sandbox')
 async def run_python_sandbox(request_data: dict):
     try:
-        code_to_execute = request_data.get('parameters', {}).get('code')
-        if not code_to_execute:
-            raise HTTPException(status_code=422, detail="Missing 'code' field.")
-
-        input_data = CodeInterpreterInput(code=code_to_execute)
+        input_data = parse_sandbox_request(request_data)
         result = await code_interpreter_instance.execute(input_data)
         
         if result.get("success"):
             return result.get("data")
         else:
             raise HTTPException(status_code=500, detail=result.get("error"))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Internal server error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post('/api/v1/python_sandbox/stream')
+async def stream_python_sandbox(request_data: dict):
+    """Execute code and stream stdout/stderr as NDJSON events while it runs"""
+    input_data = parse_sandbox_request(request_data)
+
+    async def events():
+        async for event in code_interpreter_instance.stream(input_data):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.get('/api/v1/python_sandbox/datasets')
+async def list_sandbox_datasets():
+    """List read-only datasets mounted into every sandbox"""
+    return {
+        "mounted": bool(SANDBOX_DATASETS_HOST_DIR),
+        "datasets_dir": SANDBOX_DATASETS_DIR,
+        "datasets": await code_interpreter_instance.list_datasets(),
+    }
+
+@app.get('/api/v1/python_sandbox/sessions')
+async def list_sandbox_sessions():
+    """List active stateful sessions"""
+    return {"sessions": code_interpreter_instance.list_sessions()}
+
+@app.delete('/api/v1/python_sandbox/sessions/{session_id}')
+async def close_sandbox_session(session_id: str):
+    """Close a session and destroy its container"""
+    if not await code_interpreter_instance.close_session(session_id):
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+    return {"session_id": session_id, "closed": True}
+
 @app.get('/health')
 async def health_check():
     """Health check endpoint"""
     try:
         if code_interpreter_instance and code_interpreter_instance.docker_client:
             code_interpreter_instance.docker_client.ping()
-            return {"status": "healthy", "docker": "connected"}
+            return {"status": "healthy", "docker": "connected", **code_interpreter_instance.stats()}
         else:
             return {"status": "degraded", "docker": "not_available"}
     except Exception as e:
         return {"status": "degraded", "docker": f"error: {e}"}
 
+@app.get('/metrics')
+async def get_metrics():
+    """Pool and execution metrics"""
+    return metrics.snapshot()
+
 @app.get('/')
 async def root():
     """Root endpoint with basic info"""
@@ -284,6 +1407,11 @@ async def root():
         "version": "1.0",
         "endpoints": {
             "execute_code": "POST /api/v1/python_sandbox",
-            "health_check": "GET /health"
+            "stream_code": "POST /api/v1/python_sandbox/stream",
+            "list_datasets": "GET /api/v1/python_sandbox/datasets",
+            "list_sessions": "GET /api/v1/python_sandbox/sessions",
+            "close_session": "DELETE /api/v1/python_sandbox/sessions/{session_id}",
+            "health_check": "GET /health",
+            "metrics": "GET /metrics"
         }
     }
\ No newline at end of file
@@ -5,7 +5,7 @@ import gc
 import psutil
 import time
 import json
-from typing import Dict, Any, List, Optional, Literal
+from typing import AsyncIterator, Dict, Any, List, Optional, Literal
 from pydantic import BaseModel, Field
 from crawl4ai import AsyncWebCrawler
 from crawl4ai import CrawlerRunConfig, CacheMode
@@ -17,11 +17,19 @@ from crawl4ai.content_scraping_strategy import LXMLWebScrapingStrategy
 from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
 from crawl4ai.content_filter_strategy import PruningContentFilter
 import logging
+import os
 from PIL import Image
+from pydantic import ValidationError
+
+from .url_utils import canonicalize_url
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# batch_crawl 的并发上限与单个 URL 超时上限（秒）
+CRAWL4AI_BATCH_MAX_CONCURRENCY = int(os.getenv("CRAWL4AI_BATCH_MAX_CONCURRENCY", "10"))
+CRAWL4AI_BATCH_MAX_URL_TIMEOUT = float(os.getenv("CRAWL4AI_BATCH_MAX_URL_TIMEOUT", "300"))
+
 # 1. 扩展输入模型以支持新功能
 class ScrapeParams(BaseModel):
     url: str = Field(description="The URL of the page to scrape.")
@@ -63,9 +71,10 @@ class ExtractParams(BaseModel):
     prompt: Optional[str] = Field(default=None, description="Prompt for LLM extraction.")
 
 class BatchCrawlParams(BaseModel):
-    urls: List[str] = Field(description="List of URLs to crawl.")
-    stream: bool = Field(default=False, description="Stream results as they complete.")
-    concurrent_limit: int = Field(default=3, description="Maximum concurrent crawls.")
+    urls: List[str] = Field(description="List of URLs to crawl (duplicates after URL canonicalization are crawled once).")
+    stream: bool = Field(default=False, description="Stream results as they complete (use the /api/v1/execute_tool/stream endpoint).")
+    concurrent_limit: int = Field(default=3, ge=1, le=CRAWL4AI_BATCH_MAX_CONCURRENCY, description="Maximum concurrent crawls.")
+    timeout_per_url: float = Field(default=60, gt=0, le=CRAWL4AI_BATCH_MAX_URL_TIMEOUT, description="Timeout in seconds for each URL.")
 
 class PdfExportParams(BaseModel):
     url: str = Field(description="The URL to export as PDF.")
@@ -156,6 +165,8 @@ class EnhancedCrawl4AITool:
         "and advanced content filtering. All outputs are returned as memory streams (base64 for binary data)."
     )
     input_schema = Crawl4AIInput
+    # stream() 以 {"type": "done"} 事件结束，可直接用于 /api/v1/execute_tool/stream
+    streams_done_events = True
 
     def __init__(self):
         self.crawler = None
@@ -169,6 +180,8 @@ class EnhancedCrawl4AITool:
         self._last_memory_check = 0
         self._memory_check_interval = 60
         self._browser_lock = asyncio.Lock()
+        # 正在执行的任务数：有其他任务共用浏览器时，任务后清理不关闭页面、不重启浏览器
+        self._running = 0
         self.compressor = ScreenshotCompressor()
         logger.info("EnhancedCrawl4AITool instance created")
 
@@ -296,6 +309,8 @@ class EnhancedCrawl4AITool:
 
     async def _cleanup_after_task(self):
         """任务后清理页面资源 - 优化版本"""
+        if self._running > 1:
+            return
         try:
             # ✅ 1. 主动清理：每次都尝试关闭多余页面
             crawler = await self._get_crawler()
@@ -605,85 +620,118 @@ class EnhancedCrawl4AITool:
         finally:
             await self._cleanup_after_task()
 
+    @staticmethod
+    def _dedupe_urls(urls: List[str]) -> List[str]:
+        """按规范化后的 URL 去重，保留第一次出现的原始 URL"""
+        seen = set()
+        unique = []
+        for url in urls:
+            key = canonicalize_url(url)
+            if key not in seen:
+                seen.add(key)
+                unique.append(url)
+        return unique
+
+    async def _crawl_batch_url(self, crawler, index: int, url: str, config, timeout: float) -> Dict[str, Any]:
+        """抓取批量任务中的一个 URL（每次 arun 使用独立的页面），异常与超时都转换为失败结果"""
+        try:
+            result = await asyncio.wait_for(crawler.arun(url=url, config=config), timeout=timeout)
+        except asyncio.TimeoutError:
+            return {"index": index, "url": url, "success": False, "error": f"抓取超时（{timeout:g}秒）"}
+        except Exception as e:
+            return {"index": index, "url": url, "success": False, "error": str(e)}
+        if not result.success:
+            return {"index": index, "url": url, "success": False, "error": result.error_message}
+        content = getattr(result, 'markdown', '') or ''
+        return {
+            "index": index,
+            "url": result.url,
+            "success": True,
+            "title": getattr(result, 'title', ''),
+            "content": content,
+            "metadata": {
+                "word_count": len(content),
+                "status_code": getattr(result, 'status_code', 200)
+            }
+        }
+
+    async def _iter_batch(self, urls: List[str], params: BatchCrawlParams) -> AsyncIterator[Dict[str, Any]]:
+        """
+        concurrent_limit 个 worker 从同一个迭代器中依次领取 URL 并发抓取，按完成顺序产出结果。
+        结果队列有界，消费方（流式响应）较慢时 worker 会暂停，列表再长内存占用也有上限。
+        """
+        crawler = await self._get_crawler()
+        if crawler is None:
+            raise RuntimeError("浏览器实例未正确初始化")
+        config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, word_count_threshold=10)
+        pending = iter(enumerate(urls))
+        queue: asyncio.Queue = asyncio.Queue(maxsize=params.concurrent_limit)
+
+        async def worker():
+            for index, url in pending:
+                await queue.put(await self._crawl_batch_url(crawler, index, url, config, params.timeout_per_url))
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(params.concurrent_limit, len(urls)))]
+        try:
+            for _ in range(len(urls)):
+                yield await queue.get()
+        finally:
+            for task in workers:
+                task.cancel()
+
+    @staticmethod
+    def _batch_summary(total: int, unique: int, successful: int, started: float) -> Dict[str, Any]:
+        return {
+            "total_urls": total,
+            "unique_urls": unique,
+            "duplicate_urls": total - unique,
+            "successful_crawls": successful,
+            "failed_crawls": unique - successful,
+            "success_rate": (successful / unique) * 100 if unique else 0,
+            "elapsed_seconds": round(time.time() - started, 2)
+        }
+
+    async def _recover_if_crashed(self, error: Optional[Exception] = None):
+        """
+        批量任务结束后按需重启浏览器：整个批量任务因浏览器类错误失败（error），或浏览器已断开连接。
+        单个 URL 的错误（如导航时的 "Execution context was destroyed"）只记录在结果中，不触发重启；
+        有其他任务正在使用浏览器时也不重启，以免中断它们。
+        """
+        if error is not None:
+            crashed = "browser" in str(error).lower() or "context" in str(error).lower() or "NoneType" in str(error)
+        else:
+            browser = getattr(self.crawler, 'browser', None)
+            crashed = browser is not None and not browser.is_connected()
+            error = RuntimeError("浏览器已断开连接")
+        if not crashed:
+            return
+        if self._running > 1:
+            logger.warning(f"⚠️ 浏览器可能已崩溃，但仍有 {self._running - 1} 个任务在使用，暂不重启: {error}")
+            return
+        await self._handle_browser_crash(error)
+
     async def _batch_crawl_urls(self, params: BatchCrawlParams) -> Dict[str, Any]:
-        """批量爬取多个URL - 优化版本"""
-        logger.info(f"🔗 开始批量爬取 {len(params.urls)} 个URL")
+        """批量并发爬取多个URL：按规范化 URL 去重，最多 concurrent_limit 个页面同时抓取"""
+        started = time.time()
+        urls = self._dedupe_urls(params.urls)
+        logger.info(f"🔗 开始批量爬取 {len(urls)} 个URL（去重前 {len(params.urls)} 个，并发 {params.concurrent_limit}）")
         
         try:
-            crawler = await self._get_crawler()
-            if crawler is None:
-                return {
-                    "success": False, 
-                    "error": "浏览器实例未正确初始化",
-                    "memory_info": await self._get_system_memory_info()
-                }
-            
-            # 使用更轻量的配置
-            config = CrawlerRunConfig(
-                cache_mode=CacheMode.BYPASS,
-                word_count_threshold=10,
-                stream=params.stream
-            )
-            
-            crawled_results = []
-            successful_crawls = 0
-            
-            # 对于批量爬取，使用更保守的方式
-            for url in params.urls:
-                if len(crawled_results) >= 10:  # 安全限制
-                    break
-                    
-                try:
-                    result = await self._execute_with_timeout(
-                        crawler.arun(url=url, config=config),
-                        timeout=60
-                    )
-                    
-                    if result.success:
-                        page_data = {
-                            "url": result.url,
-                            "title": getattr(result, 'title', ''),
-                            "content": getattr(result, 'markdown', ''),
-                            "metadata": {
-                                "word_count": len(getattr(result, 'markdown', '')),
-                                "status_code": getattr(result, 'status_code', 200)
-                            }
-                        }
-                        crawled_results.append(page_data)
-                        successful_crawls += 1
-                    else:
-                        crawled_results.append({
-                            "url": url,
-                            "error": result.error_message,
-                            "success": False
-                        })
-                        
-                    # 每个URL之间短暂延迟
-                    await asyncio.sleep(1)
-                    
-                except Exception as e:
-                    crawled_results.append({
-                        "url": url,
-                        "error": str(e),
-                        "success": False
-                    })
+            crawled_results = [page async for page in self._iter_batch(urls, params)]
+            crawled_results.sort(key=lambda page: page["index"])
+            await self._recover_if_crashed()
+            successful_crawls = sum(1 for page in crawled_results if page["success"])
             
             return {
                 "success": True,
                 "results": crawled_results,
-                "summary": {
-                    "total_urls": len(params.urls),
-                    "successful_crawls": successful_crawls,
-                    "failed_crawls": len(params.urls) - successful_crawls,
-                    "success_rate": (successful_crawls / len(params.urls)) * 100 if params.urls else 0
-                },
+                "summary": self._batch_summary(len(params.urls), len(urls), successful_crawls, started),
                 "memory_info": await self._get_system_memory_info()
             }
             
         except Exception as e:
             logger.error(f"❌ 批量爬取错误: {str(e)}")
-            if "browser" in str(e).lower() or "context" in str(e).lower() or "NoneType" in str(e):
-                await self._handle_browser_crash(e)
+            await self._recover_if_crashed(e)
             return {
                 "success": False, 
                 "error": f"批量爬取错误: {str(e)}",
@@ -942,6 +990,7 @@ class EnhancedCrawl4AITool:
 
     async def execute(self, parameters: Crawl4AIInput) -> dict:
         """执行工具的主要方法"""
+        self._running += 1
         try:
             mode = parameters.mode
             params = parameters.parameters
@@ -951,8 +1000,8 @@ class EnhancedCrawl4AITool:
             # 任务计数和定期强制清理
             self._task_count += 1
 
-            # 只有在达到清理间隔时才执行内存检查
-            if self._task_count % self._cleanup_interval == 0:
+            # 只有在达到清理间隔、且没有其他任务在使用浏览器时才执行内存检查
+            if self._task_count % self._cleanup_interval == 0 and self._running == 1:
                 memory_ok = await self._check_memory_health()
                 if not memory_ok:
                     logger.warning("⚠️ 执行前内存检查失败，先执行清理")
@@ -1002,6 +1051,51 @@ class EnhancedCrawl4AITool:
                 "error": f"发生错误: {str(e)}",
                 "memory_info": await self._get_system_memory_info()
             }
+        finally:
+            self._running -= 1
+
+    async def stream(self, parameters: Crawl4AIInput) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式执行：batch_crawl 每抓完一个 URL 产出一个 {"type": "page"} 事件，最后产出 {"type": "done"} 汇总；
+        其他模式只产出一个包含完整结果的 done 事件。
+        """
+        if parameters.mode != 'batch_crawl':
+            yield {"type": "done", **await self.execute(parameters)}
+            return
+        try:
+            params = BatchCrawlParams(**parameters.parameters)
+        except ValidationError as e:
+            yield {"type": "done", "success": False, "error": f"参数错误: {e}"}
+            return
+
+        started = time.time()
+        urls = self._dedupe_urls(params.urls)
+        successful = 0
+        self._running += 1
+        self._task_count += 1
+        try:
+            await self.initialize()
+            async for page in self._iter_batch(urls, params):
+                if page["success"]:
+                    successful += 1
+                yield {"type": "page", **page}
+            await self._recover_if_crashed()
+        except Exception as e:
+            logger.error(f"❌ 批量流式爬取错误: {str(e)}")
+            await self._recover_if_crashed(e)
+            yield {"type": "done", "success": False, "error": f"批量爬取错误: {str(e)}"}
+            return
+        finally:
+            # 先清理再减计数，与 execute() 一致：其他任务仍在运行时 _cleanup_after_task 必须看到它们
+            try:
+                await self._cleanup_after_task()
+            finally:
+                self._running -= 1
+        yield {
+            "type": "done",
+            "success": True,
+            "summary": self._batch_summary(len(params.urls), len(urls), successful, started)
+        }
 
     async def cleanup(self):
         """清理资源"""
@@ -0,0 +1,119 @@
+"""
+FEN 校验与规范化。
+
+校验在进入引擎池之前完成，不需要额外的引擎往返：先用正则做格式检查，再用 python-chess 检查
+局面合法性（非走棋方被将军、兵数过多等局面会让 Stockfish 崩溃或给出错误结果）；
+规范化是纯字符串处理，规范化后的 FEN 用作分析缓存的键，
+使同一局面的不同写法（回合数、无效的王车易位权、不可吃的过路兵格）命中同一条缓存。
+半回合计数保留在键中：Stockfish 按 50 步计数缩放静态评估，不同计数下的分数和最佳走法可能不同。
+"""
+
+import re
+from typing import List, Tuple
+
+import chess
+
+_FEN_RE = re.compile(r"^((?:[rnbqkpRNBQKP1-8]+/){7}[rnbqkpRNBQKP1-8]+) ([bw]) (-|[KQkq]{1,4}) (-|[a-h][36]) (\d+) (\d+)$")
+
+_CASTLING_SQUARES = {
+    # 权利: (王所在格, 车所在格, 王, 车)
+    "K": ("e1", "h1", "K", "R"),
+    "Q": ("e1", "a1", "K", "R"),
+    "k": ("e8", "h8", "k", "r"),
+    "q": ("e8", "a8", "k", "r"),
+}
+
+
+def _parse_board(placement: str) -> List[List[str]]:
+    """返回 8x8 棋盘，board[0] 为第 8 行，空格为 ''。格式错误时抛出 ValueError"""
+    board = []
+    for row in placement.split("/"):
+        squares: List[str] = []
+        previous_was_digit = False
+        for c in row:
+            if c.isdigit():
+                if previous_was_digit:
+                    raise ValueError(f"Invalid FEN row '{row}': two adjacent digits.")
+                squares.extend([""] * int(c))
+                previous_was_digit = True
+            else:
+                squares.append(c)
+                previous_was_digit = False
+        if len(squares) != 8:
+            raise ValueError(f"Invalid FEN row '{row}': must describe exactly 8 squares.")
+        board.append(squares)
+    return board
+
+
+def _piece_at(board: List[List[str]], square: str) -> str:
+    return board[8 - int(square[1])][ord(square[0]) - ord("a")]
+
+
+def parse_fen(fen: str) -> Tuple[List[List[str]], List[str]]:
+    """
+    校验 FEN 并返回 (棋盘, 6 个字段)。
+    检查字段格式、每行 8 格、双方各有且仅有一个王、第 1/8 行没有兵；不合法时抛出 ValueError。
+    """
+    fields = fen.split()
+    match = _FEN_RE.match(" ".join(fields))
+    if not match:
+        raise ValueError(f"Invalid FEN string: {fen}")
+    board = _parse_board(match.group(1))
+    pieces = [p for row in board for p in row if p]
+    if pieces.count("K") != 1 or pieces.count("k") != 1:
+        raise ValueError("Invalid FEN: each side must have exactly one king.")
+    if any(p in ("P", "p") for p in board[0] + board[7]):
+        raise ValueError("Invalid FEN: pawns cannot stand on the first or last rank.")
+    return board, fields
+
+
+def validate_fen(fen: str) -> str:
+    """校验 FEN 的格式和局面合法性，返回去除多余空白后的字符串；不合法时抛出 ValueError"""
+    _, fields = parse_fen(fen)
+    fen = " ".join(fields)
+    status = chess.Board(fen).status()
+    if status != chess.STATUS_VALID:
+        reasons = [name[len("STATUS_"):].lower() for name in dir(chess)
+                   if name.startswith("STATUS_") and name != "STATUS_VALID" and status & getattr(chess, name)]
+        raise ValueError(f"Illegal position in FEN ({', '.join(reasons)}): {fen}")
+    return fen
+
+
+def normalize_fen(fen: str) -> str:
+    """
+    规范化 FEN：
+    - 去掉与王、车位置不符的王车易位权，并按 KQkq 排序；
+    - 去掉没有兵能够吃过路兵的过路兵格；
+    - 保留半回合计数（去掉前导零），回合数固定为 1。
+    结果仍是合法的 FEN，局面（对引擎而言）与输入相同。
+    """
+    board, (placement, turn, castling, ep_square, halfmove, _) = parse_fen(fen)
+
+    rights = "".join(
+        right for right in "KQkq"
+        if right in castling
+        and _piece_at(board, _CASTLING_SQUARES[right][0]) == _CASTLING_SQUARES[right][2]
+        and _piece_at(board, _CASTLING_SQUARES[right][1]) == _CASTLING_SQUARES[right][3]
+    ) or "-"
+
+    if ep_square != "-":
+        file_index = ord(ep_square[0]) - ord("a")
+        # 白方走棋时过路兵格在第 6 行，被吃的黑兵在第 5 行，能吃的白兵也在第 5 行
+        pawn_rank, own_pawn, their_pawn, expected_rank = ("5", "P", "p", "6") if turn == "w" else ("4", "p", "P", "3")
+        pushed = ep_square[0] + pawn_rank
+        capturers = [
+            chr(ord("a") + f) + pawn_rank for f in (file_index - 1, file_index + 1) if 0 <= f < 8
+        ]
+        if (
+            ep_square[1] != expected_rank
+            or _piece_at(board, pushed) != their_pawn
+            or _piece_at(board, ep_square)
+            or not any(_piece_at(board, sq) == own_pawn for sq in capturers)
+        ):
+            ep_square = "-"
+
+    return f"{placement} {turn} {rights} {ep_square} {int(halfmove)} 1"
+
+
+def side_to_move(fen: str) -> str:
+    return fen.split()[1]
@@ -0,0 +1,299 @@
+"""
+Firecrawl 异步任务（crawl / extract）的服务端管理。
+
+提交的任务记录在一个 SQLite 文件中，由本机所有 worker 共享：每个 worker 为自己关心的任务
+启动后台轮询（间隔按指数增长），轮询前先在表中“认领”本轮，其他 worker 在同一间隔内
+直接读取表中的最新状态，而不是重复调用 API。完成（或失败）的结果保留在表中，
+条目数超过上限时淘汰最早完成的任务。`wait` 长轮询期间每 FIRECRAWL_WAIT_POLL_INTERVAL 秒
+刷新一次状态（不受后台轮询退避的影响），任务结束后最多在该间隔内返回。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .metrics import metrics
+from .rate_limiter import status_code_of
+
+logger = logging.getLogger(__name__)
+
+# 任务表路径；设为空字符串时每个 worker 使用各自的内存数据库（不跨 worker 共享）
+FIRECRAWL_JOB_DB = os.getenv(
+    "FIRECRAWL_JOB_DB", os.path.join(tempfile.gettempdir(), "py_tool_server_firecrawl_jobs.db")
+)
+# 最多保留的已结束任务数，以及任何任务在表中保留的最长时间（秒）
+FIRECRAWL_JOB_STORE_SIZE = int(os.getenv("FIRECRAWL_JOB_STORE_SIZE", "200"))
+FIRECRAWL_JOB_TTL = float(os.getenv("FIRECRAWL_JOB_TTL", "86400"))
+# 后台轮询：首个间隔、增长倍数、最大间隔，以及单个任务最多轮询多久（秒）
+FIRECRAWL_POLL_INITIAL = float(os.getenv("FIRECRAWL_POLL_INITIAL", "2"))
+FIRECRAWL_POLL_FACTOR = float(os.getenv("FIRECRAWL_POLL_FACTOR", "1.5"))
+FIRECRAWL_POLL_MAX = float(os.getenv("FIRECRAWL_POLL_MAX", "30"))
+FIRECRAWL_POLL_MAX_SECONDS = float(os.getenv("FIRECRAWL_POLL_MAX_SECONDS", "3600"))
+# 有等待者时的状态刷新间隔（秒）
+FIRECRAWL_WAIT_POLL_INTERVAL = float(os.getenv("FIRECRAWL_WAIT_POLL_INTERVAL", "2"))
+
+TERMINAL_STATUSES = {"completed", "failed", "cancelled"}
+
+StatusFetcher = Callable[[str, str], Awaitable[Any]]
+
+
+def to_plain(value: Any) -> Any:
+    """把 SDK 返回的对象（pydantic 模型、dataclass 风格对象）转换为可 JSON 序列化的结构"""
+    if hasattr(value, "model_dump"):
+        value = value.model_dump()
+    elif hasattr(value, "dict") and callable(value.dict) and not isinstance(value, dict):
+        value = value.dict()
+    elif hasattr(value, "__dict__") and not isinstance(value, (dict, list, str, int, float, bool)):
+        value = {k: v for k, v in vars(value).items() if not k.startswith("_")}
+    return json.loads(json.dumps(value, default=str))
+
+
+def job_id_of(response: Any) -> str:
+    """从 start_crawl / start_extract 的返回值中取任务 ID"""
+    if isinstance(response, str):
+        return response
+    data = to_plain(response)
+    if isinstance(data, dict):
+        for key in ("id", "job_id", "jobId"):
+            if data.get(key):
+                return str(data[key])
+    raise ValueError(f"Firecrawl did not return a job id: {str(data)[:200]}")
+
+
+def job_response(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    check_status / wait 的返回格式：Firecrawl 最近一次返回的状态（status、total、completed、data 等，
+    与直接调用 SDK 时相同）放在顶层，任务表中的字段（job_id、kind、finished、polls、时间戳）与之并列。
+    status 与 error 以任务表为准（例如任务已不存在时为 failed）。
+    """
+    payload = snapshot.get("data")
+    result = dict(payload) if isinstance(payload, dict) else {}
+    for key in ("job_id", "kind", "status", "finished", "polls", "submitted_at", "updated_at"):
+        if key in snapshot:
+            result[key] = snapshot[key]
+    if snapshot.get("error") is not None:
+        result["error"] = snapshot["error"]
+    return result
+
+
+class JobManager:
+    """
+    fetch_status(kind, job_id) 返回任务的当前状态（SDK 对象或字典，需含 status 字段）。
+    """
+
+    def __init__(self, fetch_status: StatusFetcher, db_path: str = FIRECRAWL_JOB_DB,
+                 max_jobs: int = FIRECRAWL_JOB_STORE_SIZE):
+        self.fetch_status = fetch_status
+        self.max_jobs = max_jobs
+        self._db = sqlite3.connect(db_path or ":memory:", check_same_thread=False, timeout=5.0)
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            if db_path:
+                self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, finished INTEGER NOT NULL, "
+                "data TEXT, error TEXT, polls INTEGER NOT NULL, submitted_at REAL NOT NULL, "
+                "updated_at REAL NOT NULL, polled_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        # 本进程内的轮询任务与等待者
+        self._pollers: Dict[str, asyncio.Task] = {}
+        self._events: Dict[str, asyncio.Event] = {}
+
+    # --- 存储 ---
+    def _row(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            cursor = self._db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+            row = cursor.fetchone()
+            columns = [c[0] for c in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def _insert(self, job_id: str, kind: str, polled: bool):
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO jobs (job_id, kind, status, finished, data, error, polls, "
+                "submitted_at, updated_at, polled_at) VALUES (?, ?, 'pending', 0, NULL, NULL, 0, ?, ?, ?)",
+                (job_id, kind, now, now, now if polled else 0.0),
+            )
+            self._db.commit()
+
+    def _claim(self, job_id: str, interval: float) -> bool:
+        """认领一次轮询：距上次轮询（任何 worker）不足 interval 秒时返回 False"""
+        now = time.time()
+        with self._db_lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET polled_at = ? WHERE job_id = ? AND finished = 0 AND polled_at <= ?",
+                (now, job_id, now - interval),
+            )
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def _save(self, job_id: str, status: Optional[str], finished: bool, data: Any = None, error: Optional[str] = None):
+        with self._db_lock:
+            self._db.execute(
+                "UPDATE jobs SET status = COALESCE(?, status), finished = ?, data = COALESCE(?, data), error = ?, "
+                "polls = polls + 1, updated_at = ? WHERE job_id = ?",
+                (status, int(finished), json.dumps(data) if data is not None else None, error, time.time(), job_id),
+            )
+            if finished:
+                self._prune()
+            self._db.commit()
+
+    def _prune(self):
+        # 调用方已持有 _db_lock
+        self._db.execute("DELETE FROM jobs WHERE updated_at < ?", (time.time() - FIRECRAWL_JOB_TTL,))
+        self._db.execute(
+            "DELETE FROM jobs WHERE finished = 1 AND job_id NOT IN ("
+            "SELECT job_id FROM jobs WHERE finished = 1 ORDER BY updated_at DESC LIMIT ?)",
+            (self.max_jobs,),
+        )
+
+    @staticmethod
+    def _snapshot(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "job_id": row["job_id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "finished": bool(row["finished"]),
+            "polls": row["polls"],
+            "submitted_at": row["submitted_at"],
+            "updated_at": row["updated_at"],
+            "error": row["error"],
+            "data": json.loads(row["data"]) if row["data"] else None,
+        }
+
+    # --- 轮询 ---
+    async def _poll_once(self, job_id: str, kind: str) -> bool:
+        """调用一次状态接口并写回；返回任务是否已结束"""
+        try:
+            data = to_plain(await self.fetch_status(kind, job_id))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status = status_code_of(e)
+            metrics.counter("firecrawl_job_polls_total", kind=kind, result="error").inc()
+            # 任务不存在或请求本身无效：不再轮询；其他错误保留上次的状态，下一轮重试
+            finished = status in (400, 404)
+            await asyncio.to_thread(self._save, job_id, "failed" if finished else None, finished, None, str(e))
+            return finished
+        metrics.counter("firecrawl_job_polls_total", kind=kind, result="ok").inc()
+        status = str(data.get("status", "unknown")) if isinstance(data, dict) else "unknown"
+        finished = status in TERMINAL_STATUSES
+        error = data.get("error") if isinstance(data, dict) and status == "failed" else None
+        await asyncio.to_thread(self._save, job_id, status, finished, data, error)
+        if finished:
+            metrics.counter("firecrawl_jobs_finished_total", kind=kind, status=status).inc()
+            self._wake(job_id)
+        return finished
+
+    def _wake(self, job_id: str):
+        event = self._events.get(job_id)
+        if event is not None:
+            event.set()
+
+    async def _poll_loop(self, job_id: str, kind: str):
+        delay = FIRECRAWL_POLL_INITIAL
+        deadline = time.monotonic() + FIRECRAWL_POLL_MAX_SECONDS
+        try:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(delay)
+                row = await asyncio.to_thread(self._row, job_id)
+                if row is None or row["finished"]:
+                    break
+                # 其他 worker 在本间隔内已轮询过时，只读取表中的结果
+                if await asyncio.to_thread(self._claim, job_id, delay * 0.9):
+                    if await self._poll_once(job_id, kind):
+                        break
+                delay = min(delay * FIRECRAWL_POLL_FACTOR, FIRECRAWL_POLL_MAX)
+            else:
+                logger.warning(f"Stopped polling Firecrawl {kind} job {job_id} after {FIRECRAWL_POLL_MAX_SECONDS:g}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Polling Firecrawl {kind} job {job_id} failed: {e}")
+        finally:
+            self._pollers.pop(job_id, None)
+            event = self._events.pop(job_id, None)
+            if event is not None:
+                # 唤醒等待者：任务结束，或本进程不再轮询（等待者读取当前状态返回）
+                event.set()
+
+    def _ensure_poller(self, job_id: str, kind: str):
+        if job_id not in self._pollers:
+            self._pollers[job_id] = asyncio.create_task(self._poll_loop(job_id, kind))
+
+    # --- 对外接口 ---
+    async def submit(self, kind: str, job_id: str) -> Dict[str, Any]:
+        """登记一个刚提交的任务并开始后台轮询"""
+        await asyncio.to_thread(self._insert, job_id, kind, True)
+        metrics.counter("firecrawl_jobs_submitted_total", kind=kind).inc()
+        self._ensure_poller(job_id, kind)
+        return self._snapshot(await asyncio.to_thread(self._row, job_id))
+
+    async def _track(self, job_id: str, kind: Optional[str]) -> Dict[str, Any]:
+        """返回任务记录；未登记的任务（其他服务提交或记录已淘汰）立即查询一次并开始跟踪"""
+        row = await asyncio.to_thread(self._row, job_id)
+        if row is None:
+            kind = kind or "crawl"
+            await asyncio.to_thread(self._insert, job_id, kind, False)
+            row = await asyncio.to_thread(self._row, job_id)
+        if row["finished"]:
+            metrics.counter("firecrawl_job_status_total", source="store").inc()
+            return row
+        polled = await self._refresh(job_id, row["kind"], FIRECRAWL_POLL_INITIAL)
+        metrics.counter("firecrawl_job_status_total", source="api" if polled else "store").inc()
+        row = await asyncio.to_thread(self._row, job_id)
+        if row is not None and not row["finished"]:
+            self._ensure_poller(job_id, row["kind"])
+        return row
+
+    async def _refresh(self, job_id: str, kind: str, interval: float) -> bool:
+        """最近 interval 秒内（任何 worker）没有轮询过时调用一次状态接口；返回是否调用了接口"""
+        if await asyncio.to_thread(self._claim, job_id, interval):
+            await self._poll_once(job_id, kind)
+            return True
+        return False
+
+    async def status(self, job_id: str, kind: Optional[str] = None) -> Dict[str, Any]:
+        return self._snapshot(await self._track(job_id, kind))
+
+    async def wait(self, job_id: str, kind: Optional[str] = None, timeout: float = 30.0) -> Dict[str, Any]:
+        """等待任务结束或超时，返回当前状态（超时时 finished 为 False）"""
+        deadline = time.monotonic() + timeout
+        row = await self._track(job_id, kind)
+        while not row["finished"]:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            event = self._events.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, FIRECRAWL_WAIT_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                # 后台轮询的间隔可能已退避到 FIRECRAWL_POLL_MAX；其他 worker 也可能已看到任务结束
+                await self._refresh(job_id, row["kind"], FIRECRAWL_WAIT_POLL_INTERVAL)
+            row = await asyncio.to_thread(self._row, job_id)
+            if row is None:
+                break
+        return self._snapshot(row) if row is not None else {"job_id": job_id, "status": "unknown", "finished": False}
+
+    async def close(self):
+        for task in list(self._pollers.values()):
+            task.cancel()
+        for task in list(self._pollers.values()):
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        with self._db_lock:
+            self._db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"polling": len(self._pollers), "waiting": len(self._events), "max_jobs": self.max_jobs}
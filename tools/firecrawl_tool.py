@@ -1,7 +1,12 @@
 import os
+import asyncio
 from firecrawl import Firecrawl
-from pydantic import BaseModel, Field
-from typing import Literal, List, Dict, Any, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Literal, List, Dict, Any, Optional, AsyncIterator
+
+from .firecrawl_jobs import JobManager, job_id_of, job_response, to_plain
+from .rate_limiter import RateLimiter
+from .url_utils import canonicalize_url, url_matches
 
 # 1. 从环境变量加载 API Key
 api_key = os.getenv("FIRECRAWL_API_KEY")
@@ -10,6 +15,46 @@ if not api_key:
 
 firecrawl_client = Firecrawl(api_key=api_key)
 
+# 本机所有 worker 共享的客户端限流（每秒请求数，0 表示不限速；突发上限）
+FIRECRAWL_RATE_LIMIT = float(os.getenv("FIRECRAWL_RATE_LIMIT", "1"))
+FIRECRAWL_RATE_BURST = int(os.getenv("FIRECRAWL_RATE_BURST", "5"))
+rate_limiter = RateLimiter("firecrawl", FIRECRAWL_RATE_LIMIT, FIRECRAWL_RATE_BURST)
+
+
+async def call_firecrawl(method, *args, idempotent: bool = True, **kwargs):
+    """
+    在线程中调用同步的 SDK 方法（不阻塞事件循环），经过限流，429 时退避重试。
+    idempotent=False（启动 crawl/extract 任务）时 5xx 不重试，以免重复创建任务。
+    """
+    return await rate_limiter.call(
+        lambda: asyncio.to_thread(method, *args, **kwargs),
+        retry_server_errors=idempotent,
+    )
+
+# 异步任务的 SDK 方法：v2 SDK 的 crawl/extract 会阻塞到任务结束，提交任务使用 start_*；
+# 旧版 SDK 没有 start_* 时回退到 crawl/extract，状态接口为 check_crawl_status
+START_METHODS = {
+    "crawl": getattr(firecrawl_client, "start_crawl", None) or firecrawl_client.crawl,
+    "extract": getattr(firecrawl_client, "start_extract", None) or firecrawl_client.extract,
+}
+STATUS_METHODS = {
+    "crawl": getattr(firecrawl_client, "get_crawl_status", None) or getattr(firecrawl_client, "check_crawl_status", None),
+    "extract": getattr(firecrawl_client, "get_extract_status", None),
+}
+
+# wait 模式单次请求最多等待的秒数
+FIRECRAWL_WAIT_MAX_SECONDS = float(os.getenv("FIRECRAWL_WAIT_MAX_SECONDS", "120"))
+# map_and_scrape：单次最多抓取的 URL 数与并发上限
+FIRECRAWL_MAP_SCRAPE_MAX_URLS = int(os.getenv("FIRECRAWL_MAP_SCRAPE_MAX_URLS", "100"))
+FIRECRAWL_MAP_SCRAPE_MAX_CONCURRENCY = int(os.getenv("FIRECRAWL_MAP_SCRAPE_MAX_CONCURRENCY", "10"))
+
+
+async def fetch_job_status(kind: str, job_id: str):
+    method = STATUS_METHODS.get(kind)
+    if method is None:
+        raise ValueError(f"The installed Firecrawl SDK cannot query {kind} jobs.")
+    return await call_firecrawl(method, job_id)
+
 # 2. 为不同的子功能定义输入模型以进行验证
 
 class ScrapeParams(BaseModel):
@@ -36,12 +81,39 @@ class ExtractParams(BaseModel):
     prompt: Optional[str] = Field(default=None, description="A natural language prompt for data extraction.")
     schema_definition: Optional[Dict[str, Any]] = Field(default=None, alias="schema", description="A JSON schema to define the output structure.")
 
+class MapAndScrapeParams(BaseModel):
+    url: str = Field(description="The URL of the website to map.")
+    search: Optional[str] = Field(default=None, description="Optional search term passed to map.")
+    include_patterns: Optional[List[str]] = Field(
+        default=None, description="Glob patterns; only matching URLs are scraped, e.g. ['*/blog/*']."
+    )
+    exclude_patterns: Optional[List[str]] = Field(
+        default=None, description="Glob patterns of URLs to skip, e.g. ['*.pdf', '*/tag/*']."
+    )
+    limit: int = Field(
+        default=20, ge=1, le=FIRECRAWL_MAP_SCRAPE_MAX_URLS, description="Maximum number of matched URLs to scrape."
+    )
+    concurrency: int = Field(
+        default=5, ge=1, le=FIRECRAWL_MAP_SCRAPE_MAX_CONCURRENCY, description="How many URLs are scraped at once."
+    )
+    formats: List[str] = Field(default=["markdown"], description="List of formats, e.g., ['markdown', 'html'].")
+
 class CheckStatusParams(BaseModel):
     job_id: str = Field(description="The job ID of the crawl or extract task to check.")
+    kind: Optional[Literal['crawl', 'extract']] = Field(
+        default=None,
+        description="The job type; only needed for jobs not submitted through this service (defaults to 'crawl')."
+    )
+
+class WaitParams(CheckStatusParams):
+    timeout: float = Field(
+        default=30.0, gt=0, le=FIRECRAWL_WAIT_MAX_SECONDS,
+        description="Seconds to wait for the job to finish before returning its current status."
+    )
 
 # 3. 定义总的工具输入模型
 class FirecrawlInput(BaseModel):
-    mode: Literal['scrape', 'search', 'crawl', 'map', 'extract', 'check_status'] = Field(
+    mode: Literal['scrape', 'search', 'crawl', 'map', 'extract', 'check_status', 'wait', 'map_and_scrape'] = Field(
         description="The Firecrawl function to execute."
     )
     parameters: Dict[str, Any] = Field(
@@ -54,9 +126,93 @@ class FirecrawlTool:
     description = (
         "A powerful tool to scrape, crawl, search, map, or extract structured data from web pages. "
         "Modes: 'scrape' for a single URL, 'search' for a web query, 'crawl' for an entire website, "
-        "'map' to get all links, 'extract' for AI-powered data extraction, and 'check_status' for async jobs."
+        "'map' to get all links, 'extract' for AI-powered data extraction, 'check_status' for async jobs, "
+        "'wait' to block until an async job finishes, and 'map_and_scrape' to map a site and scrape the matching URLs. "
+        "'check_status' and 'wait' return Firecrawl's job status fields (status, total, completed, data, ...) "
+        "plus job_id, kind, finished and polls."
     )
     input_schema = FirecrawlInput
+    # stream() 以 {"type": "done"} 事件结束，可直接用于 /api/v1/execute_tool/stream
+    streams_done_events = True
+
+    def __init__(self):
+        # crawl/extract 任务由服务端在后台轮询，结果保存在各 worker 共享的任务表中
+        self.jobs = JobManager(fetch_job_status)
+
+    async def cleanup(self):
+        await self.jobs.close()
+
+    async def _map_and_scrape(self, params: MapAndScrapeParams) -> AsyncIterator[Dict[str, Any]]:
+        """
+        map 站点后按模式过滤、去重，并发抓取匹配的 URL（SDK 调用在线程中执行），
+        先输出一条 map 事件，再按完成顺序逐条输出 page 事件。
+        """
+        mapped = to_plain(await call_firecrawl(firecrawl_client.map, url=params.url, search=params.search))
+        links = mapped.get("links", []) if isinstance(mapped, dict) else mapped or []
+        urls: List[str] = []
+        seen = set()
+        for link in links:
+            # v2 SDK 返回 {"url", "title", ...}，旧版 SDK 返回 URL 字符串
+            url = link.get("url") if isinstance(link, dict) else link
+            if not url or not url_matches(url, params.include_patterns, params.exclude_patterns):
+                continue
+            key = canonicalize_url(url)
+            if key not in seen:
+                seen.add(key)
+                urls.append(url)
+        yield {
+            "type": "map",
+            "url": params.url,
+            "mapped": len(links),
+            "matched": len(urls),
+            "urls": urls[:params.limit],
+        }
+
+        semaphore = asyncio.Semaphore(params.concurrency)
+
+        async def scrape(url: str) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    data = await call_firecrawl(firecrawl_client.scrape, url=url, formats=params.formats)
+                except Exception as e:
+                    return {"type": "page", "url": url, "success": False, "error": str(e)}
+                return {"type": "page", "url": url, "success": True, "data": to_plain(data)}
+
+        tasks = [asyncio.create_task(scrape(url)) for url in urls[:params.limit]]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 客户端断开或出错时不再发起剩余的抓取
+            for task in tasks:
+                task.cancel()
+
+    async def stream(self, parameters: FirecrawlInput) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式执行：map_and_scrape 逐条输出 map / page 事件，最后是 done 事件；
+        其他模式只输出一条包含完整结果的 done 事件。
+        """
+        if parameters.mode != 'map_and_scrape':
+            yield {"type": "done", **await self.execute(parameters)}
+            return
+        try:
+            params = MapAndScrapeParams(**parameters.parameters)
+        except ValidationError as e:
+            yield {"type": "done", "success": False, "error": f"An error occurred in Firecrawl tool: {str(e)}"}
+            return
+        succeeded = failed = 0
+        try:
+            async for event in self._map_and_scrape(params):
+                if event["type"] == "page":
+                    if event["success"]:
+                        succeeded += 1
+                    else:
+                        failed += 1
+                yield event
+        except Exception as e:
+            yield {"type": "done", "success": False, "error": f"An error occurred in Firecrawl tool: {str(e)}"}
+            return
+        yield {"type": "done", "success": True, "succeeded": succeeded, "failed": failed}
 
     async def execute(self, parameters: FirecrawlInput) -> dict:
         try:
@@ -66,44 +222,66 @@ class FirecrawlTool:
             result = None
             if mode == 'scrape':
                 validated_params = ScrapeParams(**params)
-                result = firecrawl_client.scrape(
+                result = await call_firecrawl(
+                    firecrawl_client.scrape,
                     url=validated_params.url,
                     formats=validated_params.formats
                 )
             elif mode == 'search':
                 validated_params = SearchParams(**params)
-                result = firecrawl_client.search(
+                result = await call_firecrawl(
+                    firecrawl_client.search,
                     query=validated_params.query,
                     limit=validated_params.limit,
                     scrape_options=validated_params.scrape_options
                 )
             elif mode == 'crawl':
                 validated_params = CrawlParams(**params)
-                # crawl API 返回一个任务ID
-                job_id = firecrawl_client.crawl(
+                response = await call_firecrawl(
+                    START_METHODS["crawl"],
                     url=validated_params.url,
                     limit=validated_params.limit,
-                    scrape_options=validated_params.scrape_options
+                    scrape_options=validated_params.scrape_options,
+                    idempotent=False
                 )
-                result = {"status": "crawl job started", "job_id": job_id}
+                job_id = job_id_of(response)
+                result = {"status": "crawl job started", "job_id": job_id, "job": await self.jobs.submit("crawl", job_id)}
             elif mode == 'map':
                 validated_params = MapParams(**params)
-                result = firecrawl_client.map(
+                result = await call_firecrawl(
+                    firecrawl_client.map,
                     url=validated_params.url,
                     search=validated_params.search
                 )
             elif mode == 'extract':
                 validated_params = ExtractParams(**params)
-                # extract API 返回一个任务ID
-                job_id = firecrawl_client.extract(
+                response = await call_firecrawl(
+                    START_METHODS["extract"],
                     urls=validated_params.urls,
                     prompt=validated_params.prompt,
-                    schema=validated_params.schema_definition
+                    schema=validated_params.schema_definition,
+                    idempotent=False
                 )
-                result = {"status": "extract job started", "job_id": job_id}
+                job_id = job_id_of(response)
+                result = {"status": "extract job started", "job_id": job_id, "job": await self.jobs.submit("extract", job_id)}
             elif mode == 'check_status':
                 validated_params = CheckStatusParams(**params)
-                result = firecrawl_client.check_crawl_status(validated_params.job_id)
+                result = job_response(await self.jobs.status(validated_params.job_id, validated_params.kind))
+            elif mode == 'map_and_scrape':
+                validated_params = MapAndScrapeParams(**params)
+                result = {"pages": []}
+                async for event in self._map_and_scrape(validated_params):
+                    if event["type"] == "map":
+                        result.update({k: v for k, v in event.items() if k != "type"})
+                    else:
+                        result["pages"].append({k: v for k, v in event.items() if k != "type"})
+                result["succeeded"] = sum(1 for page in result["pages"] if page["success"])
+                result["failed"] = len(result["pages"]) - result["succeeded"]
+            elif mode == 'wait':
+                validated_params = WaitParams(**params)
+                result = job_response(
+                    await self.jobs.wait(validated_params.job_id, validated_params.kind, validated_params.timeout)
+                )
             else:
                 return {"success": False, "error": f"Invalid mode '{mode}'."}
 
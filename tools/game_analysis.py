@@ -0,0 +1,189 @@
+"""
+整局分析的辅助函数：把 PGN 或 FEN 列表展开为待分析的局面序列，
+并根据每个局面的搜索结果计算逐步评估、最佳走法与失误（cp loss）统计。
+
+搜索结果使用 stockfish_tool 的缓存条目格式：分数相对于走棋方。
+"""
+
+import io
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import chess
+import chess.pgn
+
+# 计算失误时评估值截断到 ±EVAL_CLAMP_CP，避免将杀分数放大平均损失
+EVAL_CLAMP_CP = 1000
+MATE_CP = 10000
+
+# 单步损失达到以下阈值（centipawn）时分别记为 inaccuracy / mistake / blunder
+INACCURACY_CP = 50
+MISTAKE_CP = 100
+BLUNDER_CP = 300
+
+_SUMMARY_KEYS = {"inaccuracy": "inaccuracies", "mistake": "mistakes", "blunder": "blunders"}
+
+
+@dataclass
+class GamePosition:
+    """一局中的一个局面：引擎从 engine_fen 出发走 moves 到达 fen"""
+    fen: str
+    engine_fen: str
+    moves: List[str] = field(default_factory=list)
+    # 从该局面实际走出的一步（最后一个局面或未知时为 None）
+    move_played: Optional[str] = None
+    san: Optional[str] = None
+    # 终局（将死、逼和、子力不足）直接给出的结果，不需要引擎
+    terminal_entry: Optional[Dict[str, Any]] = None
+
+
+def _terminal_entry(board: chess.Board) -> Optional[Dict[str, Any]]:
+    if board.is_checkmate():
+        score = {"type": "mate", "value": 0}
+    elif board.is_stalemate() or board.is_insufficient_material():
+        score = {"type": "cp", "value": 0}
+    else:
+        return None
+    return {"depth": 0, "bestmove": None, "ponder": None,
+            "lines": [{"multipv": 1, "score": score, "pv": []}]}
+
+
+def positions_from_pgn(pgn: str, max_plies: int) -> List[GamePosition]:
+    """解析 PGN 主线（支持 [FEN] 标签的自定义起始局面），返回每一步之前的局面及最终局面"""
+    game = chess.pgn.read_game(io.StringIO(pgn))
+    if game is None:
+        raise ValueError("No game found in PGN.")
+    if game.errors:
+        raise ValueError(f"Invalid PGN: {game.errors[0]}")
+    board = game.board()
+    start_fen = board.fen()
+    moves: List[str] = []
+    positions: List[GamePosition] = []
+    for move in game.mainline_moves():
+        if len(moves) >= max_plies:
+            raise ValueError(f"Game is too long: at most {max_plies} plies can be analyzed.")
+        positions.append(GamePosition(
+            fen=board.fen(), engine_fen=start_fen, moves=list(moves),
+            move_played=move.uci(), san=board.san(move),
+        ))
+        board.push(move)
+        moves.append(move.uci())
+    positions.append(GamePosition(
+        fen=board.fen(), engine_fen=start_fen, moves=list(moves), terminal_entry=_terminal_entry(board),
+    ))
+    return positions
+
+
+def _find_move(board: chess.Board, next_fen: str) -> Optional[chess.Move]:
+    """找出从 board 到达 next_fen 的合法走法（只比较棋子位置、走棋方和易位权）"""
+    target = next_fen.split()[:3]
+    for move in board.legal_moves:
+        board.push(move)
+        reached = board.fen().split()[:3]
+        board.pop()
+        if reached == target:
+            return move
+    return None
+
+
+def positions_from_fens(fens: List[str]) -> List[GamePosition]:
+    """
+    把连续的 FEN 列表视为一局棋；相邻局面之间若恰好相差一步合法走法，则推断出实际走法，
+    否则该步的走法与损失为空。
+    """
+    positions: List[GamePosition] = []
+    for i, fen in enumerate(fens):
+        board = chess.Board(fen)
+        position = GamePosition(fen=board.fen(), engine_fen=fen, terminal_entry=_terminal_entry(board))
+        if i + 1 < len(fens):
+            move = _find_move(board, fens[i + 1])
+            if move is not None:
+                position.move_played = move.uci()
+                position.san = board.san(move)
+        positions.append(position)
+    return positions
+
+
+def _score_cp(entry: Dict[str, Any]) -> Optional[int]:
+    """走棋方视角的 centipawn 值（将杀换算为 ±MATE_CP 并截断）"""
+    if not entry["lines"]:
+        return None
+    score = entry["lines"][0]["score"]
+    if score["type"] == "mate":
+        value = score["value"]
+        # mate 0 表示走棋方已被将死
+        cp = -MATE_CP if value <= 0 else MATE_CP - value
+    else:
+        cp = score["value"]
+    return max(-EVAL_CLAMP_CP, min(EVAL_CLAMP_CP, cp))
+
+
+def _white_evaluation(entry: Dict[str, Any], turn: str) -> Dict[str, Any]:
+    if not entry["lines"]:
+        return {}
+    score = entry["lines"][0]["score"]
+    sign = 1 if turn == "w" else -1
+    return {"type": score["type"], "value": score["value"] * sign}
+
+
+def _classify(loss: int) -> Optional[str]:
+    if loss >= BLUNDER_CP:
+        return "blunder"
+    if loss >= MISTAKE_CP:
+        return "mistake"
+    if loss >= INACCURACY_CP:
+        return "inaccuracy"
+    return None
+
+
+def annotate_game(positions: List[GamePosition], entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    根据每个局面的搜索结果生成逐步报告。
+    cp_loss 为走棋方在该步损失的评估（走前评估减去走后评估，均为走棋方视角，截断到 ±EVAL_CLAMP_CP）。
+    """
+    plies = []
+    summary = {
+        color: {"moves": 0, "average_cp_loss": None, "inaccuracies": 0, "mistakes": 0, "blunders": 0}
+        for color in ("white", "black")
+    }
+    losses: Dict[str, List[int]] = {"white": [], "black": []}
+
+    for i, (position, entry) in enumerate(zip(positions[:-1], entries[:-1])):
+        turn = position.fen.split()[1]
+        color = "white" if turn == "w" else "black"
+        next_position, next_entry = positions[i + 1], entries[i + 1]
+        ply = {
+            "ply": i + 1,
+            "color": color,
+            "fen": position.fen,
+            "move_played": position.move_played,
+            "san": position.san,
+            "best_move": entry["bestmove"],
+            "evaluation": _white_evaluation(entry, turn),
+            "evaluation_after": _white_evaluation(next_entry, next_position.fen.split()[1]),
+            "depth": entry["depth"],
+            "cp_loss": None,
+            "classification": None,
+        }
+        before, after = _score_cp(entry), _score_cp(next_entry)
+        if position.move_played is not None and before is not None and after is not None:
+            loss = 0 if position.move_played == entry["bestmove"] else max(0, before + after)
+            ply["cp_loss"] = loss
+            ply["classification"] = _classify(loss)
+            losses[color].append(loss)
+            if ply["classification"]:
+                summary[color][_SUMMARY_KEYS[ply["classification"]]] += 1
+        plies.append(ply)
+
+    for color, values in losses.items():
+        summary[color]["moves"] = len(values)
+        if values:
+            summary[color]["average_cp_loss"] = round(sum(values) / len(values), 1)
+
+    final_position, final_entry = positions[-1], entries[-1]
+    return {
+        "plies": plies,
+        "final_fen": final_position.fen,
+        "final_evaluation": _white_evaluation(final_entry, final_position.fen.split()[1]),
+        "summary": summary,
+    }
@@ -0,0 +1,44 @@
+"""
+Shared async HTTP client factory for tools that call remote APIs.
+
+Each tool keeps one long-lived `httpx.AsyncClient` so that concurrent calls share a
+keep-alive connection pool (and a single HTTP/2 connection where the server supports it)
+instead of opening a fresh TLS connection per request.
+"""
+
+import importlib.util
+import logging
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 support in httpx needs the optional h2 package (pip install "httpx[http2]")
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def build_async_client(
+    base_url: str,
+    timeout: float = 30.0,
+    connect_timeout: float = 5.0,
+    max_connections: int = 20,
+    max_keepalive_connections: int = 10,
+    keepalive_expiry: float = 30.0,
+    http2: bool = True,
+    headers: Optional[Dict[str, str]] = None,
+) -> httpx.AsyncClient:
+    """Create a pooled AsyncClient; HTTP/2 is used only when requested and `h2` is installed."""
+    if http2 and not HTTP2_AVAILABLE:
+        logger.warning("HTTP/2 requested but the 'h2' package is not installed; falling back to HTTP/1.1.")
+    return httpx.AsyncClient(
+        base_url=base_url,
+        http2=http2 and HTTP2_AVAILABLE,
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        headers=headers,
+    )
@@ -0,0 +1,154 @@
+"""
+进程内轻量级指标 (counters / histograms)。
+
+不依赖 prometheus_client，通过 `metrics.snapshot()` 导出为 JSON，
+由 main.py 的 `/api/v1/metrics` 与沙箱服务的 `/metrics` 端点暴露。
+注意：gunicorn 每个 worker 各自维护一份指标，快照中带有 pid 以便区分。
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+# 默认的延迟分桶（秒）
+DEFAULT_LATENCY_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+
+def _metric_key(name: str, labels: Dict[str, Any]) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram:
+    """固定分桶直方图，附带 count/sum/min/max 与基于分桶估算的分位数"""
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self._buckets) + 1)  # 最后一个是 +Inf
+        self._count = 0
+        self._sum = 0.0
+        self._min: Optional[float] = None
+        self._max: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            index = len(self._buckets)
+            for i, upper in enumerate(self._buckets):
+                if value <= upper:
+                    index = i
+                    break
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            self._min = value if self._min is None else min(self._min, value)
+            self._max = value if self._max is None else max(self._max, value)
+
+    def time(self) -> "_HistogramTimer":
+        """`with histogram.time(): ...` 记录代码块耗时（秒）"""
+        return _HistogramTimer(self)
+
+    def _quantile(self, q: float) -> Optional[float]:
+        if self._count == 0:
+            return None
+        target = q * self._count
+        cumulative = 0
+        for i, count in enumerate(self._counts):
+            cumulative += count
+            if cumulative >= target:
+                upper = self._buckets[i] if i < len(self._buckets) else self._max
+                return min(upper, self._max) if self._max is not None else upper
+        return self._max
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            cumulative = 0
+            buckets: Dict[str, int] = {}
+            for upper, count in zip(self._buckets, self._counts):
+                cumulative += count
+                buckets[str(upper)] = cumulative
+            buckets["+Inf"] = self._count
+            return {
+                "count": self._count,
+                "sum": self._sum,
+                "avg": self._sum / self._count if self._count else None,
+                "min": self._min,
+                "max": self._max,
+                "p50": self._quantile(0.50),
+                "p95": self._quantile(0.95),
+                "p99": self._quantile(0.99),
+                "buckets": buckets,
+            }
+
+
+class _HistogramTimer:
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+class MetricsRegistry:
+    """按 名称+标签 管理指标实例"""
+
+    def __init__(self):
+        self._counters: Dict[str, Counter] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, **labels) -> Counter:
+        key = _metric_key(name, labels)
+        with self._lock:
+            if key not in self._counters:
+                self._counters[key] = Counter()
+            return self._counters[key]
+
+    def histogram(self, name: str, buckets: Optional[Tuple[float, ...]] = None, **labels) -> Histogram:
+        key = _metric_key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets or DEFAULT_LATENCY_BUCKETS)
+            return self._histograms[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+        return {
+            "pid": os.getpid(),
+            "timestamp": time.time(),
+            "counters": {key: counter.value for key, counter in sorted(counters.items())},
+            "histograms": {key: hist.snapshot() for key, hist in sorted(histograms.items())},
+        }
+
+
+# 全局单例
+metrics = MetricsRegistry()
@@ -0,0 +1,205 @@
+"""
+按外部服务（Tavily、Firecrawl 等）限流的客户端令牌桶，以及对 429/5xx 的退避重试。
+
+gunicorn 的多个 worker 共享同一个令牌桶：桶的状态保存在本机的一个小文件里，
+读写时用 fcntl.flock 加锁。令牌不足时调用方预约下一个令牌并短暂排队等待，
+只有预计等待超过 max_wait 时才拒绝。服务端返回 429 时，桶会被整体暂停到
+Retry-After 之后，所有 worker 一起让出，避免轮流撞上限流。
+没有 fcntl 的平台上退化为进程内令牌桶。
+"""
+
+import asyncio
+import email.utils
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+
+from .metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_DIR = os.getenv("RATE_LIMIT_DIR", os.path.join(tempfile.gettempdir(), "py_tool_server_rate_limits"))
+# 令牌不足时最多排队等待的秒数；超过则直接报错
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+# 429/5xx 重试：最多尝试次数（含第一次）与指数退避的基数、上限（秒）
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+
+
+class RateLimitExceeded(RuntimeError):
+    """预计排队时间超过上限（本地令牌不足或服务端要求的 Retry-After 太长）"""
+
+    def __init__(self, provider: str, wait: float):
+        super().__init__(f"{provider} rate limit reached; retry in {wait:.1f}s.")
+        self.provider = provider
+        self.wait = wait
+
+
+def status_code_of(exc: BaseException) -> Optional[int]:
+    """从 httpx / requests / SDK 异常中取 HTTP 状态码"""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after_of(exc: BaseException) -> Optional[float]:
+    """解析响应的 Retry-After 头（秒数或 HTTP 日期），没有时返回 None"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RateLimiter:
+    """
+    一个服务的令牌桶：每秒补充 rate 个令牌，最多积累 burst 个。rate <= 0 表示不限速（仍然重试）。
+    """
+
+    def __init__(self, provider: str, rate: float, burst: int, max_wait: float = RATE_LIMIT_MAX_WAIT,
+                 state_dir: str = RATE_LIMIT_DIR):
+        self.provider = provider
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_wait = max_wait
+        self.path = os.path.join(state_dir, f"{provider}.bucket")
+        self._fd: Optional[int] = None
+        self._fd_pid: Optional[int] = None
+        # 没有 fcntl 时使用的进程内状态
+        self._local_lock = threading.Lock()
+        self._local_state = {"tokens": float(self.burst), "updated": time.time(), "blocked_until": 0.0}
+
+    # --- 桶状态 ---
+    def _open(self) -> int:
+        # flock 锁属于打开的文件描述，fork 后的子进程必须重新打开
+        if self._fd is None or self._fd_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._fd_pid = os.getpid()
+        return self._fd
+
+    def _update(self, change: Callable[[dict, float], Any]) -> Any:
+        """在锁内读取桶状态，补充令牌后交给 change 修改，再写回；返回 change 的返回值"""
+        if fcntl is None:
+            with self._local_lock:
+                return self._apply(self._local_state, change)
+        fd = self._open()
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            raw = os.read(fd, 4096)
+            try:
+                state = json.loads(raw) if raw else None
+            except ValueError:
+                state = None
+            if not isinstance(state, dict):
+                state = {"tokens": float(self.burst), "updated": time.time(), "blocked_until": 0.0}
+            result = self._apply(state, change)
+            data = json.dumps(state).encode()
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, data)
+            return result
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _apply(self, state: dict, change: Callable[[dict, float], Any]) -> Any:
+        now = time.time()
+        elapsed = max(0.0, now - state["updated"])
+        state["tokens"] = min(float(self.burst), state["tokens"] + elapsed * self.rate)
+        state["updated"] = now
+        return change(state, now)
+
+    def _reserve(self, state: dict, now: float) -> Optional[float]:
+        """预约一个令牌，返回需要等待的秒数；等待超过 max_wait 时不预约并返回 None"""
+        blocked = max(0.0, state.get("blocked_until", 0.0) - now)
+        # tokens 可以为负：表示已被排队的调用预约
+        wait = max(blocked, (1 - state["tokens"]) / self.rate if state["tokens"] < 1 else 0.0)
+        if wait > self.max_wait:
+            return None
+        state["tokens"] -= 1
+        return wait
+
+    async def acquire(self):
+        """取得一个令牌，必要时排队等待"""
+        if self.rate <= 0:
+            wait = self._update(lambda state, now: max(0.0, state.get("blocked_until", 0.0) - now))
+            if wait > self.max_wait:
+                raise RateLimitExceeded(self.provider, wait)
+        else:
+            wait = self._update(self._reserve)
+            if wait is None:
+                metrics.counter("rate_limit_rejected_total", provider=self.provider).inc()
+                raise RateLimitExceeded(self.provider, self.max_wait)
+        metrics.histogram("rate_limit_wait_seconds", provider=self.provider).observe(wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """服务端返回 429：所有 worker 暂停到 seconds 秒之后，并清空已积累的令牌"""
+        def change(state: dict, now: float):
+            state["blocked_until"] = max(state.get("blocked_until", 0.0), now + seconds)
+            state["tokens"] = min(state["tokens"], 0.0)
+        self._update(change)
+
+    # --- 重试 ---
+    async def call(self, func: Callable[[], Awaitable[Any]], retry_server_errors: bool = True,
+                   retry_on: Tuple[Type[BaseException], ...] = (), max_attempts: int = RETRY_MAX_ATTEMPTS) -> Any:
+        """
+        限流后调用 func()；429 以及（retry_server_errors 时）5xx 和 retry_on 中的异常按带抖动的指数退避重试，
+        有 Retry-After 时至少等待该时长。非幂等的请求应传 retry_server_errors=False，只在 429 时重试。
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.acquire()
+            try:
+                return await func()
+            except Exception as e:
+                status = status_code_of(e)
+                if status == 429:
+                    reason = "429"
+                elif retry_server_errors and (
+                    (status is not None and status >= 500) or (status is None and isinstance(e, retry_on))
+                ):
+                    reason = str(status) if status is not None else type(e).__name__
+                else:
+                    raise
+                if attempt >= max_attempts:
+                    metrics.counter("rate_limit_retries_exhausted_total", provider=self.provider).inc()
+                    raise
+                # full jitter：在 [0, min(上限, 基数 * 2^n)] 内随机，避免各 worker 同时重试
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+                retry_after = retry_after_of(e)
+                if retry_after is not None:
+                    if retry_after > self.max_wait:
+                        raise RateLimitExceeded(self.provider, retry_after) from e
+                    delay = retry_after + random.uniform(0, RETRY_BASE_DELAY)
+                if status == 429:
+                    # 由令牌桶统一等待，其他 worker 也会一起让出
+                    self.pause(delay)
+                    delay = 0.0
+                metrics.counter("rate_limit_retries_total", provider=self.provider, reason=reason).inc()
+                logger.warning(f"{self.provider} request failed ({reason}), retry {attempt}/{max_attempts - 1}")
+                if delay > 0:
+                    await asyncio.sleep(delay)
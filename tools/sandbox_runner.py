@@ -0,0 +1,506 @@
+# sandbox_runner.py - 沙箱容器内的常驻 runner (forkserver)
+#
+# 该文件被打包进 tools-python-sandbox 镜像，在沙箱容器内运行：
+#
+#   python /app/sandbox_runner.py serve                 容器主进程：预导入科学计算库、解析字体，等待执行请求
+#   python /app/sandbox_runner.py run                   每次执行：从 stdin 读取代码和输入文件，把代码和本进程的
+#                                                       stdout/stderr 交给 forkserver；会话模式下在常驻的会话进程中
+#                                                       执行，变量在调用之间保留
+#   python /app/sandbox_runner.py reset                 归还容器前：杀掉残留进程并清空 /tmp
+#   python /app/sandbox_runner.py ping                  就绪检查
+#
+# forkserver 为每段代码 fork 一个子进程执行，子进程直接继承预导入的模块，
+# 因此 numpy/pandas/matplotlib 代码无需再付出解释器启动和导入的开销。
+# stdin 负载格式：一行 JSON 头 {"token", "session", "code_size", "files": [{"name", "size"}]}，
+# 随后依次是代码 (UTF-8) 和各输入文件的原始字节；输入文件写入 /tmp/inputs/<name>。
+# 每次执行前清空 /tmp/outputs；执行结束时所有打开的 matplotlib 图表保存为 /tmp/outputs/figure_<n>.png，
+# 该目录下的文件列表随元数据返回，由宿主机侧一次性取回作为 artifacts。
+# 元数据中的 usage 记录本次执行的资源消耗：CPU 时间和 OOM 取自容器自身的 cgroup (v2)，
+# 峰值内存取自执行进程的 rusage。
+# 执行结束后 client 在 stderr 末尾写入一行以 "\x1e<token>" 开头的 JSON 元数据
+# (退出码、图表标题等)，由宿主机侧的 code_interpreter.py 解析并剥离。
+#
+# 注意：这里只能使用标准库做顶层导入，client/ping/reset 每次都会启动一个新的解释器。
+
+import io
+import json
+import os
+import resource
+import shutil
+import signal
+import socket
+import struct
+import sys
+import time
+import traceback
+
+SOCKET_PATH = os.environ.get("SANDBOX_RUNNER_SOCKET", "/run/sandbox/forkserver.sock")
+PRELOAD_MODULES = [m.strip() for m in os.environ.get(
+    "SANDBOX_PRELOAD_MODULES", "numpy,pandas,matplotlib,matplotlib.pyplot"
+).split(",") if m.strip()]
+META_PREFIX = b"\x1e"
+INPUTS_DIR = os.environ.get("SANDBOX_INPUTS_DIR", "/tmp/inputs")
+OUTPUTS_DIR = os.environ.get("SANDBOX_OUTPUTS_DIR", "/tmp/outputs")
+CGROUP_DIR = os.environ.get("SANDBOX_CGROUP_DIR", "/sys/fs/cgroup")
+
+# 安全的内置函数列表
+SAFE_BUILTINS = {
+    '__import__': __import__, 'print': print, 'repr': repr, 'bool': bool, 'int': int,
+    'float': float, 'str': str, 'list': list, 'dict': dict, 'set': set, 'tuple': tuple,
+    'type': type, 'len': len, 'range': range, 'sorted': sorted, 'reversed': reversed,
+    'zip': zip, 'enumerate': enumerate, 'slice': slice, 'abs': abs, 'max': max,
+    'min': min, 'sum': sum, 'round': round, 'pow': pow, 'divmod': divmod,
+    'isinstance': isinstance, 'issubclass': issubclass, 'hasattr': hasattr,
+    'getattr': getattr, 'setattr': setattr,
+}
+
+
+# --- 进程间通信：4 字节长度前缀 + JSON ---
+def _recv_exact(sock, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _send_message(sock, message: dict, fds=None):
+    payload = json.dumps(message).encode("utf-8")
+    header = struct.pack("!I", len(payload))
+    if fds:
+        socket.send_fds(sock, [header], fds)
+    else:
+        sock.sendall(header)
+    sock.sendall(payload)
+
+
+def _recv_message(sock, maxfds: int = 0):
+    fds = []
+    if maxfds:
+        header, fds, _, _ = socket.recv_fds(sock, 4, maxfds)
+        if not header:
+            raise ConnectionError("connection closed")
+        header += _recv_exact(sock, 4 - len(header))
+    else:
+        header = _recv_exact(sock, 4)
+    (size,) = struct.unpack("!I", header)
+    return json.loads(_recv_exact(sock, size)), list(fds)
+
+
+# --- Matplotlib Font and Style Setup (runs once in the forkserver) ---
+def setup_matplotlib_config():
+    try:
+        import matplotlib.pyplot as plt
+        import matplotlib.font_manager as fm
+
+        # 字体优先级列表
+        font_preferences = [
+            'WenQuanYi Micro Hei', 'WenQuanYi Zen Hei', 'DejaVu Sans',
+            'Arial Unicode MS', 'SimHei'
+        ]
+
+        # 查找系统中可用的字体
+        available_fonts = set(f.name for f in fm.fontManager.ttflist)
+
+        # 设置找到的第一个偏好字体
+        for font_name in font_preferences:
+            if font_name in available_fonts:
+                plt.rcParams['font.family'] = font_name
+                break
+
+        # 金融图表常用配置
+        plt.rcParams['axes.unicode_minus'] = False
+        plt.rcParams['font.size'] = 10
+        plt.rcParams['figure.titlesize'] = 12
+        plt.rcParams['axes.labelsize'] = 10
+    except ImportError:
+        pass  # Matplotlib not available
+    except Exception as e:
+        print(f"Font setup failed inside sandbox: {e}", file=sys.stderr)
+
+
+def _figure_title(fig):
+    if fig.get_suptitle():
+        return fig.get_suptitle()
+    for ax in fig.axes:
+        if ax.get_title():
+            return ax.get_title()
+    return None
+
+
+def save_figures() -> dict:
+    """把所有打开的 matplotlib 图表保存到 OUTPUTS_DIR 并关闭，返回 {文件名: 标题}"""
+    plt = sys.modules.get('matplotlib.pyplot')
+    if plt is None:
+        return {}
+    figures = {}
+    try:
+        for num in plt.get_fignums():
+            fig = plt.figure(num)
+            name = f"figure_{num}.png"
+            os.makedirs(OUTPUTS_DIR, exist_ok=True)
+            fig.savefig(os.path.join(OUTPUTS_DIR, name), format="png", bbox_inches="tight")
+            figures[name] = _figure_title(fig)
+    except Exception as e:
+        print(f"Saving figures failed: {e}", file=sys.stderr)
+    finally:
+        plt.close('all')
+    return figures
+
+
+def preload():
+    import importlib
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"Preloading '{name}' failed: {e}", file=sys.stderr)
+    setup_matplotlib_config()
+
+
+# --- Child process: 执行用户代码 ---
+def _bind_stdio():
+    """stdout/stderr 已经 dup2 到 client 的管道上，重新包装以便实时输出"""
+    sys.stdout = io.TextIOWrapper(io.FileIO(1, "w", closefd=False), encoding="utf-8",
+                                  errors="backslashreplace", line_buffering=True)
+    sys.stderr = io.TextIOWrapper(io.FileIO(2, "w", closefd=False), encoding="utf-8",
+                                  errors="backslashreplace", line_buffering=True)
+
+
+def _exec_code(code: str, exec_globals: dict) -> dict:
+    """在给定的 exec_globals 中执行用户代码，返回元数据（退出码、保存的图表及其标题）"""
+    exit_code = 0
+    try:
+        # 执行用户代码
+        exec(compile(code, "<sandbox>", "exec"), exec_globals)
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        figures = save_figures()
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+
+    return {"exit_code": exit_code, "figures": figures}
+
+
+def _child_main(code: str, meta_fd: int) -> int:
+    _bind_stdio()
+    exec_globals = {'__builtins__': SAFE_BUILTINS}
+    meta = _exec_code(code, exec_globals)
+    os.write(meta_fd, json.dumps(meta).encode("utf-8"))
+    return meta["exit_code"]
+
+
+def _session_main(channel) -> int:
+    """会话进程：在同一个 exec_globals 中依次执行多段代码，变量和导入在调用之间保留"""
+    exec_globals = {'__builtins__': SAFE_BUILTINS}
+    saved_stdout, saved_stderr = os.dup(1), os.dup(2)
+    while True:
+        try:
+            request, fds = _recv_message(channel, maxfds=2)
+        except (ConnectionError, OSError):
+            return 0
+        os.dup2(fds[0], 1)
+        os.dup2(fds[1], 2)
+        for fd in fds:
+            os.close(fd)
+        _bind_stdio()
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        meta = _exec_code(request["code"], exec_globals)
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        # 会话进程是常驻的，CPU 时间取本次执行的增量，峰值内存是会话进程至今的峰值
+        meta["rusage"] = {
+            "cpu_seconds": (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime),
+            "maxrss_kb": after.ru_maxrss,
+        }
+        # 还原 stdout/stderr，释放 client 的管道，使 docker exec 能够结束
+        os.dup2(saved_stdout, 1)
+        os.dup2(saved_stderr, 2)
+        _send_message(channel, meta)
+
+
+# --- Resource accounting ---
+def _read_cgroup_stat(name: str) -> dict:
+    """读取 cgroup v2 的 "key value" 格式文件（cpu.stat、memory.events），不可用时返回空字典"""
+    try:
+        with open(os.path.join(CGROUP_DIR, name)) as f:
+            return {key: int(value) for key, value in (line.split() for line in f if line.strip())}
+    except (OSError, ValueError):
+        return {}
+
+
+def _usage_snapshot() -> dict:
+    return {
+        "time": time.monotonic(),
+        "cpu_usec": _read_cgroup_stat("cpu.stat").get("usage_usec"),
+        "oom_kill": _read_cgroup_stat("memory.events").get("oom_kill"),
+    }
+
+
+def _usage_since(before: dict, rusage: dict) -> dict:
+    """本次执行的资源消耗；cgroup 不可用时 CPU 时间退回到执行进程的 rusage"""
+    after = _usage_snapshot()
+    usage = {"wall_seconds": round(after["time"] - before["time"], 4)}
+    if before["cpu_usec"] is not None and after["cpu_usec"] is not None:
+        usage["cpu_seconds"] = round((after["cpu_usec"] - before["cpu_usec"]) / 1e6, 4)
+    elif rusage.get("cpu_seconds") is not None:
+        usage["cpu_seconds"] = round(rusage["cpu_seconds"], 4)
+    if rusage.get("maxrss_kb") is not None:
+        usage["peak_memory_bytes"] = rusage["maxrss_kb"] * 1024
+    if before["oom_kill"] is not None and after["oom_kill"] is not None:
+        usage["oom_killed"] = after["oom_kill"] > before["oom_kill"]
+    else:
+        usage["oom_killed"] = False
+    return usage
+
+
+def _rusage_dict(ru) -> dict:
+    return {"cpu_seconds": ru.ru_utime + ru.ru_stime, "maxrss_kb": ru.ru_maxrss}
+
+
+# --- Forkserver ---
+_session = None  # (pid, channel)：当前容器的会话进程
+
+
+def _exit_meta(status: int) -> dict:
+    exit_code = os.waitstatus_to_exitcode(status)
+    meta = {"exit_code": exit_code if exit_code >= 0 else 128 - exit_code}
+    if exit_code < 0:
+        meta["signal"] = -exit_code
+    return meta
+
+
+def _run_child(request: dict, fds: list, server, conn) -> dict:
+    meta_read, meta_write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 1
+        try:
+            server.close()
+            conn.close()
+            os.close(meta_read)
+            os.dup2(fds[0], 1)
+            os.dup2(fds[1], 2)
+            for fd in fds:
+                os.close(fd)
+            exit_code = _child_main(request["code"], meta_write)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(exit_code)
+
+    os.close(meta_write)
+    for fd in fds:
+        os.close(fd)
+    chunks = []
+    while True:
+        chunk = os.read(meta_read, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(meta_read)
+    _, status, rusage = os.wait4(pid, 0)
+
+    try:
+        meta = json.loads(b"".join(chunks) or b"{}")
+    except ValueError:
+        meta = {}
+    meta.update(_exit_meta(status))
+    meta["rusage"] = _rusage_dict(rusage)
+    return meta
+
+
+def _run_in_session(request: dict, fds: list, server, conn) -> dict:
+    """把请求转交给常驻会话进程；会话进程不存在（首次调用或已被 OOM 杀死）时重新 fork"""
+    global _session
+    restarted = False
+    if _session is None:
+        parent_channel, child_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                server.close()
+                conn.close()
+                parent_channel.close()
+                for fd in fds:  # 只在每次执行时通过 channel 接收 client 的管道
+                    os.close(fd)
+                exit_code = _session_main(child_channel)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(exit_code)
+        child_channel.close()
+        _session = (pid, parent_channel)
+        restarted = True
+
+    pid, channel = _session
+    try:
+        _send_message(channel, request, fds=fds)
+        meta, _ = _recv_message(channel)
+    except (ConnectionError, OSError):
+        # 会话进程在执行中退出（例如超出内存上限被杀），会话状态丢失
+        channel.close()
+        _session = None
+        _, status, rusage = os.wait4(pid, 0)
+        meta = _exit_meta(status)
+        meta["rusage"] = _rusage_dict(rusage)
+        meta["session_lost"] = True
+    finally:
+        for fd in fds:
+            os.close(fd)
+    meta["session_started"] = restarted
+    return meta
+
+
+def _reset(keep_pids: set):
+    for entry in os.listdir('/proc'):
+        if entry.isdigit() and int(entry) not in keep_pids:
+            try:
+                os.kill(int(entry), signal.SIGKILL)
+            except Exception:
+                pass
+    for name in os.listdir('/tmp'):
+        path = os.path.join('/tmp', name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+
+
+def serve():
+    preload()
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    os.makedirs(os.path.dirname(SOCKET_PATH), exist_ok=True)
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCKET_PATH)
+    server.listen(8)
+
+    # 宿主机一次只把容器租给一个请求，顺序处理即可
+    while True:
+        conn, _ = server.accept()
+        with conn:
+            try:
+                request, fds = _recv_message(conn, maxfds=2)
+                op = request.get("op")
+                if op == "run":
+                    before = _usage_snapshot()
+                    if request.get("session"):
+                        response = _run_in_session(request, fds, server, conn)
+                    else:
+                        response = _run_child(request, fds, server, conn)
+                    response["usage"] = _usage_since(before, response.pop("rusage", {}))
+                elif op == "reset":
+                    _reset({1, os.getpid(), request.get("pid")})
+                    response = {"ok": True}
+                else:
+                    response = {"ok": True}
+                _send_message(conn, response)
+            except Exception:
+                traceback.print_exc()
+
+
+# --- Client commands ---
+def _connect(timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(SOCKET_PATH)
+            return sock
+        except OSError:
+            sock.close()
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _read_stdin_exact(stream, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError(f"stdin payload truncated: expected {size} bytes, got {len(data)}")
+    return data
+
+
+def read_request(stream) -> dict:
+    """解析 stdin 负载，把输入文件写入 INPUTS_DIR，返回 {"token", "session", "code"}"""
+    header = json.loads(stream.readline())
+    code = _read_stdin_exact(stream, header["code_size"]).decode("utf-8")
+    for entry in header.get("files", []):
+        name = os.path.basename(entry["name"])
+        if name in ("", ".", ".."):
+            raise ValueError(f"invalid input file name: {entry['name']!r}")
+        os.makedirs(INPUTS_DIR, exist_ok=True)
+        with open(os.path.join(INPUTS_DIR, name), "wb") as f:
+            f.write(_read_stdin_exact(stream, entry["size"]))
+    return {"token": header["token"], "session": bool(header.get("session")), "code": code}
+
+
+def list_outputs() -> list:
+    artifacts = []
+    for root, _, files in os.walk(OUTPUTS_DIR):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                artifacts.append({"name": os.path.relpath(path, OUTPUTS_DIR), "size": os.path.getsize(path)})
+    return artifacts
+
+
+def run() -> int:
+    request = read_request(sys.stdin.buffer)
+    token = request["token"]
+    shutil.rmtree(OUTPUTS_DIR, ignore_errors=True)
+    os.makedirs(OUTPUTS_DIR, exist_ok=True)
+    with _connect() as sock:
+        _send_message(sock, {"op": "run", "code": request["code"], "session": request["session"]}, fds=[1, 2])
+        result, _ = _recv_message(sock)
+    result["artifacts"] = list_outputs()
+    trailer = META_PREFIX + token.encode("ascii") + json.dumps(result).encode("utf-8") + b"\n"
+    os.write(2, trailer)
+    return result.get("exit_code", 1)
+
+
+def control(op: str) -> int:
+    try:
+        with _connect(timeout=0.5) as sock:
+            _send_message(sock, {"op": op, "pid": os.getpid()})
+            result, _ = _recv_message(sock)
+    except (OSError, ConnectionError) as e:
+        print(f"forkserver not available: {e}", file=sys.stderr)
+        return 1
+    return 0 if result.get("ok") else 1
+
+
+def main(argv) -> int:
+    if len(argv) < 2:
+        print("usage: sandbox_runner.py serve | run | reset | ping", file=sys.stderr)
+        return 2
+    command = argv[1]
+    if command == "serve":
+        serve()
+        return 0
+    if command == "run" and len(argv) == 2:
+        return run()
+    if command in ("reset", "ping"):
+        return control(command)
+    print(f"unknown command: {' '.join(argv[1:])}", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
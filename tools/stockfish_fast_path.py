@@ -0,0 +1,143 @@
+"""
+stockfish_analyzer 的快速路径：在调用引擎之前查询 Polyglot 开局库和 Syzygy 残局库。
+
+开局库命中时直接给出库中权重最高的走法（开局库不含评估，evaluation 为 {"type": "book", "value": None}）；残局库（不超过表所支持的子数，且没有王车易位权）
+命中时给出精确的胜/和/负结果和最佳走法。两者都未命中时返回 None，由调用方回退到引擎搜索。
+"""
+
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import chess
+import chess.polyglot
+import chess.syzygy
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 残局库结果换算为 centipawn 时使用的分数（与 Stockfish 报告的残局库胜势量级一致）
+TB_WIN_CP = 20000
+# 开局库响应中最多列出的候选走法数
+BOOK_CANDIDATES = 5
+
+
+class FastPath:
+    """
+    book_path: Polyglot .bin 文件路径（空字符串表示不使用）
+    syzygy_path: Syzygy 表所在目录，多个目录用 os.pathsep 分隔（空字符串表示不使用）
+    """
+
+    def __init__(self, book_path: str = "", syzygy_path: str = ""):
+        self.book: Optional[chess.polyglot.MemoryMappedReader] = None
+        self.tablebase: Optional[chess.syzygy.Tablebase] = None
+        self.max_pieces = 0
+        if book_path:
+            try:
+                self.book = chess.polyglot.open_reader(book_path)
+                logger.info(f"Opened Polyglot book: {book_path}")
+            except OSError as e:
+                logger.error(f"Failed to open Polyglot book {book_path}: {e}")
+        if syzygy_path:
+            tablebase = chess.syzygy.Tablebase()
+            loaded = 0
+            for directory in filter(None, syzygy_path.split(os.pathsep)):
+                try:
+                    loaded += tablebase.add_directory(directory)
+                except OSError as e:
+                    logger.error(f"Failed to load Syzygy tables from {directory}: {e}")
+            if loaded:
+                self.tablebase = tablebase
+                # 表名形如 "KRPvKR"，字母数即子数
+                self.max_pieces = max(len(name.replace("v", "")) for name in tablebase.wdl)
+                logger.info(f"Loaded {loaded} Syzygy tables from {syzygy_path}")
+            else:
+                tablebase.close()
+
+    @property
+    def enabled(self) -> bool:
+        return self.book is not None or self.tablebase is not None
+
+    def probe(self, fen: str, mode: str, use_tablebase: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        同步查询（涉及文件读取，调用方应放到线程中执行）。
+        返回 {"source", "best_move_uci", "evaluation", ...}，未命中时返回 None。
+        开局库不含评估，只用于 get_best_move。
+        """
+        board = chess.Board(fen)
+        if self.tablebase is not None and use_tablebase:
+            result = self._probe_tablebase(board)
+            if result is not None:
+                return result
+        if self.book is not None and mode == 'get_best_move':
+            return self._probe_book(board)
+        return None
+
+    def _probe_book(self, board: chess.Board) -> Optional[Dict[str, Any]]:
+        metrics.counter("stockfish_fast_path_probes_total", source="book").inc()
+        entries = sorted(self.book.find_all(board), key=lambda entry: entry.weight, reverse=True)
+        if not entries:
+            return None
+        metrics.counter("stockfish_fast_path_hits_total", source="book").inc()
+        return {
+            "source": "book",
+            "best_move_uci": entries[0].move.uci(),
+            "evaluation": {"type": "book", "value": None},
+            "book_moves": [
+                {"move": entry.move.uci(), "weight": entry.weight} for entry in entries[:BOOK_CANDIDATES]
+            ],
+        }
+
+    def _probe_tablebase(self, board: chess.Board) -> Optional[Dict[str, Any]]:
+        if chess.popcount(board.occupied) > self.max_pieces or board.castling_rights:
+            return None
+        metrics.counter("stockfish_fast_path_probes_total", source="tablebase").inc()
+        try:
+            wdl = self.tablebase.probe_wdl(board)
+            dtz = self.tablebase.probe_dtz(board)
+            best_move = self._tablebase_move(board)
+        except KeyError:
+            # 缺少对应的表
+            return None
+        metrics.counter("stockfish_fast_path_hits_total", source="tablebase").inc()
+        # wdl/dtz 相对于走棋方；evaluation 与引擎结果一致，使用白方视角
+        sign = 1 if board.turn == chess.WHITE else -1
+        value = TB_WIN_CP if wdl == 2 else -TB_WIN_CP if wdl == -2 else 0
+        return {
+            "source": "tablebase",
+            "best_move_uci": best_move,
+            "evaluation": {"type": "cp", "value": value * sign},
+            "tablebase": {"wdl": wdl, "dtz": dtz},
+        }
+
+    def _tablebase_move(self, board: chess.Board) -> Optional[str]:
+        """
+        按残局库挑选走法：先比较走后对手的 WDL（越小越好）；
+        取胜时优先将杀、吃子或兵步（清零 50 步计数），再选 DTZ 最短的走法；失利时选 DTZ 最长的走法拖延。
+        """
+        candidates: List = []
+        for move in board.legal_moves:
+            zeroing = board.is_zeroing(move)
+            board.push(move)
+            try:
+                if board.is_checkmate():
+                    key = (-3, 0, 0)
+                else:
+                    wdl = self.tablebase.probe_wdl(board)
+                    dtz = abs(self.tablebase.probe_dtz(board))
+                    key = (wdl, 0 if zeroing else 1, dtz) if wdl < 0 else (wdl, 1, -dtz)
+            finally:
+                board.pop()
+            candidates.append((key, move.uci()))
+        if not candidates:
+            return None
+        return min(candidates)[1]
+
+    def close(self):
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if self.tablebase is not None:
+            self.tablebase.close()
+            self.tablebase = None
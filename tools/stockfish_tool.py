@@ -1,9 +1,24 @@
 import os
-from stockfish import Stockfish
-from pydantic import BaseModel, Field, validator
-from typing import Literal, List, Dict, Any, Optional
+import re
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field, root_validator, validator
+from typing import List, Literal, Optional
 import logging
 
+import chess
+
+from .metrics import metrics
+from .uci_engine import AnalysisResult, UCIEngine
+from .fen_utils import normalize_fen, side_to_move, validate_fen
+from .stockfish_fast_path import FastPath
+from .game_analysis import GamePosition, annotate_game, positions_from_fens, positions_from_pgn
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,75 +31,850 @@ if not stockfish_path:
 if not os.path.exists(stockfish_path):
     raise FileNotFoundError(f"Stockfish executable not found at the specified path: {stockfish_path}")
 
+# 引擎池参数：常驻的 Stockfish 进程数按 CPU 核心数和每个引擎的线程数确定
+STOCKFISH_THREADS = int(os.getenv("STOCKFISH_THREADS", "2"))
+STOCKFISH_HASH_MB = int(os.getenv("STOCKFISH_HASH_MB", "64"))
+STOCKFISH_POOL_SIZE = int(os.getenv("STOCKFISH_POOL_SIZE", str(max(1, (os.cpu_count() or 1) // STOCKFISH_THREADS))))
+STOCKFISH_LEASE_TIMEOUT = float(os.getenv("STOCKFISH_LEASE_TIMEOUT", "30"))
+
+# 分析缓存：内存 LRU 条目数，以及可选的 SQLite 持久化文件（多个 worker 可共享）
+STOCKFISH_CACHE_SIZE = int(os.getenv("STOCKFISH_CACHE_SIZE", "10000"))
+STOCKFISH_CACHE_DB = os.getenv("STOCKFISH_CACHE_DB", "")
+# 缓存键格式的版本；键的含义变化时递增，SQLite 文件中的旧条目不再命中
+CACHE_KEY_VERSION = 2
+
+# analyze_game / batch 模式单次请求最多分析的局面数；整局分析时每个引擎至少连续分析的步数
+STOCKFISH_MAX_POSITIONS = int(os.getenv("STOCKFISH_MAX_POSITIONS", "300"))
+STOCKFISH_MIN_SEGMENT_PLIES = int(os.getenv("STOCKFISH_MIN_SEGMENT_PLIES", "16"))
+
+# 快速路径：运维提供的 Polyglot 开局库文件与 Syzygy 残局库目录（多个目录用 ':' 分隔）。
+# 残局库同时通过 SyzygyPath 选项提供给引擎
+STOCKFISH_BOOK_PATH = os.getenv("STOCKFISH_BOOK_PATH", "")
+STOCKFISH_SYZYGY_PATH = os.getenv("STOCKFISH_SYZYGY_PATH", "")
+
+# 搜索预算：未指定 movetime_ms / nodes 时的默认深度，单次 movetime 上限，
+# 以及任何搜索的墙钟上限（超时后发送 stop，返回已找到的最佳结果）
+DEFAULT_DEPTH = 15
+STOCKFISH_MAX_MOVETIME_MS = int(os.getenv("STOCKFISH_MAX_MOVETIME_MS", "60000"))
+STOCKFISH_MAX_SEARCH_SECONDS = float(os.getenv("STOCKFISH_MAX_SEARCH_SECONDS", "120"))
+# movetime 到期后等待引擎给出 bestmove 的宽限时间
+MOVETIME_GRACE_SECONDS = 0.5
+
+# WebSocket 流式分析：每个 worker 同时存在的会话上限（每个会话独占一个引擎），
+# 单个局面无限分析的最长秒数，以及 info 推送的最小间隔
+STOCKFISH_MAX_STREAMS = int(os.getenv("STOCKFISH_MAX_STREAMS", str(max(1, STOCKFISH_POOL_SIZE // 2))))
+STOCKFISH_STREAM_MAX_SECONDS = float(os.getenv("STOCKFISH_STREAM_MAX_SECONDS", "300"))
+STOCKFISH_STREAM_INTERVAL = float(os.getenv("STOCKFISH_STREAM_INTERVAL", "0.1"))
+
 # 2. 为不同的子功能定义输入模型以进行验证
 
 class StockfishOptions(BaseModel):
     skill_level: int = Field(default=20, ge=0, le=20, description="Stockfish's skill level (0-20).")
-    depth: int = Field(default=15, ge=1, le=30, description="Analysis depth (1-30). Higher is stronger but slower.")
+    depth: Optional[int] = Field(
+        default=None, ge=1, le=30,
+        description="Analysis depth (1-30). Higher is stronger but slower. Defaults to 15 when no other budget is given.",
+    )
+    movetime_ms: Optional[int] = Field(
+        default=None, ge=1, le=STOCKFISH_MAX_MOVETIME_MS,
+        description="Search time budget in milliseconds; the best result found when it expires is returned.",
+    )
+    nodes: Optional[int] = Field(
+        default=None, ge=1, le=1_000_000_000,
+        description="Search node budget; the best result found when it is exhausted is returned.",
+    )
     count: int = Field(default=3, ge=1, le=10, description="Number of top moves to return for 'get_top_moves' mode.")
 
+    def has_budget(self) -> bool:
+        return self.movetime_ms is not None or self.nodes is not None
+
+    def search_depth(self) -> Optional[int]:
+        """传给 go 的深度：指定了时间或节点预算且未显式给出深度时不限制深度"""
+        if self.depth is not None:
+            return self.depth
+        return None if self.has_budget() else DEFAULT_DEPTH
+
+    def cache_depth(self) -> int:
+        """缓存条目至少达到该深度才能直接作为答案；纯预算请求按默认深度判断"""
+        return self.depth if self.depth is not None else DEFAULT_DEPTH
+
+    def timeout(self) -> float:
+        """墙钟上限：movetime 到期后再留少量宽限，其余情况使用全局上限"""
+        if self.movetime_ms is not None:
+            return min(STOCKFISH_MAX_SEARCH_SECONDS, self.movetime_ms / 1000 + MOVETIME_GRACE_SECONDS)
+        return STOCKFISH_MAX_SEARCH_SECONDS
+
 class StockfishInput(BaseModel):
-    mode: Literal['get_best_move', 'get_top_moves', 'evaluate_position'] = Field(
+    mode: Literal['get_best_move', 'get_top_moves', 'evaluate_position', 'analyze_game', 'batch'] = Field(
         description="The analysis mode to execute."
     )
-    fen: str = Field(description="The FEN string of the current board position.")
+    fen: Optional[str] = Field(default=None, description="The FEN string of the current board position (single-position modes).")
+    pgn: Optional[str] = Field(default=None, description="A PGN game to analyze move by move ('analyze_game' mode).")
+    fens: Optional[List[str]] = Field(
+        default=None,
+        description="FEN strings: consecutive positions of one game for 'analyze_game', or independent positions for 'batch'.",
+    )
     options: Optional[StockfishOptions] = Field(default_factory=StockfishOptions, description="Optional parameters for the analysis.")
 
     @validator('fen')
     def validate_fen_string(cls, v):
-        # 简单的FEN格式校验，更严格的校验由Stockfish引擎自己完成
-        parts = v.split()
-        if len(parts) != 6:
-            raise ValueError("FEN string must have 6 parts separated by spaces.")
-        return v
+        # 在进入引擎之前完成校验：非法局面可能导致引擎崩溃
+        return validate_fen(v) if v is not None else v
+
+    @validator('fens')
+    def validate_fen_list(cls, v):
+        if v is None:
+            return v
+        if not v:
+            raise ValueError("fens must not be empty.")
+        if len(v) > STOCKFISH_MAX_POSITIONS:
+            raise ValueError(f"At most {STOCKFISH_MAX_POSITIONS} positions can be analyzed per request.")
+        return [validate_fen(fen) for fen in v]
+
+    @root_validator(skip_on_failure=True)
+    def check_position_source(cls, values):
+        mode = values.get('mode')
+        if mode == 'analyze_game':
+            if (values.get('pgn') is None) == (values.get('fens') is None):
+                raise ValueError("'analyze_game' mode requires exactly one of 'pgn' or 'fens'.")
+        elif mode == 'batch':
+            if values.get('fens') is None:
+                raise ValueError("'batch' mode requires 'fens'.")
+        elif values.get('fen') is None:
+            raise ValueError(f"'{mode}' mode requires 'fen'.")
+        return values
+
+
+# 3. 常驻引擎池
+ENGINE_OPTIONS = {"Threads": STOCKFISH_THREADS, "Hash": STOCKFISH_HASH_MB}
+if STOCKFISH_SYZYGY_PATH:
+    ENGINE_OPTIONS["SyzygyPath"] = STOCKFISH_SYZYGY_PATH
+
+
+class PooledEngine:
+    """池中的一个 Stockfish 进程及其当前配置"""
+
+    def __init__(self, engine: UCIEngine):
+        self.engine = engine
+        self.created_at = time.time()
+        self.uses = 0
+
+    def alive(self) -> bool:
+        return self.engine.alive()
+
+    async def configure(self, skill_level: int):
+        """每次租用时按请求重新配置；选项只在变化时下发"""
+        await self.engine.set_option("Skill Level", skill_level)
+
+    def kill(self):
+        self.engine.kill()
+
+
+class EnginePool:
+    """
+    常驻 Stockfish 进程池，省去每次请求的进程启动、UCI 握手和哈希表分配。
+
+    引擎按需创建，最多 size 个；归还时检查进程是否存活，崩溃或出错的引擎被销毁，
+    并在后台补充新的引擎。每次设置局面时引擎会收到 ucinewgame，清空上一局的搜索状态。
+    """
+
+    def __init__(self, size: int = STOCKFISH_POOL_SIZE, lease_timeout: float = STOCKFISH_LEASE_TIMEOUT):
+        self.size = size
+        self.lease_timeout = lease_timeout
+        self._idle: deque = deque()
+        self._total = 0
+        self._leased = 0
+        self._closed = False
+        self._cond = asyncio.Condition()
+
+    async def _spawn(self) -> PooledEngine:
+        engine = await UCIEngine.start(
+            stockfish_path,
+            options=ENGINE_OPTIONS,
+        )
+        metrics.counter("stockfish_engines_started_total").inc()
+        return PooledEngine(engine)
+
+    async def start(self, count: Optional[int] = None):
+        """预先启动引擎"""
+        await asyncio.gather(*(self._replenish() for _ in range(count or self.size)))
 
-# 3. 创建工具类
+    async def acquire(self, timeout: Optional[float] = None) -> PooledEngine:
+        start = time.perf_counter()
+        deadline = start + (timeout if timeout is not None else self.lease_timeout)
+        async with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Stockfish engine pool is closed.")
+                while self._idle:
+                    pooled = self._idle.popleft()
+                    if pooled.alive():
+                        self._leased += 1
+                        metrics.histogram("stockfish_pool_lease_wait_seconds").observe(time.perf_counter() - start)
+                        return pooled
+                    # 空闲期间崩溃的引擎：销毁并在后台补充
+                    self._total -= 1
+                    pooled.kill()
+                    metrics.counter("stockfish_engine_crashes_total").inc()
+                    asyncio.create_task(self._replenish())
+                if self._total < self.size:
+                    self._total += 1
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    metrics.counter("stockfish_pool_lease_timeouts_total").inc()
+                    raise TimeoutError(f"No Stockfish engine available within {timeout or self.lease_timeout:g}s.")
+                try:
+                    await asyncio.wait_for(self._cond.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+        # 在锁外启动新引擎
+        try:
+            pooled = await self._spawn()
+        except Exception:
+            async with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+        async with self._cond:
+            self._leased += 1
+        metrics.histogram("stockfish_pool_lease_wait_seconds").observe(time.perf_counter() - start)
+        return pooled
+
+    async def release(self, pooled: PooledEngine, healthy: bool = True):
+        async with self._cond:
+            self._leased -= 1
+            pooled.uses += 1
+            if healthy and not self._closed and pooled.alive():
+                self._idle.append(pooled)
+                self._cond.notify()
+                return
+            self._total -= 1
+            self._cond.notify()
+        pooled.kill()
+        if not self._closed:
+            if not healthy:
+                metrics.counter("stockfish_engine_crashes_total").inc()
+            asyncio.create_task(self._replenish())
+
+    async def _replenish(self):
+        """在后台启动一个引擎放入空闲队列（用于预热和崩溃后的补充）"""
+        async with self._cond:
+            if self._closed or self._total >= self.size:
+                return
+            self._total += 1
+        try:
+            pooled = await self._spawn()
+        except Exception as e:
+            logger.error(f"Failed to start Stockfish engine: {e}")
+            async with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            return
+        async with self._cond:
+            if self._closed:
+                self._total -= 1
+                pooled.kill()
+                return
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    @asynccontextmanager
+    async def lease(self, timeout: Optional[float] = None):
+        pooled = await self.acquire(timeout)
+        healthy = False
+        try:
+            yield pooled
+            healthy = True
+        finally:
+            await self.release(pooled, healthy)
+
+    async def close(self):
+        async with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            pooled.kill()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "total": self._total,
+            "idle": len(self._idle),
+            "leased": self._leased,
+        }
+
+
+# 4. 分析结果缓存
+class AnalysisCache:
+    """
+    以规范化 FEN、MultiPV 数量和技能等级为键缓存原始搜索结果（分数相对于走棋方）。
+
+    get_best_move 与 evaluate_position 使用同一次 MultiPV=1 的搜索，因此共享缓存条目；
+    每个键只保留最深的一次结果，深度不低于请求深度的条目可以直接作为答案。
+    内存中为 LRU，配置 STOCKFISH_CACHE_DB 时同时写入 SQLite 文件，进程重启后和其他 worker 也能命中。
+    """
+
+    def __init__(self, max_entries: int = STOCKFISH_CACHE_SIZE, db_path: str = STOCKFISH_CACHE_DB):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5.0)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis ("
+                "key TEXT PRIMARY KEY, depth INTEGER NOT NULL, result TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(fen: str, multipv: int, skill_level: int, moves: Optional[List[str]] = None) -> str:
+        """
+        moves 为引擎到达 fen 所走的历史走法。最后一次吃子或兵走之后的走法会影响重复局面的判定，
+        计入键（半回合计数已在规范化 FEN 中）；没有这样的走法时与不带历史的同一局面共用条目。
+        """
+        key = f"v{CACHE_KEY_VERSION}|{normalize_fen(fen)}|multipv={multipv}|skill={skill_level}"
+        halfmove_clock = chess.Board(fen).halfmove_clock
+        reversible = min(halfmove_clock, len(moves or []))
+        if reversible:
+            key += f"|history={' '.join(moves[-reversible:])}"
+        return key
+
+    async def get(self, key: str, depth: int) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None and entry["depth"] >= depth:
+            self._entries.move_to_end(key)
+            metrics.counter("stockfish_cache_hits_total", source="memory").inc()
+            return entry
+        if self._db is not None:
+            entry = await asyncio.to_thread(self._db_get, key, depth)
+            if entry is not None:
+                self._remember(key, entry)
+                metrics.counter("stockfish_cache_hits_total", source="disk").inc()
+                return entry
+        metrics.counter("stockfish_cache_misses_total").inc()
+        return None
+
+    async def put(self, key: str, entry: dict):
+        current = self._entries.get(key)
+        if current is not None and current["depth"] > entry["depth"]:
+            return
+        self._remember(key, entry)
+        if self._db is not None:
+            await asyncio.to_thread(self._db_put, key, entry)
+
+    def _remember(self, key: str, entry: dict):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _db_get(self, key: str, depth: int) -> Optional[dict]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT result FROM analysis WHERE key = ? AND depth >= ?", (key, depth)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _db_put(self, key: str, entry: dict):
+        with self._db_lock:
+            # 只有更深（或同样深）的结果才覆盖已有条目
+            self._db.execute(
+                "INSERT INTO analysis (key, depth, result, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET depth = excluded.depth, result = excluded.result, "
+                "updated_at = excluded.updated_at WHERE excluded.depth >= analysis.depth",
+                (key, entry["depth"], json.dumps(entry), time.time()),
+            )
+            self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "persistent": self._db is not None}
+
+
+def _cache_entry(analysis: AnalysisResult, depth: Optional[int], stopped: bool) -> dict:
+    """
+    把一次搜索结果转换为可序列化的缓存条目。
+    纯深度搜索在请求深度之前结束（如将死局面）时，结果对更深的请求同样成立；
+    受时间/节点预算限制或被 stop 中断的搜索只记录实际达到的深度。
+    """
+    reached = analysis.depth
+    if depth is not None and not stopped:
+        reached = max(reached, depth)
+    return {
+        "depth": reached,
+        "seldepth": analysis.seldepth,
+        "nodes": analysis.nodes,
+        "time_ms": analysis.time_ms,
+        "bestmove": analysis.bestmove,
+        "ponder": analysis.ponder,
+        "lines": [
+            {"multipv": line.get("multipv", 1), "score": line["score"], "pv": line["pv"]}
+            for line in analysis.top_lines()
+        ],
+    }
+
+
+# 5. 创建工具类
 class StockfishTool:
     name = "stockfish_analyzer"
     description = (
         "A powerful chess analysis tool using the Stockfish engine. "
-        "Use different modes to get the best move, top several moves, or a positional evaluation."
+        "Use different modes to get the best move, top several moves, or a positional evaluation of one position, "
+        "to analyze a whole game (PGN or FEN list) with per-move evaluations and blunder detection, "
+        "or to evaluate a batch of positions."
     )
     input_schema = StockfishInput
 
+    def __init__(self):
+        self.pool = EnginePool()
+        self.cache = AnalysisCache()
+        self.fast_path = FastPath(STOCKFISH_BOOK_PATH, STOCKFISH_SYZYGY_PATH)
+        self.streams = 0
+
+    async def initialize(self):
+        """预先启动引擎池"""
+        await self.pool.start()
+
+    async def cleanup(self):
+        await self.pool.close()
+        self.cache.close()
+        self.fast_path.close()
+
     async def execute(self, parameters: StockfishInput) -> dict:
-        try:
-            # --- 初始化 Stockfish 引擎 ---
-            # 每次执行都创建一个新实例以保证状态纯净
-            stockfish = Stockfish(
-                path=stockfish_path,
-                depth=parameters.options.depth,
-                parameters={
-                    "Threads": 2,  # 限制CPU使用，可根据服务器配置调整
-                    "Skill Level": parameters.options.skill_level
-                }
-            )
-            
-            if not stockfish.is_fen_valid(parameters.fen):
-                return {"success": False, "error": f"Invalid FEN string provided: {parameters.fen}"}
-            
-            stockfish.set_fen_position(parameters.fen)
-            logger.info(f"Stockfish processing FEN: {parameters.fen} with mode: {parameters.mode}")
-
-            # --- 根据 mode 执行功能 ---
-            result = None
-            if parameters.mode == 'get_best_move':
-                best_move = stockfish.get_best_move()
-                evaluation = stockfish.get_evaluation()
-                result = {"best_move_uci": best_move, "evaluation": evaluation}
-            
-            elif parameters.mode == 'get_top_moves':
-                top_moves = stockfish.get_top_moves(parameters.options.count)
-                result = {"top_moves": top_moves}
-
-            elif parameters.mode == 'evaluate_position':
-                evaluation = stockfish.get_evaluation()
-                result = {"evaluation": evaluation}
-            
-            logger.info(f"Stockfish execution successful. Result: {result}")
-            return {"success": True, "data": result}
+        if parameters.mode == 'analyze_game':
+            return await self._analyze_game(parameters)
+        if parameters.mode == 'batch':
+            return await self._batch(parameters)
 
+        options = parameters.options
+        logger.info(f"Stockfish processing FEN: {parameters.fen} with mode: {parameters.mode}")
+        if self.fast_path.enabled and parameters.mode in ('get_best_move', 'evaluate_position'):
+            result = await self._probe_fast_path(parameters)
+            if result is not None:
+                logger.info(f"Stockfish answered from {result['source']}. Result: {result}")
+                return {"success": True, "data": result}
+        try:
+            multipv = options.count if parameters.mode == 'get_top_moves' else 1
+            entry = await self._search(parameters.fen, multipv, options)
+        except TimeoutError as e:
+            return {"success": False, "error": f"Stockfish busy: {e}"}
         except Exception as e:
             error_message = f"An error occurred in Stockfish tool: {str(e)}"
             logger.error(error_message)
             return {"success": False, "error": error_message}
+
+        result = _render(parameters.mode, parameters.fen, entry, options.count)
+        result["source"] = "engine"
+        logger.info(f"Stockfish execution successful. Result: {result}")
+        return {"success": True, "data": result}
+
+    def open_stream(self, send) -> "AnalysisStream":
+        """创建一个流式分析会话（调用方负责 attach / close）"""
+        return AnalysisStream(self, send)
+
+    async def _probe_fast_path(self, parameters: StockfishInput) -> Optional[dict]:
+        """
+        查询开局库和残局库。降低了 skill_level 的请求期望引擎的非完美走法，不使用残局库的精确结果。
+        命中时的响应与引擎结果字段相同（search 中的搜索开销为 0），source 标明来源；
+        未命中时记入 stockfish_fast_path_misses_total，作为各来源命中率的分母。
+        """
+        try:
+            hit = await asyncio.to_thread(
+                self.fast_path.probe, parameters.fen, parameters.mode,
+                use_tablebase=parameters.options.skill_level == 20,
+            )
+        except Exception as e:
+            logger.error(f"Stockfish fast path probe failed: {e}")
+            hit = None
+        if hit is None:
+            metrics.counter("stockfish_fast_path_misses_total", mode=parameters.mode).inc()
+            return None
+        if parameters.mode == 'evaluate_position':
+            hit.pop("best_move_uci", None)
+        hit["search"] = {"depth": 0, "seldepth": None, "nodes": 0, "time_ms": 0}
+        return hit
+
+    async def _search(self, fen: str, multipv: int, options: StockfishOptions) -> dict:
+        """返回缓存条目格式的搜索结果；缓存未命中时从池中租用引擎搜索并写入缓存"""
+        key = self.cache.key(fen, multipv, options.skill_level)
+        entry = await self.cache.get(key, options.cache_depth())
+        if entry is not None:
+            return entry
+        async with self.pool.lease() as pooled:
+            return await self._search_with(pooled, key, fen, multipv, options)
+
+    async def _search_with(self, pooled: PooledEngine, key: str, fen: str, multipv: int, options: StockfishOptions,
+                           moves: Optional[List[str]] = None, new_game: bool = True) -> dict:
+        """用已租用的引擎搜索并写入缓存"""
+        engine = pooled.engine
+        await pooled.configure(options.skill_level)
+        if new_game:
+            # 清空上一个请求的搜索状态
+            await engine.new_game()
+        depth = options.search_depth()
+        analysis = await engine.analyse(
+            fen, moves=moves, depth=depth, movetime=options.movetime_ms, nodes=options.nodes,
+            multipv=multipv, timeout=options.timeout(),
+        )
+        entry = _cache_entry(analysis, depth, stopped=analysis.stopped or options.has_budget())
+        await self.cache.put(key, entry)
+        return entry
+
+    async def _batch(self, parameters: StockfishInput) -> dict:
+        """
+        分析一组互不相关的局面。相同局面只分析一次；
+        最多 pool.size 个 worker 并发，每个 worker 在一次租用中连续处理多个未命中缓存的局面。
+        """
+        options = parameters.options
+        fens = parameters.fens
+        keys = [self.cache.key(fen, 1, options.skill_level) for fen in fens]
+        pending = deque(dict(zip(keys, fens)).items())
+        results: dict = {}
+
+        async def worker():
+            while pending:
+                key, fen = pending.popleft()
+                try:
+                    entry = await self.cache.get(key, options.cache_depth())
+                    if entry is not None:
+                        results[key] = entry
+                        continue
+                    async with self.pool.lease() as pooled:
+                        results[key] = await self._search_with(pooled, key, fen, 1, options)
+                        while pending:
+                            key, fen = pending.popleft()
+                            entry = await self.cache.get(key, options.cache_depth())
+                            if entry is None:
+                                entry = await self._search_with(pooled, key, fen, 1, options)
+                            results[key] = entry
+                except Exception as e:
+                    # 出错的引擎已在归还时销毁；记录该局面的错误，继续处理剩余局面
+                    logger.error(f"Stockfish batch analysis failed for {fen}: {e}")
+                    results[key] = e
+
+        await asyncio.gather(*(worker() for _ in range(min(self.pool.size, len(pending)))))
+
+        positions = []
+        for fen, key in zip(fens, keys):
+            entry = results[key]
+            if isinstance(entry, Exception):
+                error = f"Stockfish busy: {entry}" if isinstance(entry, TimeoutError) else str(entry)
+                positions.append({"fen": fen, "success": False, "error": error})
+            else:
+                positions.append({"fen": fen, "success": True, **_render('get_best_move', fen, entry, 1)})
+        return {"success": True, "data": {"positions": positions}}
+
+    async def _analyze_game(self, parameters: StockfishInput) -> dict:
+        """
+        整局分析。缓存未命中的局面按顺序切分为若干连续段，分别在池中的不同引擎上分析；
+        每段内按走子顺序连续搜索，不发送 ucinewgame，并以 "position ... moves" 传入历史，
+        使置换表在相邻局面之间保持有效。
+        """
+        options = parameters.options
+        try:
+            if parameters.pgn is not None:
+                positions = positions_from_pgn(parameters.pgn, STOCKFISH_MAX_POSITIONS)
+            else:
+                positions = positions_from_fens(parameters.fens)
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
+
+        entries: List[Optional[dict]] = [position.terminal_entry for position in positions]
+        keys = [self.cache.key(position.fen, 1, options.skill_level, position.moves) for position in positions]
+        missing = []
+        for i, key in enumerate(keys):
+            if entries[i] is None:
+                entries[i] = await self.cache.get(key, options.cache_depth())
+                if entries[i] is None:
+                    missing.append(i)
+
+        segment_count = max(1, min(self.pool.size, -(-len(missing) // STOCKFISH_MIN_SEGMENT_PLIES)))
+        segment_size = -(-len(missing) // segment_count) if missing else 0
+        segments = [missing[i:i + segment_size] for i in range(0, len(missing), segment_size or 1)]
+
+        async def walk(indices: List[int]):
+            async with self.pool.lease() as pooled:
+                for n, i in enumerate(indices):
+                    position: GamePosition = positions[i]
+                    entries[i] = await self._search_with(
+                        pooled, keys[i], position.engine_fen, 1, options,
+                        moves=position.moves or None, new_game=(n == 0),
+                    )
+
+        results = await asyncio.gather(*(walk(segment) for segment in segments), return_exceptions=True)
+        for result in results:
+            if isinstance(result, TimeoutError):
+                return {"success": False, "error": f"Stockfish busy: {result}"}
+            if isinstance(result, Exception):
+                error_message = f"An error occurred in Stockfish tool: {str(result)}"
+                logger.error(error_message)
+                return {"success": False, "error": error_message}
+
+        logger.info(f"Stockfish analyzed game: {len(positions)} positions, {len(missing)} searched")
+        return {"success": True, "data": annotate_game(positions, entries)}
+
+
+def _render(mode: str, fen: str, entry: dict, count: int) -> dict:
+    """按 mode 组织结果；引擎给出的分数相对于走棋方，这里统一换算为白方视角（正数表示白方优势）"""
+    sign = 1 if side_to_move(fen) == 'w' else -1
+    lines = entry["lines"]
+
+    if mode == 'get_best_move':
+        result = {"best_move_uci": entry["bestmove"], "evaluation": _evaluation(lines, sign)}
+
+    elif mode == 'get_top_moves':
+        top_moves = []
+        if entry["bestmove"] is not None:
+            for line in lines[:count]:
+                score = line["score"]
+                top_moves.append({
+                    "Move": line["pv"][0],
+                    "Centipawn": score["value"] * sign if score["type"] == "cp" else None,
+                    "Mate": score["value"] * sign if score["type"] == "mate" else None,
+                })
+        result = {"top_moves": top_moves}
+
+    else:
+        result = {"evaluation": _evaluation(lines, sign)}
+
+    # 实际达到的搜索深度与开销（时间/节点预算下深度因局面而异）
+    result["search"] = {
+        "depth": entry["depth"],
+        "seldepth": entry.get("seldepth"),
+        "nodes": entry.get("nodes"),
+        "time_ms": entry.get("time_ms"),
+    }
+    return result
+
+
+def _evaluation(lines: list, sign: int) -> dict:
+    """主变的评估，格式与 stockfish 包装库的 get_evaluation() 一致"""
+    if not lines:
+        # 无合法走法（将死或逼和）
+        return {}
+    score = lines[0]["score"]
+    return {"type": score["type"], "value": score["value"] * sign}
+
+
+# 6. 流式无限分析会话（WebSocket）
+_UCI_MOVE_RE = re.compile(r"^[a-h][1-8][a-h][1-8][qrbn]?$")
+
+
+class StreamCommand(BaseModel):
+    """
+    WebSocket 客户端发送的命令：
+    - {"type": "position", "fen": ..., "moves": [...], "multipv": 3}：在新局面上开始（或切换到）无限分析
+    - {"type": "stop"}：停止当前分析，保留会话和引擎
+    """
+    type: Literal['position', 'stop']
+    fen: Optional[str] = None
+    moves: List[str] = Field(default_factory=list, description="UCI moves played from 'fen'.")
+    multipv: int = Field(default=1, ge=1, le=10)
+    skill_level: int = Field(default=20, ge=0, le=20)
+
+    @validator('fen')
+    def validate_fen_string(cls, v):
+        return validate_fen(v) if v is not None else v
+
+    @validator('moves')
+    def validate_moves(cls, v):
+        if len(v) > STOCKFISH_MAX_POSITIONS:
+            raise ValueError(f"At most {STOCKFISH_MAX_POSITIONS} moves are allowed.")
+        for move in v:
+            if not _UCI_MOVE_RE.match(move):
+                raise ValueError(f"Invalid UCI move: {move}")
+        return v
+
+    @root_validator(skip_on_failure=True)
+    def check_position(cls, values):
+        if values.get('type') == 'position':
+            if values.get('fen') is None:
+                raise ValueError("'position' command requires 'fen'.")
+            # 引擎会静默忽略非法走法，这里先检查合法性
+            _final_fen(values['fen'], values.get('moves') or [])
+        return values
+
+
+def _final_fen(fen: str, moves: List[str]) -> str:
+    """在 fen 上依次走 moves，返回最终局面；走法不合法时抛出 ValueError"""
+    board = chess.Board(fen)
+    for move in moves:
+        try:
+            board.push_uci(move)
+        except ValueError:
+            raise ValueError(f"Illegal move {move} in position {board.fen()}")
+    return board.fen()
+
+
+class AnalysisStream:
+    """
+    一个 WebSocket 会话独占一个池中的引擎，对当前局面执行 go infinite，
+    按深度推送 MultiPV 更新。切换局面时只 stop 当前搜索并重新 go，不重启引擎进程。
+
+    send: 向客户端发送一条 JSON 消息的协程函数；连接断开后的发送失败会被忽略。
+    """
+
+    def __init__(self, tool: "StockfishTool", send):
+        self.tool = tool
+        self._send = send
+        self.pooled: Optional[PooledEngine] = None
+        self._task: Optional[asyncio.Task] = None
+        self._healthy = True
+        self._closed = False
+        self._attached = False
+
+    async def attach(self):
+        if self.tool.streams >= STOCKFISH_MAX_STREAMS:
+            raise TimeoutError(f"Too many streaming sessions ({STOCKFISH_MAX_STREAMS}) on this worker.")
+        self.tool.streams += 1
+        try:
+            self.pooled = await self.tool.pool.acquire()
+            await self.pooled.engine.new_game()
+        except BaseException:
+            self.tool.streams -= 1
+            if self.pooled is not None:
+                await self.tool.pool.release(self.pooled, healthy=False)
+                self.pooled = None
+            raise
+        self._attached = True
+        metrics.counter("stockfish_streams_started_total").inc()
+
+    async def emit(self, message: dict):
+        if self._closed:
+            return
+        try:
+            await self._send(message)
+        except Exception:
+            # 客户端已断开，由接收循环负责关闭会话
+            self._closed = True
+
+    async def set_position(self, command: StreamCommand):
+        await self.stop()
+        if self.pooled is None or not self._healthy:
+            try:
+                await self._replace_engine()
+            except Exception as e:
+                await self.emit({"type": "error", "error": f"Stockfish busy: {e}"})
+                return
+        await self.pooled.configure(command.skill_level)
+        # 等到 go 发出后再返回：紧接着到达的下一条命令调用 stop() 时，引擎必须已经在搜索，
+        # 否则 stop 会被引擎忽略，go infinite 一直运行到 stop() 超时
+        go_sent = asyncio.Event()
+        self._task = asyncio.create_task(self._analyse(command, go_sent.set))
+        waiter = asyncio.ensure_future(go_sent.wait())
+        try:
+            await asyncio.wait({self._task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+
+    async def _replace_engine(self):
+        """
+        出错或未能正常停止的引擎可能还会输出上一次搜索残留的 info / bestmove，
+        在开始新的搜索前把它作为不健康的引擎还给池，换用另一个引擎。
+        """
+        old, self.pooled = self.pooled, None
+        if old is not None:
+            await self.tool.pool.release(old, healthy=False)
+            metrics.counter("stockfish_stream_engines_replaced_total").inc()
+        pooled = await self.tool.pool.acquire()
+        try:
+            await pooled.engine.new_game()
+        except BaseException:
+            await self.tool.pool.release(pooled, healthy=False)
+            raise
+        self.pooled = pooled
+        self._healthy = True
+
+    async def _analyse(self, command: StreamCommand, on_go):
+        final_fen = _final_fen(command.fen, command.moves)
+        sign = 1 if side_to_move(final_fen) == 'w' else -1
+        # 合法走法少于 multipv 时，引擎每轮只输出与合法走法数相同的线
+        line_count = max(1, min(command.multipv, chess.Board(final_fen).legal_moves.count()))
+        lines: dict = {}
+        last_sent = 0.0
+
+        def snapshot(info: dict) -> dict:
+            return {
+                "fen": final_fen,
+                "depth": info.get("depth"),
+                "seldepth": info.get("seldepth"),
+                "nodes": info.get("nodes"),
+                "nps": info.get("nps"),
+                "time_ms": info.get("time"),
+                "lines": [
+                    {
+                        "multipv": k,
+                        "evaluation": {"type": lines[k]["score"]["type"], "value": lines[k]["score"]["value"] * sign},
+                        "depth": lines[k].get("depth"),
+                        "pv": lines[k]["pv"],
+                    }
+                    for k in sorted(lines)
+                ],
+            }
+
+        async def on_info(info: dict):
+            nonlocal last_sent
+            if "score" not in info or info["score"].get("bound"):
+                return
+            lines[info.get("multipv", 1)] = info
+            # 每完成一轮迭代（最后一条 MultiPV 线到达）推送一次，并限制推送频率
+            now = time.monotonic()
+            if info.get("multipv", 1) == line_count and now - last_sent >= STOCKFISH_STREAM_INTERVAL:
+                last_sent = now
+                await self.emit({"type": "info", **snapshot(info)})
+
+        try:
+            analysis = await self.pooled.engine.analyse(
+                command.fen, moves=command.moves or None, infinite=True, multipv=command.multipv,
+                timeout=STOCKFISH_STREAM_MAX_SECONDS, on_info=on_info, on_go=on_go,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._healthy = False
+            logger.error(f"Stockfish streaming analysis failed: {e}")
+            await self.emit({"type": "error", "error": f"Engine error: {e}"})
+            return
+        await self.emit({
+            "type": "bestmove",
+            "fen": final_fen,
+            "best_move_uci": analysis.bestmove,
+            "ponder": analysis.ponder,
+            "depth": analysis.depth,
+            "stopped": analysis.stopped,
+        })
+
+    async def stop(self):
+        """停止当前搜索并等待引擎给出 bestmove"""
+        task, self._task = self._task, None
+        if task is None or task.done():
+            return
+        try:
+            await self.pooled.engine.stop()
+            await asyncio.wait_for(asyncio.shield(task), 5.0)
+        except Exception as e:
+            logger.error(f"Stockfish did not stop cleanly: {e}")
+            self._healthy = False
+            task.cancel()
+
+    async def close(self):
+        if not self._attached:
+            return
+        self._attached = False
+        await self.stop()
+        self._closed = True
+        self.tool.streams -= 1
+        pooled, self.pooled = self.pooled, None
+        if pooled is not None:
+            await self.tool.pool.release(pooled, healthy=self._healthy)
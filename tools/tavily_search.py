@@ -1,29 +1,181 @@
 import os
-from tavily import TavilyClient
-from pydantic import BaseModel, Field
+import re
+import time
+import asyncio
+import logging
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from pydantic import BaseModel, Field, root_validator, validator
+
+from .http_client import build_async_client
+from .metrics import metrics
+from .rate_limiter import RateLimiter
+from .url_utils import canonicalize_url
+
+logger = logging.getLogger(__name__)
 
 # Load the API key from environment variables once when the module is loaded.
 api_key = os.getenv("TAVILY_API_KEY")
 if not api_key:
     raise ValueError("TAVILY_API_KEY not found in environment variables. Please set it in the .env file.")
 
-tavily_client = TavilyClient(api_key=api_key)
+# HTTP client settings. TAVILY_BASE_URL can point at a local stub server for testing.
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+TAVILY_TIMEOUT = float(os.getenv("TAVILY_TIMEOUT", "30"))
+TAVILY_CONNECT_TIMEOUT = float(os.getenv("TAVILY_CONNECT_TIMEOUT", "5"))
+TAVILY_MAX_CONNECTIONS = int(os.getenv("TAVILY_MAX_CONNECTIONS", "20"))
+TAVILY_HTTP2 = os.getenv("TAVILY_HTTP2", "true").lower() in ("1", "true", "yes")
+
+# Client-side rate limit shared by all workers on this host (requests per second, 0 disables; burst size).
+# Keep it just under the plan's limit; 429/5xx responses are still retried with backoff.
+TAVILY_RATE_LIMIT = float(os.getenv("TAVILY_RATE_LIMIT", "1.5"))
+TAVILY_RATE_BURST = int(os.getenv("TAVILY_RATE_BURST", "10"))
+
+# Result cache: entries are fresh for TAVILY_CACHE_TTL seconds, then may be served stale for up to
+# TAVILY_CACHE_STALE_TTL more seconds while a background refresh runs. TAVILY_CACHE_SIZE=0 disables it.
+TAVILY_CACHE_SIZE = int(os.getenv("TAVILY_CACHE_SIZE", "1000"))
+TAVILY_CACHE_TTL = float(os.getenv("TAVILY_CACHE_TTL", "300"))
+TAVILY_CACHE_STALE_TTL = float(os.getenv("TAVILY_CACHE_STALE_TTL", "1800"))
+
+# Multi-query fan-out: at most TAVILY_MAX_QUERIES queries per call, TAVILY_FANOUT_CONCURRENCY of them in flight.
+TAVILY_MAX_QUERIES = int(os.getenv("TAVILY_MAX_QUERIES", "10"))
+TAVILY_FANOUT_CONCURRENCY = int(os.getenv("TAVILY_FANOUT_CONCURRENCY", "4"))
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, drop punctuation (keeping '+' and '#', e.g. C++ / C#) and collapse whitespace."""
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = re.sub(r"[^\w\s+#]", " ", query)
+    return " ".join(query.split())
+
+
+class SearchCache:
+    """
+    Size-bounded LRU of search responses with a TTL and a stale-while-revalidate window.
+    """
+
+    def __init__(self, max_entries: int = TAVILY_CACHE_SIZE, ttl: float = TAVILY_CACHE_TTL,
+                 stale_ttl: float = TAVILY_CACHE_STALE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(query: str, search_depth: str, max_results: int) -> Tuple:
+        return (normalize_query(query), search_depth, max_results)
+
+    def get(self, key: Tuple) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Return (result, state) where state is 'hit', 'stale' or 'miss'."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, "miss"
+        stored_at, result = entry
+        age = time.monotonic() - stored_at
+        if age >= self.ttl + self.stale_ttl:
+            del self._entries[key]
+            return None, "miss"
+        self._entries.move_to_end(key)
+        return result, "hit" if age < self.ttl else "stale"
+
+    def put(self, key: Tuple, result: Dict[str, Any]):
+        self._entries[key] = (time.monotonic(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            metrics.counter("tavily_cache_evictions_total").inc()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl, "stale_ttl": self.stale_ttl}
+
+
+def merge_results(outcomes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Merge the results of several queries, deduplicated by canonical URL. Each merged result keeps the
+    fields of its best-scoring copy and lists every query that returned it under `sources`
+    (query, 1-based rank, score). Results are ordered by best score, then by how many queries found them.
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for outcome in outcomes:
+        if not outcome["success"]:
+            continue
+        for rank, item in enumerate(outcome["result"].get("results") or [], start=1):
+            url = item.get("url")
+            key = canonicalize_url(url) if url else f"{outcome['query']}#{rank}"
+            source = {"query": outcome["query"], "rank": rank, "score": item.get("score")}
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = {**item, "sources": [source]}
+                continue
+            entry["sources"].append(source)
+            if (item.get("score") or 0) > (entry.get("score") or 0):
+                entry.update(item)
+    return sorted(
+        merged.values(),
+        key=lambda entry: (-(entry.get("score") or 0), -len(entry["sources"])),
+    )
 
 class TavilySearchInput(BaseModel):
-    """Input schema for the Tavily Search tool."""
-    query: str = Field(description="The search query to execute.")
+    """Input schema for the Tavily Search tool. Exactly one of `query` or `queries` must be given."""
+    query: Optional[str] = Field(default=None, description="The search query to execute.")
+    queries: Optional[List[str]] = Field(
+        default=None,
+        description="Several queries to run concurrently; results are merged and deduplicated by URL."
+    )
     search_depth: str = Field(
         default="advanced",
         description="The depth of the search. 'basic' is faster, 'advanced' is more comprehensive."
     )
     max_results: int = Field(
         default=5,
-        description="The maximum number of search results to return."
+        description="The maximum number of search results to return (per query in multi-query mode)."
     )
+    max_concurrency: Optional[int] = Field(
+        default=None,
+        description=f"How many of `queries` run at once (default and upper bound {TAVILY_FANOUT_CONCURRENCY})."
+    )
+
+    @validator('queries')
+    def validate_queries(cls, v):
+        if v is None:
+            return v
+        # Drop blanks and duplicates that would hit the same cache entry
+        unique: Dict[str, str] = {}
+        for query in v:
+            if query.strip():
+                unique.setdefault(normalize_query(query), query.strip())
+        if not unique:
+            raise ValueError("queries must contain at least one non-empty query.")
+        if len(unique) > TAVILY_MAX_QUERIES:
+            raise ValueError(f"At most {TAVILY_MAX_QUERIES} queries can be searched per call.")
+        return list(unique.values())
+
+    @validator('max_concurrency')
+    def validate_max_concurrency(cls, v):
+        if v is not None and v < 1:
+            raise ValueError("max_concurrency must be at least 1.")
+        return v
+
+    @root_validator(skip_on_failure=True)
+    def check_query_source(cls, values):
+        if (values.get('query') is None) == (values.get('queries') is None):
+            raise ValueError("Exactly one of 'query' or 'queries' must be provided.")
+        return values
 
 class TavilySearchTool:
     """
     A tool for performing web searches using the Tavily API.
+
+    Requests go through one shared, pooled `httpx.AsyncClient` (keep-alive, HTTP/2 where
+    supported), so concurrent searches overlap instead of blocking the event loop.
+    Responses are cached by normalized query; concurrent identical searches share one API call.
     """
     name = "tavily_search"
     description = (
@@ -32,24 +184,181 @@ class TavilySearchTool:
     )
     input_schema = TavilySearchInput
 
+    def __init__(self):
+        self.client = build_async_client(
+            TAVILY_BASE_URL,
+            timeout=TAVILY_TIMEOUT,
+            connect_timeout=TAVILY_CONNECT_TIMEOUT,
+            max_connections=TAVILY_MAX_CONNECTIONS,
+            http2=TAVILY_HTTP2,
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        self.limiter = RateLimiter("tavily", TAVILY_RATE_LIMIT, TAVILY_RATE_BURST)
+        self.cache = SearchCache()
+        # In-flight API calls by cache key, so concurrent misses and refreshes share one request
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        self._refresh_tasks: set = set()
+
+    async def cleanup(self):
+        for task in list(self._refresh_tasks) + list(self._inflight.values()):
+            task.cancel()
+        await self.client.aclose()
+
+    async def cached_search(self, query: str, search_depth: str, max_results: int) -> Tuple[dict, str]:
+        """
+        Search through the cache. Returns (result, cache_state) with cache_state one of
+        'hit', 'stale' (served immediately, refreshed in the background), 'miss' or 'disabled'.
+        """
+        if not self.cache.enabled:
+            return await self.search(query, search_depth, max_results), "disabled"
+        key = self.cache.key(query, search_depth, max_results)
+        result, state = self.cache.get(key)
+        metrics.counter("tavily_cache_requests_total", result=state).inc()
+        if state == "hit":
+            return result, state
+        if state == "stale":
+            if key not in self._inflight:
+                task = asyncio.create_task(self._refresh(key, query, search_depth, max_results))
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_tasks.discard)
+            return result, state
+        return await self._fetch(key, query, search_depth, max_results), state
+
+    async def _fetch(self, key: Tuple, query: str, search_depth: str, max_results: int) -> dict:
+        """
+        Call the API once per key at a time and store successful results. The call runs as its own
+        task and every caller awaits it through asyncio.shield, so one caller being cancelled (e.g. a
+        client disconnecting) does not cancel the request for the others sharing it.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.counter("tavily_cache_coalesced_total").inc()
+        else:
+            task = asyncio.create_task(self._search_and_store(key, query, search_depth, max_results))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._fetch_done(key, done))
+        return await asyncio.shield(task)
+
+    async def _search_and_store(self, key: Tuple, query: str, search_depth: str, max_results: int) -> dict:
+        result = await self.search(query, search_depth, max_results)
+        self.cache.put(key, result)
+        return result
+
+    def _fetch_done(self, key: Tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Retrieve the exception so a task whose callers have all gone away does not log a warning
+        if not task.cancelled():
+            task.exception()
+
+    async def _refresh(self, key: Tuple, query: str, search_depth: str, max_results: int):
+        try:
+            await self._fetch(key, query, search_depth, max_results)
+            metrics.counter("tavily_cache_refreshes_total", result="ok").inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Keep serving the stale entry until it expires
+            metrics.counter("tavily_cache_refreshes_total", result="error").inc()
+            logger.warning(f"Background Tavily refresh failed for {query!r}: {e}")
+
+    async def search(self, query: str, search_depth: str, max_results: int) -> dict:
+        """
+        Call the Tavily /search endpoint and return the decoded JSON response.
+        Calls wait for the shared rate limiter; 429, 5xx and connection failures (including a pooled
+        keep-alive connection closed by the server) are retried with backoff. Read timeouts are not.
+        """
+        async def post() -> dict:
+            response = await self.client.post(
+                "/search",
+                json={
+                    "query": query,
+                    "search_depth": search_depth,
+                    "max_results": max_results,
+                },
+            )
+            response.raise_for_status()
+            return response.json()
+
+        return await self.limiter.call(post, retry_on=(httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError))
+
+    async def multi_search(self, queries: List[str], search_depth: str, max_results: int,
+                           max_concurrency: Optional[int] = None) -> dict:
+        """Run `queries` concurrently (bounded by max_concurrency) and merge their results."""
+        limit = min(max_concurrency or TAVILY_FANOUT_CONCURRENCY, TAVILY_FANOUT_CONCURRENCY)
+        semaphore = asyncio.Semaphore(limit)
+
+        async def run(query: str) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    result, cache_state = await self.cached_search(query, search_depth, max_results)
+                except Exception as e:
+                    return {"query": query, "success": False, "error": self._error_message(e)}
+                return {"query": query, "success": True, "result": result, "cache": cache_state}
+
+        outcomes = await asyncio.gather(*(run(query) for query in queries))
+        results = merge_results(outcomes)
+        total = sum(len(o["result"].get("results") or []) for o in outcomes if o["success"])
+        summaries = []
+        for outcome in outcomes:
+            summary = {"query": outcome["query"], "success": outcome["success"]}
+            if outcome["success"]:
+                summary["cache"] = outcome["cache"]
+                summary["result_count"] = len(outcome["result"].get("results") or [])
+                if outcome["result"].get("answer"):
+                    summary["answer"] = outcome["result"]["answer"]
+            else:
+                summary["error"] = outcome["error"]
+            summaries.append(summary)
+        return {
+            "queries": summaries,
+            "results": results,
+            "duplicates_removed": total - len(results),
+        }
+
+    @staticmethod
+    def _error_message(e: Exception) -> str:
+        if isinstance(e, httpx.HTTPStatusError):
+            # Surface the provider's error message (e.g. invalid key, usage limit) when present
+            detail = e.response.text[:500]
+            return f"Tavily API returned HTTP {e.response.status_code}: {detail}"
+        if isinstance(e, httpx.TimeoutException):
+            return f"The Tavily search timed out: {type(e).__name__}"
+        return f"An error occurred during the Tavily search: {str(e)}"
+
     async def execute(self, parameters: TavilySearchInput) -> dict:
         """
-        Executes the Tavily search.
+        Executes the Tavily search. With `queries`, all queries are searched concurrently and
+        the merged, deduplicated results are returned in one response.
         """
+        if parameters.queries is not None:
+            data = await self.multi_search(
+                parameters.queries,
+                search_depth=parameters.search_depth,
+                max_results=parameters.max_results,
+                max_concurrency=parameters.max_concurrency,
+            )
+            failed = [q for q in data["queries"] if not q["success"]]
+            if len(failed) == len(data["queries"]):
+                return {
+                    "success": False,
+                    "error": f"All {len(failed)} queries failed. First error: {failed[0]['error']}"
+                }
+            return {"success": True, "data": data}
         try:
-            # The Tavily client's search method returns a dictionary.
-            search_result = tavily_client.search(
+            search_result, cache_state = await self.cached_search(
                 query=parameters.query,
                 search_depth=parameters.search_depth,
                 max_results=parameters.max_results
             )
             return {
                 "success": True,
-                "data": search_result
+                "data": search_result,
+                "cache": cache_state
             }
         except Exception as e:
             # Handle potential exceptions during the API call
             return {
                 "success": False,
-                "error": f"An error occurred during the Tavily search: {str(e)}"
-            }
\ No newline at end of file
+                "error": self._error_message(e)
+            }
@@ -1,4 +1,4 @@
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator
 from pydantic import ValidationError
 import logging
 
@@ -11,6 +11,7 @@ from .code_interpreter import CodeInterpreterTool as PythonSandboxTool
 from .firecrawl_tool import FirecrawlTool
 from .stockfish_tool import StockfishTool
 from .crawl4ai_tool_all import EnhancedCrawl4AITool  # 改为增强版本
+from .web_scrape_router import WebScrapeRouter
 
 # --- Tool Classes Registry ---
 TOOL_CLASSES = {
@@ -19,6 +20,7 @@ TOOL_CLASSES = {
     FirecrawlTool.name: FirecrawlTool,
     StockfishTool.name: StockfishTool,
     EnhancedCrawl4AITool.name: EnhancedCrawl4AITool,  # 更新为增强版类名
+    WebScrapeRouter.name: WebScrapeRouter,
 }
 
 # --- Shared Tool Instances ---
@@ -28,6 +30,8 @@ tool_instances: Dict[str, Any] = {}
 async def initialize_tools():
     """创建并初始化所有工具的实例"""
     logger.info("Starting tool initialization...")
+    # 初始化成功的工具；web_scrape 只路由到其中的后端
+    ready: Dict[str, Any] = {}
     
     for name, tool_class in TOOL_CLASSES.items():
         try:
@@ -41,6 +45,17 @@ async def initialize_tools():
                 logger.info("Pre-warming browser for crawl4ai...")
                 await tool_instance.initialize()
                 logger.info("Browser pre-warmed successfully for crawl4ai")
+
+            # 预先启动 Stockfish 引擎池
+            if name == StockfishTool.name:
+                await tool_instance.initialize()
+                logger.info(f"Stockfish engine pool started ({tool_instance.pool.size} engines)")
+
+            # web_scrape 路由到初始化成功的 crawl4ai / firecrawl 实例（预热失败的 crawl4ai 仍可直接调用，但不参与路由）
+            if name == WebScrapeRouter.name:
+                tool_instance.bind(ready)
+
+            ready[name] = tool_instance
                 
         except Exception as e:
             logger.error(f"Failed to initialize tool {name}: {str(e)}")
@@ -53,13 +68,15 @@ async def cleanup_tools():
     """清理需要特殊处理的工具资源"""
     logger.info("Starting tool cleanup...")
     
-    # 特别清理 crawl4ai 的浏览器资源
-    if "crawl4ai" in tool_instances:
+    # 清理持有外部资源的工具（crawl4ai 的浏览器、python_sandbox 的容器池等）
+    for name, tool_instance in tool_instances.items():
+        if not hasattr(tool_instance, "cleanup"):
+            continue
         try:
-            await tool_instances["crawl4ai"].cleanup()
-            logger.info("crawl4ai browser resources cleaned up successfully")
+            await tool_instance.cleanup()
+            logger.info(f"{name} resources cleaned up successfully")
         except Exception as e:
-            logger.error(f"Error cleaning up crawl4ai: {str(e)}")
+            logger.error(f"Error cleaning up {name}: {str(e)}")
     
     # 清空工具实例字典
     tool_instances.clear()
@@ -101,4 +118,47 @@ async def execute_tool(tool_name: str, parameters: Dict[str, Any]) -> Dict[str,
         return {
             "success": False,
             "error": f"An error occurred while executing tool '{tool_name}': {str(e)}"
-        }
\ No newline at end of file
+        }
+
+def execute_tool_stream(tool_name: str, parameters: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    流式执行工具，返回事件的异步迭代器。声明了 `streams_done_events = True` 的工具由其
+    `async stream(parameters)` 逐条产生事件，其他工具（包括事件格式不同的 python_sandbox 流）
+    只产生一条包含完整结果的事件。最后一条事件总是 {"type": "done", "success": ...}。
+    工具不存在时抛出 ValueError；输入校验失败时只产生一条带 details 的 done 事件。
+    """
+    if tool_name not in tool_instances:
+        available_tools = list(tool_instances.keys())
+        error_msg = f"Tool '{tool_name}' not found or not initialized. Available tools: {available_tools}"
+        logger.warning(error_msg)
+        raise ValueError(error_msg)
+    return _stream_events(tool_name, tool_instances[tool_name], parameters)
+
+async def _stream_events(tool_name: str, tool_instance: Any, parameters: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    try:
+        validated_parameters = tool_instance.input_schema(**parameters)
+    except ValidationError as e:
+        logger.warning(f"Input validation failed for tool {tool_name}: {e.errors()}")
+        yield {"type": "done", "success": False, "error": "Input validation failed", "details": e.errors()}
+        return
+
+    try:
+        logger.info(f"Streaming tool: {tool_name} with mode: {getattr(validated_parameters, 'mode', 'N/A')}")
+        if getattr(tool_instance, "streams_done_events", False):
+            done = False
+            async for event in tool_instance.stream(validated_parameters):
+                done = event.get("type") == "done"
+                yield event
+            if not done:
+                logger.error(f"Stream of tool {tool_name} ended without a done event")
+                yield {"type": "done", "success": False, "error": f"Tool '{tool_name}' ended its stream without a result."}
+        else:
+            result = await tool_instance.execute(validated_parameters)
+            yield {"type": "done", **result}
+    except Exception as e:
+        logger.error(f"Error streaming tool {tool_name}: {str(e)}")
+        yield {
+            "type": "done",
+            "success": False,
+            "error": f"An error occurred while executing tool '{tool_name}': {str(e)}"
+        }
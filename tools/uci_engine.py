@@ -0,0 +1,276 @@
+"""
+基于 asyncio 子进程的最小 UCI 驱动。
+
+所有与引擎的交互（握手、setoption、go、解析 info 行）都是非阻塞的，
+长时间的搜索不会卡住 worker 的事件循环。一个 UCIEngine 同一时间只服务一个分析请求，
+并发由 stockfish_tool.EnginePool 负责。
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# info 行中带一个整数参数的字段
+_INT_FIELDS = {"depth", "seldepth", "multipv", "nodes", "nps", "time", "hashfull", "tbhits", "currmovenumber"}
+
+
+class EngineError(RuntimeError):
+    """引擎进程退出、协议错误或响应超时"""
+
+
+def parse_info(line: str) -> Dict[str, Any]:
+    """
+    解析一行 UCI info 输出，例如：
+        info depth 20 seldepth 28 multipv 1 score cp 35 nodes 1234 nps 5678 time 217 pv e2e4 e7e5
+    score 以 {"type": "cp"|"mate", "value": int} 表示（相对于走棋方），pv 为 UCI 走法列表。
+    """
+    tokens = line.split()
+    info: Dict[str, Any] = {}
+    i = 1
+    while i < len(tokens):
+        key = tokens[i]
+        if key in _INT_FIELDS and i + 1 < len(tokens):
+            try:
+                info[key] = int(tokens[i + 1])
+            except ValueError:
+                pass
+            i += 2
+        elif key == "score" and i + 2 < len(tokens):
+            info["score"] = {"type": tokens[i + 1], "value": int(tokens[i + 2])}
+            i += 3
+            if i < len(tokens) and tokens[i] in ("lowerbound", "upperbound"):
+                info["score"]["bound"] = tokens[i]
+                i += 1
+        elif key == "wdl" and i + 3 < len(tokens):
+            info["wdl"] = [int(t) for t in tokens[i + 1:i + 4]]
+            i += 4
+        elif key == "currmove" and i + 1 < len(tokens):
+            info["currmove"] = tokens[i + 1]
+            i += 2
+        elif key == "pv":
+            info["pv"] = tokens[i + 1:]
+            break
+        elif key == "string":
+            info["string"] = " ".join(tokens[i + 1:])
+            break
+        else:
+            i += 1
+    return info
+
+
+class AnalysisResult:
+    """一次 go 搜索的结果：最佳走法、每条 MultiPV 线的最终 info 以及达到的深度"""
+
+    def __init__(self):
+        self.bestmove: Optional[str] = None
+        self.ponder: Optional[str] = None
+        self.lines: Dict[int, Dict[str, Any]] = {}
+        self.depth = 0
+        self.seldepth = 0
+        self.nodes = 0
+        self.time_ms = 0
+        # 搜索是否因超出 timeout 被 stop 提前结束
+        self.stopped = False
+
+    def update(self, info: Dict[str, Any]):
+        if "pv" not in info or "score" not in info:
+            return
+        # 只保留边界分数以外的完整结果；每条线保存最新（最深）的一次
+        if info["score"].get("bound"):
+            return
+        self.lines[info.get("multipv", 1)] = info
+        self.depth = max(self.depth, info.get("depth", 0))
+        self.seldepth = max(self.seldepth, info.get("seldepth", 0))
+        self.nodes = max(self.nodes, info.get("nodes", 0))
+        self.time_ms = max(self.time_ms, info.get("time", 0))
+
+    def top_lines(self) -> List[Dict[str, Any]]:
+        return [self.lines[k] for k in sorted(self.lines)]
+
+
+class UCIEngine:
+    """一个 UCI 引擎子进程"""
+
+    def __init__(self, process: asyncio.subprocess.Process, path: str):
+        self.process = process
+        self.path = path
+        self.name: Optional[str] = None
+        self.options: Dict[str, Any] = {}
+        self._searching = False
+
+    @classmethod
+    async def start(cls, path: str, options: Optional[Dict[str, Any]] = None,
+                    timeout: float = 10.0) -> "UCIEngine":
+        process = await asyncio.create_subprocess_exec(
+            path,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        engine = cls(process, path)
+        try:
+            await engine._handshake(timeout)
+            for name, value in (options or {}).items():
+                await engine.set_option(name, value)
+            await engine.is_ready(timeout)
+        except BaseException:
+            engine.kill()
+            raise
+        return engine
+
+    # --- 底层读写 ---
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def send(self, command: str):
+        if not self.alive() or self.process.stdin is None:
+            raise EngineError("Engine process has exited.")
+        try:
+            self.process.stdin.write(f"{command}\n".encode())
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise EngineError(f"Engine process has exited: {e}")
+
+    async def _read_line(self) -> str:
+        line = await self.process.stdout.readline()
+        if not line:
+            raise EngineError("Engine process has exited.")
+        return line.decode(errors="replace").strip()
+
+    async def _wait_for(self, token: str, timeout: float) -> List[str]:
+        """读取输出直到出现以 token 开头的行，返回期间读到的所有行"""
+        lines = []
+
+        async def read():
+            while True:
+                line = await self._read_line()
+                lines.append(line)
+                if line.split(" ", 1)[0] == token:
+                    return
+
+        try:
+            await asyncio.wait_for(read(), timeout)
+        except asyncio.TimeoutError:
+            raise EngineError(f"Engine did not answer '{token}' within {timeout:g}s.")
+        return lines
+
+    async def _handshake(self, timeout: float):
+        await self.send("uci")
+        for line in await self._wait_for("uciok", timeout):
+            if line.startswith("id name "):
+                self.name = line[len("id name "):]
+
+    # --- UCI 命令 ---
+    async def set_option(self, name: str, value: Any):
+        """setoption；值与当前相同时跳过"""
+        if self.options.get(name) == value:
+            return
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        await self.send(f"setoption name {name} value {value}")
+        self.options[name] = value
+
+    async def is_ready(self, timeout: float = 10.0):
+        await self.send("isready")
+        await self._wait_for("readyok", timeout)
+
+    async def new_game(self, timeout: float = 10.0):
+        """ucinewgame 清空哈希表和搜索历史"""
+        await self.send("ucinewgame")
+        await self.is_ready(timeout)
+
+    async def analyse(self, fen: str, depth: Optional[int] = None, movetime: Optional[int] = None,
+                      nodes: Optional[int] = None, infinite: bool = False, multipv: int = 1,
+                      moves: Optional[List[str]] = None, timeout: Optional[float] = None,
+                      on_info: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                      on_go: Optional[Callable[[], None]] = None) -> AnalysisResult:
+        """
+        在给定局面上搜索，直到引擎给出 bestmove。
+        每条 info 行在解析后回调 on_info（用于流式输出）；timeout 秒后发送 stop 提前结束搜索。
+        on_go 在 go 命令发出后回调：引擎会忽略在 go 之前收到的 stop，需要中途停止搜索的调用方
+        应在此之后再调用 stop()。
+        """
+        await self.set_option("MultiPV", multipv)
+        position = f"position fen {fen}"
+        if moves:
+            position += " moves " + " ".join(moves)
+        await self.send(position)
+
+        limits = []
+        if depth is not None:
+            limits.append(f"depth {depth}")
+        if movetime is not None:
+            limits.append(f"movetime {movetime}")
+        if nodes is not None:
+            limits.append(f"nodes {nodes}")
+        if infinite or not limits:
+            limits = ["infinite"] if infinite else ["depth 15"]
+
+        result = AnalysisResult()
+        self._searching = True
+        task = None
+        try:
+            await self.send("go " + " ".join(limits))
+            if on_go is not None:
+                on_go()
+            read = self._read_search(result, on_info)
+            if timeout is None:
+                await read
+            else:
+                task = asyncio.ensure_future(read)
+                done, _ = await asyncio.wait({task}, timeout=timeout)
+                if not done:
+                    # 超出时间预算：让引擎立即给出当前最佳结果
+                    result.stopped = True
+                    await self.stop()
+                    try:
+                        await asyncio.wait_for(task, 5.0)
+                    except asyncio.TimeoutError:
+                        raise EngineError("Engine did not stop after 'stop'.")
+                else:
+                    task.result()
+        finally:
+            self._searching = False
+            # 被取消或出错时不留下继续读取引擎输出的任务
+            if task is not None and not task.done():
+                task.cancel()
+        return result
+
+    async def _read_search(self, result: AnalysisResult, on_info):
+        while True:
+            line = await self._read_line()
+            if line.startswith("info "):
+                info = parse_info(line)
+                result.update(info)
+                if on_info is not None and "pv" in info:
+                    await on_info(info)
+            elif line.startswith("bestmove"):
+                parts = line.split()
+                result.bestmove = parts[1] if len(parts) > 1 and parts[1] != "(none)" else None
+                if len(parts) > 3 and parts[2] == "ponder":
+                    result.ponder = parts[3]
+                return
+
+    async def stop(self):
+        """中止正在进行的搜索（引擎随后输出 bestmove）"""
+        if self._searching and self.alive():
+            await self.send("stop")
+
+    def kill(self):
+        if self.alive():
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+
+    async def quit(self, timeout: float = 2.0):
+        if not self.alive():
+            return
+        try:
+            await self.send("quit")
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except (EngineError, asyncio.TimeoutError):
+            self.kill()
+            await self.process.wait()
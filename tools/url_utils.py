@@ -0,0 +1,64 @@
+"""
+URL helpers shared by the search and crawling tools.
+"""
+
+import fnmatch
+from typing import Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track where a click came from and never change the page content
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "mc_cid", "mc_eid",
+    "igshid", "ref_src", "_ga", "_gl", "spm",
+}
+TRACKING_PREFIXES = ("utm_",)
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Return a canonical form of `url` for deduplication: lower-case scheme and host, no "www." prefix,
+    no default port, fragment or tracking parameters, sorted query string and no trailing slash.
+    Strings that are not absolute http(s) URLs are returned stripped but otherwise unchanged.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS or not parts.hostname:
+        return url
+
+    host = parts.hostname.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if port is not None and port != _DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+
+    path = parts.path.rstrip("/")
+    query = urlencode(sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not _is_tracking_param(name)
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def url_matches(url: str, include: Optional[Iterable[str]] = None, exclude: Optional[Iterable[str]] = None) -> bool:
+    """
+    Glob-style URL filter (fnmatch, case-insensitive), e.g. "*/blog/*" or "*.pdf".
+    A URL passes when it matches any include pattern (or none are given) and no exclude pattern.
+    """
+    url = url.lower()
+    if include and not any(fnmatch.fnmatchcase(url, pattern.lower()) for pattern in include):
+        return False
+    if exclude and any(fnmatch.fnmatchcase(url, pattern.lower()) for pattern in exclude):
+        return False
+    return True
@@ -0,0 +1,287 @@
+"""
+web_scrape：在本地 crawl4ai（Chromium）与远程 Firecrawl 之间路由单页抓取。
+
+按域名记录每个后端最近的延迟和成功率，先把请求发给预期最快的后端；
+若它在该域名延迟分布的某个分位数（默认 p90）之内还没有返回，再向另一个后端发出对冲请求，
+取先成功的结果并取消另一个。首选后端失败时立即改用另一个后端。
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Literal, Optional, Tuple
+from urllib.parse import urlsplit
+
+from pydantic import BaseModel, Field
+
+from .firecrawl_jobs import to_plain
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("crawl4ai", "firecrawl")
+
+# 没有任何统计数据时的后端顺序（默认先用本地浏览器，不消耗 Firecrawl 额度）
+WEB_SCRAPE_DEFAULT_ORDER = [
+    b.strip() for b in os.getenv("WEB_SCRAPE_DEFAULT_ORDER", "crawl4ai,firecrawl").split(",") if b.strip() in BACKENDS
+] or list(BACKENDS)
+# 对冲延迟取首选后端延迟的该分位数，并限制在 [MIN, MAX] 秒内；样本不足时使用 DEFAULT
+WEB_SCRAPE_HEDGE_PERCENTILE = float(os.getenv("WEB_SCRAPE_HEDGE_PERCENTILE", "90"))
+WEB_SCRAPE_HEDGE_MIN_DELAY = float(os.getenv("WEB_SCRAPE_HEDGE_MIN_DELAY", "0.5"))
+WEB_SCRAPE_HEDGE_MAX_DELAY = float(os.getenv("WEB_SCRAPE_HEDGE_MAX_DELAY", "15"))
+WEB_SCRAPE_HEDGE_DEFAULT_DELAY = float(os.getenv("WEB_SCRAPE_HEDGE_DEFAULT_DELAY", "4"))
+# 计算分位数所需的最少样本数；每个 (域名, 后端) 保留的样本数；最多跟踪的域名数
+WEB_SCRAPE_MIN_SAMPLES = int(os.getenv("WEB_SCRAPE_MIN_SAMPLES", "5"))
+WEB_SCRAPE_WINDOW = int(os.getenv("WEB_SCRAPE_WINDOW", "50"))
+WEB_SCRAPE_MAX_DOMAINS = int(os.getenv("WEB_SCRAPE_MAX_DOMAINS", "1000"))
+# 整个请求（含对冲）的超时（秒）
+WEB_SCRAPE_TIMEOUT = float(os.getenv("WEB_SCRAPE_TIMEOUT", "120"))
+
+
+class BackendStats:
+    """一个后端在某个域名（或全局）上最近的成功延迟与成败记录"""
+
+    def __init__(self, window: int = WEB_SCRAPE_WINDOW):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+
+    def record(self, success: bool, latency: float):
+        self.outcomes.append(success)
+        if success:
+            self.latencies.append(latency)
+
+    def record_cancelled(self, elapsed: float):
+        """对冲中输掉而被取消的请求：真实延迟至少为 elapsed，记为延迟样本（不计成败）"""
+        self.latencies.append(elapsed)
+
+    @property
+    def samples(self) -> int:
+        return len(self.outcomes)
+
+    @property
+    def success_rate(self) -> float:
+        # 加一平滑：少量失败不会让后端被完全放弃
+        return (sum(self.outcomes) + 1) / (len(self.outcomes) + 2)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.latencies) < WEB_SCRAPE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+        return ordered[index]
+
+    def expected_cost(self) -> Optional[float]:
+        """用于排序的预期耗时：中位延迟除以成功率；样本不足时为 None"""
+        median = self.percentile(50)
+        return median / self.success_rate if median is not None else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "success_rate": round(self.success_rate, 3),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+        }
+
+
+class WebScrapeInput(BaseModel):
+    url: str = Field(description="The URL of the page to scrape to markdown.")
+    hedge: bool = Field(
+        default=True,
+        description="Send a second request to the other backend if the first is slower than usual for this domain."
+    )
+    prefer: Optional[Literal['crawl4ai', 'firecrawl']] = Field(
+        default=None, description="Force the first backend instead of choosing by observed latency."
+    )
+    timeout: float = Field(
+        default=WEB_SCRAPE_TIMEOUT, gt=0, le=WEB_SCRAPE_TIMEOUT, description="Overall time limit in seconds."
+    )
+
+
+class WebScrapeRouter:
+    name = "web_scrape"
+    description = (
+        "Scrapes a single URL to markdown using whichever backend (local crawl4ai browser or remote Firecrawl) "
+        "is fastest for that domain, with a hedged request to the other backend when the first one is slow."
+    )
+    input_schema = WebScrapeInput
+
+    def __init__(self):
+        # 后端工具实例，由 tool_registry 在初始化时绑定
+        self.tools: Dict[str, Any] = {}
+        self._domains: "OrderedDict[str, Dict[str, BackendStats]]" = OrderedDict()
+        self._global: Dict[str, BackendStats] = {backend: BackendStats(WEB_SCRAPE_WINDOW * 4) for backend in BACKENDS}
+
+    def bind(self, tools: Dict[str, Any]):
+        self.tools = tools
+
+    # --- 统计 ---
+    def _domain_stats(self, domain: str) -> Dict[str, BackendStats]:
+        stats = self._domains.get(domain)
+        if stats is None:
+            stats = {backend: BackendStats() for backend in BACKENDS}
+            self._domains[domain] = stats
+            while len(self._domains) > WEB_SCRAPE_MAX_DOMAINS:
+                self._domains.popitem(last=False)
+        self._domains.move_to_end(domain)
+        return stats
+
+    def _record(self, domain: str, backend: str, success: bool, latency: float):
+        self._domain_stats(domain)[backend].record(success, latency)
+        self._global[backend].record(success, latency)
+        metrics.counter("web_scrape_attempts_total", backend=backend, result="ok" if success else "error").inc()
+        if success:
+            metrics.histogram("web_scrape_latency_seconds", backend=backend).observe(latency)
+
+    def _record_cancelled(self, domain: str, backend: str, elapsed: float):
+        self._domain_stats(domain)[backend].record_cancelled(elapsed)
+        self._global[backend].record_cancelled(elapsed)
+        metrics.counter("web_scrape_attempts_total", backend=backend, result="cancelled").inc()
+
+    def _order(self, domain: str, available: List[str], prefer: Optional[str]) -> List[str]:
+        """按预期耗时排序（先看该域名，样本不足时看全局）；都没有数据时使用默认顺序"""
+        if prefer in available:
+            return [prefer] + [b for b in available if b != prefer]
+        stats = self._domain_stats(domain)
+
+        def cost(backend: str) -> Tuple[int, float, int]:
+            for level, source in enumerate((stats[backend], self._global[backend])):
+                value = source.expected_cost()
+                if value is not None:
+                    return (level, value, WEB_SCRAPE_DEFAULT_ORDER.index(backend))
+            return (2, 0.0, WEB_SCRAPE_DEFAULT_ORDER.index(backend))
+
+        return sorted(available, key=cost)
+
+    def _hedge_delay(self, domain: str, backend: str) -> float:
+        delay = self._domain_stats(domain)[backend].percentile(WEB_SCRAPE_HEDGE_PERCENTILE)
+        if delay is None:
+            delay = self._global[backend].percentile(WEB_SCRAPE_HEDGE_PERCENTILE)
+        if delay is None:
+            delay = WEB_SCRAPE_HEDGE_DEFAULT_DELAY
+        return min(WEB_SCRAPE_HEDGE_MAX_DELAY, max(WEB_SCRAPE_HEDGE_MIN_DELAY, delay))
+
+    # --- 后端调用 ---
+    async def _scrape(self, backend: str, url: str) -> Dict[str, Any]:
+        """调用后端工具并把结果统一为 {"markdown", "title", "status_code"}；失败时抛出 RuntimeError"""
+        tool = self.tools[backend]
+        if backend == "crawl4ai":
+            result = await tool.execute(tool.input_schema(mode="scrape", parameters={"url": url}))
+            if not result.get("success"):
+                raise RuntimeError(result.get("error") or "crawl4ai scrape failed")
+            metadata = result.get("metadata") or {}
+            return {
+                "markdown": result.get("content", ""),
+                "title": metadata.get("title"),
+                "status_code": metadata.get("status_code"),
+            }
+        result = await tool.execute(tool.input_schema(mode="scrape", parameters={"url": url, "formats": ["markdown"]}))
+        if not result.get("success"):
+            raise RuntimeError(result.get("error") or "firecrawl scrape failed")
+        data = to_plain(result.get("data")) or {}
+        metadata = data.get("metadata") or {}
+        markdown = data.get("markdown") or ""
+        if not markdown.strip():
+            raise RuntimeError("firecrawl returned no content")
+        return {
+            "markdown": markdown,
+            "title": metadata.get("title"),
+            "status_code": metadata.get("statusCode") or metadata.get("status_code"),
+        }
+
+    async def _attempt(self, backend: str, url: str) -> Tuple[bool, Any, float]:
+        """返回 (是否成功, 结果或错误信息, 耗时)；取消会向上传播"""
+        started = time.monotonic()
+        try:
+            page = await self._scrape(backend, url)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return False, str(e), time.monotonic() - started
+        return True, page, time.monotonic() - started
+
+    async def execute(self, parameters: WebScrapeInput) -> dict:
+        url = parameters.url
+        domain = (urlsplit(url).hostname or "").lower()
+        if domain.startswith("www."):
+            domain = domain[4:]
+        available = [backend for backend in BACKENDS if backend in self.tools]
+        if not available:
+            return {"success": False, "error": "No scrape backend (crawl4ai or firecrawl) is available."}
+
+        order = self._order(domain, available, parameters.prefer)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + parameters.timeout
+        hedge_at = loop.time() + self._hedge_delay(domain, order[0]) if parameters.hedge else None
+        waiting = list(order)
+        running: Dict[asyncio.Task, str] = {}
+        started: Dict[asyncio.Task, float] = {}
+        attempts: List[Dict[str, Any]] = []
+        hedged = False
+
+        def launch():
+            backend = waiting.pop(0)
+            task = asyncio.create_task(self._attempt(backend, url))
+            running[task] = backend
+            started[task] = loop.time()
+
+        launch()
+        try:
+            while running:
+                timeout = deadline - loop.time()
+                if waiting and hedge_at is not None:
+                    timeout = min(timeout, hedge_at - loop.time())
+                done, _ = await asyncio.wait(running, timeout=max(0.0, timeout), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if loop.time() >= deadline:
+                        break
+                    # 首选后端比平时慢：对冲
+                    hedged = True
+                    hedge_at = None
+                    metrics.counter("web_scrape_hedges_total", backend=waiting[0]).inc()
+                    launch()
+                    continue
+                for task in done:
+                    backend = running.pop(task)
+                    success, value, elapsed = task.result()
+                    self._record(domain, backend, success, elapsed)
+                    if success:
+                        attempts.append({"backend": backend, "status": "won", "latency_ms": round(elapsed * 1000)})
+                        if hedged:
+                            metrics.counter("web_scrape_hedge_wins_total", backend=backend).inc()
+                        # 输掉的请求也要计入统计：变慢或卡住的后端不能一直保留原来的低延迟而排在前面
+                        for other_task, other in running.items():
+                            self._record_cancelled(domain, other, loop.time() - started[other_task])
+                            attempts.append({"backend": other, "status": "cancelled"})
+                        return {
+                            "success": True,
+                            "data": {
+                                "url": url,
+                                "backend": backend,
+                                "hedged": hedged,
+                                "latency_ms": round(elapsed * 1000),
+                                **value,
+                                "attempts": attempts,
+                            },
+                        }
+                    attempts.append({"backend": backend, "status": "failed", "error": value})
+                # 没有请求在运行时（都失败了），立即改用下一个后端
+                if not running and waiting:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+
+        for task, backend in running.items():
+            self._record(domain, backend, False, loop.time() - started[task])
+            attempts.append({"backend": backend, "status": "timeout"})
+        error = "; ".join(f"{a['backend']}: {a.get('error', a['status'])}" for a in attempts)
+        return {"success": False, "error": f"All scrape backends failed for {url}: {error}", "attempts": attempts}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "global": {backend: stats.snapshot() for backend, stats in self._global.items()},
+            "domains": len(self._domains),
+        }